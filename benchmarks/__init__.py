@@ -0,0 +1,9 @@
+"""
+Benchmarks of the converter library, run against a real ffmpeg.
+
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --output after.json
+    python -m benchmarks.compare before.json after.json
+
+    python -m benchmarks.scalers source.mp4
+"""
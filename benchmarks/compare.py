@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Compare two results files of benchmarks.suite.
+
+Every measure present in both files is printed with its change, measures
+worse by more than --threshold (in percent) are flagged as regressions
+and make the exit status 1:
+
+    python -m benchmarks.compare before.json after.json --threshold 5
+"""
+
+import argparse
+import json
+import sys
+
+
+def compare(before, after, threshold):
+    """
+    Return the (name, before, after, change in percent, regression)
+    tuples of the measures of both results, sorted by name. The change is
+    positive when the measure got better.
+    """
+    rows = []
+    for name in sorted(set(before) & set(after)):
+        old, new = before[name]['value'], after[name]['value']
+        if not old:
+            continue
+        change = (new - old) / float(old) * 100
+        if not after[name]['higher_is_better']:
+            change = -change
+        rows.append((name, old, new, change, change < -threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10.0, help='tolerated regression in percent')
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before['meta'].get('ffmpeg') != after['meta'].get('ffmpeg') or \
+            before['meta'].get('host') != after['meta'].get('host'):
+        print('warning: the results come from different hosts or ffmpeg versions')
+
+    rows = compare(before['results'], after['results'], args.threshold)
+    for name, old, new, change, regression in rows:
+        print('%-50s %14.4f %14.4f %+8.1f%%%s' % (name, old, new, change, '  REGRESSION' if regression else ''))
+    if any(regression for _, _, _, _, regression in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
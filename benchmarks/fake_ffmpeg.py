@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+Stand-in for the ffmpeg and ffprobe binaries, replaying a recording.
+
+The same script plays both: called with -show_format (as FFMpeg.probe
+does) it prints the recorded ffprobe output, otherwise it writes the
+recorded ffmpeg stderr at the recorded pace, divided by the speed, and
+creates the output file. With -benchmark or -benchmark_all, made-up
+bench: lines follow, in the format of ffmpeg. Like the output of ffmpeg
+run by FFMpeg.convert, the synthetic output has the level of each
+message (-loglevel level+info). This measures the Python side of the wrapper
+(reading and parsing the ffmpeg output, the progress loop) without
+codecs and without the noise of a real encoder.
+
+It is configured with environment variables, ffmpeg arguments being
+taken as they are:
+  * FAKE_FFMPEG_RECORDING - JSON recording file (see record()), a
+    synthetic one is used by default
+  * FAKE_FFMPEG_SPEED - replay speed, 0 (the default) for no pauses
+
+    FFMpeg(ffmpeg_path='benchmarks/fake_ffmpeg.py', ffprobe_path='benchmarks/fake_ffmpeg.py')
+
+A recording of a real conversion is made with:
+
+    python -m benchmarks.fake_ffmpeg --record recording.json source.mp4 -- -codec:v libx264 -f matroska
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+BANNER = """ffmpeg version 6.1 Copyright (c) 2000-2023 the FFmpeg developers
+  built with gcc 12 (Debian 12.2.0-14)
+Input #0, mov,mp4,m4a,3gp,3g2,mj2, from 'source.mp4':
+  Duration: %(time)s, start: 0.000000, bitrate: 2200 kb/s
+  Stream #0:0[0x1](und): Video: h264 (High) (avc1 / 0x31637661), yuv420p(progressive), 1280x720, 2000 kb/s, %(fps)d fps
+  Stream #0:1[0x2](und): Audio: aac (LC) (mp4a / 0x6134706D), 48000 Hz, stereo, fltp, 128 kb/s
+Stream mapping:
+  Stream #0:0 -> #0:0 (h264 (native) -> h264 (libx264))
+  Stream #0:1 -> #0:1 (aac (native) -> aac (native))
+Press [q] to stop, [?] for help
+Output #0, matroska, to 'output.mkv':
+  Stream #0:0: Video: h264, yuv420p(progressive), 1280x720, q=2-31, %(fps)d fps, 1k tbn
+  Stream #0:1: Audio: aac (LC), 48000 Hz, stereo, fltp, 128 kb/s
+"""
+
+PROBE = """[STREAM]
+index=0
+codec_name=h264
+codec_type=video
+width=1280
+height=720
+pix_fmt=yuv420p
+r_frame_rate=%(fps)d/1
+avg_frame_rate=%(fps)d/1
+duration=%(duration).6f
+bit_rate=2000000
+nb_frames=%(frames)d
+[/STREAM]
+[STREAM]
+index=1
+codec_name=aac
+codec_type=audio
+sample_rate=48000
+channels=2
+duration=%(duration).6f
+bit_rate=128000
+[/STREAM]
+[FORMAT]
+filename=source.mp4
+nb_streams=2
+format_name=mov,mp4,m4a,3gp,3g2,mj2
+duration=%(duration).6f
+size=%(size)d
+bit_rate=2200000
+[/FORMAT]
+"""
+
+
+def timespec(seconds):
+    return '%02d:%02d:%05.2f' % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def synthetic(duration=60.0, fps=25, encoding_speed=4.0, updates_per_second=2):
+    """
+    Return a recording of the conversion of a duration seconds video,
+    ffmpeg reporting its progress updates_per_second times per second
+    while encoding encoding_speed times faster than real time.
+    """
+    values = {'time': timespec(duration), 'fps': fps, 'duration': duration,
+              'frames': int(duration * fps), 'size': int(duration * 275000)}
+    stderr = [[0.0, ''.join('[info] %s\n' % line for line in (BANNER % values).splitlines())]]
+    elapsed = 0.0
+    while True:
+        elapsed += 1.0 / updates_per_second
+        position = min(duration, elapsed * encoding_speed)
+        stderr.append([elapsed, '[info] frame=%5d fps=%3d q=28.0 size=%8dkB time=%s bitrate=2200.0kbits/s speed=%.3gx    \r' % (
+            position * fps, fps * encoding_speed, position * 275, timespec(position), encoding_speed)])
+        if position >= duration:
+            break
+    stderr.append([elapsed, '\n[info] video:%dkB audio:%dkB subtitle:0kB other streams:0kB global headers:0kB '
+                            'muxing overhead: 0.1%%\n' % (duration * 250, duration * 16)])
+    return {'probe': PROBE % values, 'stderr': stderr, 'returncode': 0}
+
+
+def record(ffmpeg_path, ffprobe_path, source, arguments, output):
+    """
+    Return the recording of the probe of source and of its conversion
+    with the ffmpeg arguments to output.
+    """
+    probe = subprocess.run([ffprobe_path, '-hide_banner', '-show_format', '-show_streams', '-show_error', source],
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.decode('utf-8', 'replace')
+    cmd = [ffmpeg_path, '-hide_banner', '-loglevel', 'level+info', '-y', '-i', source] + arguments + [output]
+    p = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    start = time.time()
+    stderr = []
+    while True:
+        data = os.read(p.stderr.fileno(), 4096)
+        if not data:
+            break
+        stderr.append([time.time() - start, data.decode('utf-8', 'replace')])
+    p.wait()
+    return {'probe': probe, 'stderr': stderr, 'returncode': p.returncode}
+
+
+def replay(recording, argv, speed):
+    if '-show_format' in argv:
+        sys.stdout.write(recording['probe'])
+        return 0
+
+    output = argv[-1] if argv else None
+    if output and not output.startswith('pipe:') and output != '-':
+        open(output, 'wb').close()
+
+    start = time.time()
+    for offset, data in recording['stderr']:
+        if speed:
+            delay = start + offset / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        sys.stderr.write(data)
+        sys.stderr.flush()
+    if '-benchmark_all' in argv:
+        for stage in ('decode_video 0.0', 'encode_video 0.0', 'decode_audio 0.1', 'encode_audio 0.1'):
+            sys.stderr.write('[info] bench:     1000 user        0 sys     1200 real %s \n' % stage)
+    if '-benchmark' in argv or '-benchmark_all' in argv:
+        sys.stderr.write('[info] bench: utime=0.004s stime=0.001s rtime=%.3fs\n[info] bench: maxrss=20480KiB\n' % (
+            time.time() - start))
+    return recording['returncode']
+
+
+def main():
+    if '--record' not in sys.argv[1:2]:
+        path = os.environ.get('FAKE_FFMPEG_RECORDING')
+        if path:
+            with open(path) as f:
+                recording = json.load(f)
+        else:
+            recording = synthetic()
+        sys.exit(replay(recording, sys.argv[1:], float(os.environ.get('FAKE_FFMPEG_SPEED', 0))))
+
+    parser = argparse.ArgumentParser(description='Record a conversion for the fake ffmpeg.')
+    parser.add_argument('--record', required=True, metavar='RECORDING', help='JSON recording file to write')
+    parser.add_argument('--ffmpeg', default='ffmpeg')
+    parser.add_argument('--ffprobe', default='ffprobe')
+    parser.add_argument('--output', default=os.devnull, help='where the recorded conversion writes its output')
+    parser.add_argument('source')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help='ffmpeg output arguments, after --')
+    args = parser.parse_args()
+    arguments = args.arguments[1:] if args.arguments[:1] == ['--'] else args.arguments
+    with open(args.record, 'w') as f:
+        json.dump(record(args.ffmpeg, args.ffprobe, args.source, arguments, args.output), f)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Compare the throughput and the quality of the scaling algorithms.
+
+The source is downscaled with each scaler, with the same (near lossless)
+encoder settings so that the scaler makes the difference. The quality is
+the SSIM of the rendition scaled back to the source size, compared with
+the source.
+
+    python -m benchmarks.scalers source.mp4 --width 640 --height 360
+"""
+
+import argparse
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from converter import Converter
+from converter.codecs.video import VideoCodec
+
+
+def ssim(c, rendition, source, width, height):
+    graph = '[0:v:0]scale=%d:%d:flags=bicubic[up];[up][1:v:0]ssim' % (width, height)
+    p = c.ffmpeg._spawn([c.ffmpeg.ffmpeg_path, '-hide_banner', '-i', rendition, '-i', source,
+                         '-lavfi', graph, '-f', 'null', '-'])
+    _, stderr_data = p.communicate()
+    match = re.search(r'All:([0-9.]+)', stderr_data.decode('utf-8', 'replace'))
+    return float(match.group(1)) if match else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('source')
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=360)
+    parser.add_argument('--scalers', nargs='+', default=list(VideoCodec.scalers))
+    parser.add_argument('--filter-threads', type=int)
+    args = parser.parse_args()
+
+    c = Converter()
+    info = c.probe(args.source)
+    if info is None or not info.video:
+        parser.error('%s has no video stream' % args.source)
+
+    work_dir = tempfile.mkdtemp(prefix='scalers-')
+    try:
+        print('%-14s %10s %8s %8s' % ('scaler', 'seconds', 'speed', 'ssim'))
+        for scaler in args.scalers:
+            rendition = os.path.join(work_dir, scaler + '.mkv')
+            options = {
+                'format': 'mkv',
+                'video': {
+                    'codec': 'h264', 'preset': 'ultrafast', 'quality': 10,
+                    'width': args.width, 'height': args.height, 'scaler': scaler,
+                    'filter_threads': args.filter_threads,
+                },
+            }
+            start = time.time()
+            for _ in c.convert(args.source, rendition, options):
+                pass
+            elapsed = time.time() - start
+            quality = ssim(c, rendition, args.source, info.video.video_width, info.video.video_height)
+            print('%-14s %10.2f %7.1fx %8s' % (
+                scaler, elapsed, info.format.duration / elapsed, '%.5f' % quality if quality else '-'))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
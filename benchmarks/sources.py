@@ -0,0 +1,43 @@
+"""
+Deterministic synthetic sources generated with the lavfi filters: the
+testsrc2 pattern and a sine tone, encoded bit-exactly so that every run
+(and every host with the same ffmpeg) benchmarks the same bytes.
+"""
+
+import os
+
+# name -> (width, height)
+RESOLUTIONS = {
+    '360p': (640, 360),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+}
+
+
+def generate(ffmpeg, directory, resolution, duration, fps=25):
+    """
+    Return the path of the source of resolution (a RESOLUTIONS name) and
+    duration seconds, generating it in directory if it doesn't exist yet.
+    """
+    width, height = RESOLUTIONS[resolution]
+    path = os.path.join(directory, 'testsrc2-%s-%ds-%dfps.mp4' % (resolution, duration, fps))
+    if os.path.exists(path):
+        return path
+
+    tmp_path = path + '.part'
+    p = ffmpeg._start([
+        ffmpeg.ffmpeg_path, '-hide_banner', '-y', '-nostdin',
+        '-f', 'lavfi', '-i', 'testsrc2=size=%dx%d:rate=%d:duration=%d' % (width, height, fps, duration),
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000:duration=%d' % duration,
+        '-map', '0:v', '-map', '1:a',
+        # one thread and bitexact flags: the same bytes on every run
+        '-codec:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-threads', '1', '-g', str(fps * 2),
+        '-pix_fmt', 'yuv420p', '-codec:a', 'aac', '-b:a', '128k',
+        '-fflags', '+bitexact', '-flags:v', '+bitexact', '-flags:a', '+bitexact',
+        '-movflags', 'faststart', '-f', 'mp4', tmp_path], 'benchmark_source')
+    _, stderr_data = p.communicate()
+    ffmpeg._exited(p)
+    if p.returncode:
+        raise RuntimeError('Could not generate %s: %s' % (path, stderr_data.decode('utf-8', 'replace')[-1000:]))
+    os.rename(tmp_path, path)
+    return path
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""
+Measure the throughput of the converter on synthetic sources.
+
+The sources are generated once (see benchmarks.sources) in the work
+directory. Every measure is the median of --repeat runs, and the results
+are written as JSON, to be compared with benchmarks.compare:
+
+    python -m benchmarks.suite --resolutions 360p 720p --output results.json
+
+Measures:
+  * probe/<resolution>/seconds - latency of Converter.probe
+  * parse/microseconds - Converter.parse_options time for usual options
+  * convert/<codec>/<preset>/<resolution>/fps - encoded frames per second
+  * convert/<codec>/<preset>/<resolution>/cpu_ratio - CPU seconds of ffmpeg
+    per media second
+  * thumbnails/<resolution>/per_second - thumbnails extracted per second
+  * segment/<resolution>/speed - media seconds segmented per second
+  * overhead/python_cpu_seconds - CPU time of the Python process per job
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+# modify the path so that parent directory is in it
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+from benchmarks.sources import RESOLUTIONS, generate  # NOQA
+from converter import Converter  # NOQA
+from converter.capabilities import Capabilities  # NOQA
+
+
+class Results(object):
+
+    def __init__(self):
+        self.values = {}
+
+    def add(self, name, value, unit, higher_is_better):
+        self.values[name] = {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+        print('%-50s %14.4f %s' % (name, value, unit))
+
+
+def median_of(repeat, measure):
+    return statistics.median(measure() for _ in range(repeat))
+
+
+def bench_probe(c, source, resolution, repeat, results):
+    def measure():
+        start = time.time()
+        c.probe(source)
+        return time.time() - start
+    results.add('probe/%s/seconds' % resolution, median_of(repeat, measure), 's', False)
+
+
+def bench_parse(c, repeat, results):
+    options = [
+        {'format': 'mp4', 'audio': {'codec': 'aac', 'bitrate': 128, 'channels': 2},
+         'video': {'codec': 'h264', 'width': 1280, 'height': 720, 'fps': 25, 'bitrate': 3000,
+                   'src_width': 1920, 'src_height': 1080, 'mode': 'pad', 'profile': 'high', 'preset': 'fast'}},
+        {'format': 'webm', 'audio': {'codec': 'vorbis'},
+         'video': {'codec': 'vp9', 'width': 640, 'src_width': 1920, 'src_height': 1080, 'quality': 32}},
+    ]
+    loops = 1000
+
+    def measure():
+        return timeit.timeit(lambda: [c.parse_options(opt) for opt in options], number=loops)
+    results.add('parse/microseconds', median_of(repeat, measure) / loops / len(options) * 1e6, 'us', False)
+
+
+def bench_convert(c, source, resolution, duration, fps, codec, preset, repeat, work_dir, results):
+    output = os.path.join(work_dir, 'convert.mkv')
+    video = {'codec': codec}
+    if preset is not None:
+        video['preset'] = preset
+    options = {'format': 'mkv', 'video': video, 'audio': {'codec': 'aac'}}
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        for _ in c.convert(source, output, options, timeout=None):
+            pass
+        timings.append((time.time() - start, c.last_report.total_usage.cpu_time))
+        os.unlink(output)
+    elapsed = statistics.median(wall for wall, _ in timings)
+    cpu = statistics.median(cpu for _, cpu in timings)
+    name = 'convert/%s/%s/%s' % (codec, preset, resolution)
+    results.add(name + '/fps', duration * fps / elapsed, 'frames/s', True)
+    results.add(name + '/cpu_ratio', cpu / duration, 'cpu s/media s', False)
+
+
+def bench_thumbnails(c, source, resolution, duration, repeat, work_dir, results):
+    count = 10
+    option_list = [(duration * (index + 0.5) / count, os.path.join(work_dir, 'thumb%d.jpg' % index))
+                   for index in range(count)]
+
+    def measure():
+        start = time.time()
+        c.thumbnails(source, option_list)
+        return time.time() - start
+    results.add('thumbnails/%s/per_second' % resolution, count / median_of(repeat, measure), 'thumbnails/s', True)
+
+
+def bench_segment(c, source, resolution, duration, repeat, work_dir, results):
+    def measure():
+        segment_dir = tempfile.mkdtemp(dir=work_dir)
+        start = time.time()
+        for _ in c.segment(source, segment_dir, 'playlist.m3u8', 'segments', [{'segment_time': 2}], timeout=None):
+            pass
+        elapsed = time.time() - start
+        shutil.rmtree(segment_dir)
+        return elapsed
+    results.add('segment/%s/speed' % resolution, duration / median_of(repeat, measure), 'x', True)
+
+
+def bench_overhead(c, source, repeat, work_dir, results):
+    # CPU time spent by the Python side of a job (probing, parsing the
+    # options and the ffmpeg output), ffmpeg itself not included
+    output = os.path.join(work_dir, 'overhead.mkv')
+    options = {'format': 'mkv', 'video': {'codec': 'h264', 'preset': 'ultrafast'}, 'audio': {'codec': 'aac'}}
+
+    def measure():
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        for _ in c.convert(source, output, options, timeout=None):
+            pass
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        os.unlink(output)
+        return after.ru_utime - before.ru_utime + after.ru_stime - before.ru_stime
+    results.add('overhead/python_cpu_seconds', median_of(repeat, measure), 's', False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--output', help='JSON results file')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'converter-benchmarks'),
+                        help='where the sources are generated and kept')
+    parser.add_argument('--resolutions', nargs='+', default=['360p', '720p'], choices=sorted(RESOLUTIONS))
+    parser.add_argument('--duration', type=int, default=10, help='source duration in seconds')
+    parser.add_argument('--fps', type=int, default=25)
+    parser.add_argument('--codecs', nargs='+', default=['h264', 'h265', 'vp9', 'av1'])
+    parser.add_argument('--presets', nargs='+',
+                        help='presets to measure (default: the fastest and a middle one of each codec)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--ffmpeg')
+    parser.add_argument('--ffprobe')
+    args = parser.parse_args()
+
+    c = Converter(ffmpeg_path=args.ffmpeg, ffprobe_path=args.ffprobe)
+    capabilities = Capabilities(c.ffmpeg)
+    if not os.path.isdir(args.work_dir):
+        os.makedirs(args.work_dir)
+    scratch_dir = tempfile.mkdtemp(dir=args.work_dir)
+
+    results = Results()
+    try:
+        bench_parse(c, args.repeat, results)
+        for resolution in args.resolutions:
+            source = generate(c.ffmpeg, args.work_dir, resolution, args.duration, args.fps)
+            bench_probe(c, source, resolution, args.repeat, results)
+            for codec in args.codecs:
+                codec_class = c.video_codecs.get(codec)
+                if codec_class is None or codec_class.ffmpeg_codec_name not in capabilities.encoders:
+                    print('%s: not supported by %s, skipped' % (codec, c.ffmpeg.ffmpeg_path))
+                    continue
+                presets = codec_class.presets
+                if args.presets:
+                    presets = [preset for preset in presets if str(preset) in args.presets]
+                elif presets:
+                    presets = [presets[0], presets[len(presets) // 2]]
+                for preset in presets or [None]:
+                    bench_convert(c, source, resolution, args.duration, args.fps, codec, preset, args.repeat,
+                                  scratch_dir, results)
+            bench_thumbnails(c, source, resolution, args.duration, args.repeat, scratch_dir, results)
+            bench_segment(c, source, resolution, args.duration, args.repeat, scratch_dir, results)
+        bench_overhead(c, generate(c.ffmpeg, args.work_dir, '360p', 2, args.fps), args.repeat, scratch_dir, results)
+    finally:
+        shutil.rmtree(scratch_dir)
+
+    document = {
+        'meta': {
+            'time': time.time(),
+            'host': socket.gethostname(),
+            'cpu_count': multiprocessing.cpu_count(),
+            'python': platform.python_version(),
+            'ffmpeg': capabilities.version,
+            'arguments': vars(args),
+        },
+        'results': results.values,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Measure the Python side of the wrapper against the fake ffmpeg.
+
+ffmpeg and ffprobe are replaced by benchmarks/fake_ffmpeg.py, replaying
+a recording (a synthetic one by default) as fast as possible, so the
+measures only depend on the wrapper: the CPU time of the Python process
+reading and parsing the ffmpeg output, and of the progress loop. No codec
+is needed, the results are written as JSON like benchmarks.suite:
+
+    python -m benchmarks.wrapper --output results.json
+
+Measures:
+  * wrapper/probe_parse/microseconds - MediaInfo.parse_ffprobe time
+  * wrapper/ffmpeg_convert/cpu_seconds - FFMpeg.convert CPU time per job
+  * wrapper/ffmpeg_convert/progress_microseconds - CPU time per progress
+    update
+  * wrapper/converter_convert/cpu_seconds - Converter.convert CPU time per
+    job (probe and options included)
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import timeit
+
+# modify the path so that parent directory is in it
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+from benchmarks import fake_ffmpeg  # NOQA
+from benchmarks.suite import Results, median_of  # NOQA
+from converter import Converter  # NOQA
+from converter.ffmpeg import MediaInfo  # NOQA
+
+
+def cpu_time(function):
+    # CPU time of this process (the fake ffmpeg processes not included)
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    function()
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    return after.ru_utime - before.ru_utime + after.ru_stime - before.ru_stime
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--output', help='JSON results file')
+    parser.add_argument('--recording', help='recording to replay (see benchmarks.fake_ffmpeg), '
+                                            'a synthetic one by default')
+    parser.add_argument('--duration', type=float, default=3600, help='duration of the synthetic recording')
+    parser.add_argument('--updates-per-second', type=int, default=8,
+                        help='progress updates per second of the synthetic recording')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='wrapper-')
+    try:
+        recording_path = args.recording
+        if recording_path is None:
+            recording_path = os.path.join(work_dir, 'recording.json')
+            with open(recording_path, 'w') as f:
+                json.dump(fake_ffmpeg.synthetic(args.duration, updates_per_second=args.updates_per_second), f)
+        with open(recording_path) as f:
+            recording = json.load(f)
+        # inherited by the fake ffmpeg processes
+        os.environ['FAKE_FFMPEG_RECORDING'] = recording_path
+        os.environ['FAKE_FFMPEG_SPEED'] = '0'
+
+        fake = os.path.join(current_dir, 'fake_ffmpeg.py')
+        c = Converter(ffmpeg_path=fake, ffprobe_path=fake)
+        source = recording_path  # any existing file, the fake doesn't read it
+        output = os.path.join(work_dir, 'output.mkv')
+        results = Results()
+
+        loops = 1000
+
+        def parse():
+            return timeit.timeit(lambda: MediaInfo().parse_ffprobe(recording['probe']), number=loops)
+        results.add('wrapper/probe_parse/microseconds', median_of(args.repeat, parse) / loops * 1e6, 'us', False)
+
+        updates = []
+
+        def ffmpeg_convert():
+            del updates[:]
+            updates.extend(c.ffmpeg.convert(source, [output], [['-f', 'matroska']], timeout=None))
+        seconds = median_of(args.repeat, lambda: cpu_time(ffmpeg_convert))
+        results.add('wrapper/ffmpeg_convert/cpu_seconds', seconds, 's', False)
+        if updates:
+            results.add('wrapper/ffmpeg_convert/progress_microseconds', seconds / len(updates) * 1e6, 'us', False)
+
+        options = {'format': 'mkv', 'video': {'codec': 'h264', 'width': 640}, 'audio': {'codec': 'aac'}}
+
+        def converter_convert():
+            for _ in c.convert(source, output, options, timeout=None):
+                pass
+        results.add('wrapper/converter_convert/cpu_seconds',
+                    median_of(args.repeat, lambda: cpu_time(converter_convert)), 's', False)
+    finally:
+        shutil.rmtree(work_dir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': {'recording': args.recording, 'duration': args.duration,
+                                'updates_per_second': args.updates_per_second},
+                       'results': results.values}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,20 @@
 import errno
 import logging
 import os
+import time
 import warnings
+from converter.branding import Branding, BumperCache
+from converter.calibration import PresetCalibration
+from converter.capabilities import Capabilities
 from converter.codecs import codec_lists
-from converter.ffmpeg import FFMpeg
+from converter.composition import Composition
+from converter.ffmpeg import ArgumentError, FFMpeg
+from converter.filters import graph_filters, splice_video_filters
+from converter.pipes import PipeInput, PipeOutput
 from converter.formats import format_list
+from converter.log import FFMpegLog
+from converter.report import BenchmarkStats, ConversionReport
+from converter.scratch import ScratchSpace
 
 logger = logging.getLogger(__name__)
 
@@ -22,10 +32,35 @@ class Converter(object):
     >>> c = Converter()
     """
 
-    def __init__(self, ffmpeg_path=None, ffprobe_path=None):
-        """Initialize a new Converter object."""
+    def __init__(self, ffmpeg_path=None, ffprobe_path=None, check_capabilities=False, capabilities_cache_dir=None,
+                 calibration_cache_dir=None, scratch_dir=None, stager=None, instrumentation=None):
+        """
+        Initialize a new Converter object.
+
+        With check_capabilities, the encoders, filters, pixel formats and
+        muxers of the ffmpeg binary are listed (once, see Capabilities) and options
+        it does not support are rejected, or replaced by the codec
+        fallback, before ffmpeg is run.
+
+        calibration_cache_dir is where the preset throughputs used for the
+        target_speed video option are kept, see PresetCalibration.
+
+        With a scratch_dir (eg. a local disk or a tmpfs), the outputs of
+        convert, compose and segment are written there, and moved to
+        their path only once ffmpeg succeeded, see ScratchSpace.
+
+        With a stager (a staging.InputStager), convert reads its input
+        from a local copy.
+
+        instrumentation is an instrumentation.Instrumentation (or a list
+        of them) told about every ffmpeg and ffprobe process, see
+        instrumentation.PrometheusExporter.
+        """
         self.ffmpeg = FFMpeg(
-            ffmpeg_path=ffmpeg_path, ffprobe_path=ffprobe_path)
+            ffmpeg_path=ffmpeg_path, ffprobe_path=ffprobe_path, instrumentation=instrumentation)
+        self.capabilities = None
+        if check_capabilities:
+            self.capabilities = Capabilities(self.ffmpeg, capabilities_cache_dir)
         self.video_codecs = {}
         self.audio_codecs = {}
         self.subtitle_codecs = {}
@@ -47,6 +82,13 @@ class Converter(object):
             name = cls.format_name
             self.formats[name] = cls
 
+        self._bumper_infos = {}
+        self.last_report = None
+        self.calibration_cache_dir = calibration_cache_dir
+        self.scratch_dir = scratch_dir
+        self.stager = stager
+        self._calibration = None
+
     def parse_options(self, opt, twopass=None):
         """Parse format/codec options and prepare raw ffmpeg option list."""
         if not isinstance(opt, dict):
@@ -58,6 +100,8 @@ class Converter(object):
         f = opt['format']
         if f not in self.formats:
             raise ConverterError('Requested unknown format: ' + str(f))
+        if self.capabilities and self.formats[f].ffmpeg_format_name not in self.capabilities.muxers:
+            raise ConverterError('Requested format %s is not supported by %s' % (f, self.ffmpeg.ffmpeg_path))
 
         format_options = self.formats[f]().parse_options(opt)
         if format_options is None:
@@ -77,6 +121,8 @@ class Converter(object):
         c = opt_audio['codec']
         if c not in self.audio_codecs:
             raise ConverterError('Requested unknown audio codec ' + str(c))
+        opt_audio = self._supported_codec('audio', self.audio_codecs, opt_audio)
+        c = opt_audio['codec']
 
         audio_options = self.audio_codecs[c]().parse_options(opt_audio)
         if audio_options is None:
@@ -93,6 +139,15 @@ class Converter(object):
         c = opt_video['codec']
         if c not in self.video_codecs:
             raise ConverterError('Requested unknown video codec ' + str(c))
+        opt_video = self._supported_codec('video', self.video_codecs, opt_video)
+        c = opt_video['codec']
+        if self.capabilities and opt_video.get('pix_fmt'):
+            # 'auto' is checked once resolved, None keeping the source format
+            codec = self.video_codecs[c]()
+            pix_fmt = codec._parse_pix_fmt(codec.safe_options(opt_video))['pix_fmt']
+            if pix_fmt and pix_fmt not in self.capabilities.pix_fmts:
+                raise ConverterError('Requested pixel format %s is not supported by %s' % (
+                    pix_fmt, self.ffmpeg.ffmpeg_path))
 
         video_options = self.video_codecs[c]().parse_options(opt_video)
         if video_options is None:
@@ -117,6 +172,11 @@ class Converter(object):
         if 'map' in opt:
             opt.setdefault('maps', []).extends(['-map', str(opt['map'])])
 
+        if opt_video.get('decimate') and self.formats[f].variable_frame_rate:
+            # keep the timestamps of the remaining frames instead of
+            # duplicating them back to a constant frame rate
+            format_options.extend(['-fps_mode', 'vfr'])
+
         for input_map in opt.get('maps', []):
             format_options.extend(['-map', str(input_map)])
 
@@ -126,6 +186,7 @@ class Converter(object):
         # aggregate all options
         optlist = audio_options + video_options + subtitle_options + \
             format_options
+        self._check_filters(optlist)
 
         if twopass == 1:
             optlist.extend(['-pass', '1'])
@@ -134,7 +195,153 @@ class Converter(object):
 
         return optlist
 
-    def convert(self, infile, outfiles, options, twopass=False, timeout=10):
+    def _global_options(self, options):
+        """
+        Return the options of the outputs applying to the whole ffmpeg
+        process (see VideoCodec.global_options), which the outputs must
+        agree on.
+        """
+        values = {}
+        optlist = []
+        for output_options in options:
+            video = output_options.get('video') if isinstance(output_options, dict) else None
+            if not isinstance(video, dict) or video.get('codec') not in self.video_codecs:
+                continue
+            codec_options = self.video_codecs[video['codec']]().global_options(video)
+            for option, value in zip(codec_options[::2], codec_options[1::2]):
+                if option not in values:
+                    values[option] = value
+                    optlist.extend([option, value])
+                elif values[option] != value:
+                    raise ConverterError('Outputs request different %s values: %s and %s' % (
+                        option, values[option], value))
+        return optlist
+
+    def _check_filters(self, optlist):
+        """
+        Raise ConverterError if the filters of an option list (scaler,
+        decimation, branding graph, ...) are not all in the ffmpeg binary.
+        """
+        if not self.capabilities:
+            return
+        for option, value in zip(optlist, optlist[1:]):
+            if option in ('-vf', '-af', '-filter:v', '-filter:a', '-filter_complex'):
+                missing = graph_filters(value) - self.capabilities.filters
+                if missing:
+                    raise ConverterError('Requested filters %s are not supported by %s' % (
+                        ', '.join(sorted(missing)), self.ffmpeg.ffmpeg_path))
+
+    def _supported_codec(self, kind, codecs, opt):
+        """
+        Return the codec options opt, switched to the codec fallback if
+        the ffmpeg binary lacks the requested encoder.
+        """
+        cls = codecs[opt['codec']]
+        if not self.capabilities or not cls.ffmpeg_codec_name or \
+                cls.ffmpeg_codec_name in self.capabilities.encoders:
+            return opt
+
+        fallback = codecs.get(cls.fallback_codec_name)
+        if fallback and fallback.ffmpeg_codec_name in self.capabilities.encoders:
+            logger.warning('%s does not support the %s encoder, using %s instead',
+                           self.ffmpeg.ffmpeg_path, cls.ffmpeg_codec_name, fallback.ffmpeg_codec_name)
+            opt = dict(opt)
+            opt['codec'] = fallback.codec_name
+            return opt
+
+        raise ConverterError('Requested %s codec %s is not supported by %s' % (
+            kind, opt['codec'], self.ffmpeg.ffmpeg_path))
+
+    def parse_thumbnail_options(self, thumbnails):
+        """
+        Prepare extra ffmpeg outputs that turn the frames already decoded
+        for a conversion into thumbnails, so the source is read only once.
+
+        Thumbnails are described by a dict (or a list of dicts) with keys:
+            * path (mandatory, string) - output file; use an image2 pattern
+              (eg. '/tmp/thumb%03d.jpg') if more than one frame is produced
+            * timestamps (optional, list) - time points (in seconds)
+            * interval (optional, float) - take a frame every interval
+              seconds, used when no timestamps are given
+            * size (optional, string) - WxH of the thumbnails
+            * quality (optional, int) - jpeg quality in range 2(best)-31(worst)
+
+        Returns a tuple of (output files, list of output option lists).
+        All the thumbnails share a single filter graph splitting the first
+        video stream of the source.
+        """
+        if isinstance(thumbnails, dict):
+            thumbnails = [thumbnails]
+
+        if not isinstance(thumbnails, list) or not thumbnails:
+            raise ConverterError('Invalid thumbnails specification')
+
+        outfiles = []
+        optlists = []
+        chains = []
+        for index, thumb in enumerate(thumbnails):
+            if not isinstance(thumb, dict) or not thumb.get('path'):
+                raise ConverterError('Invalid thumbnails specification')
+
+            if thumb.get('timestamps'):
+                terms = []
+                for timestamp in thumb['timestamps']:
+                    timestamp = float(timestamp)
+                    if timestamp <= 0:
+                        terms.append('eq(n\\,0)')
+                    else:
+                        # first frame at or after the time point, which may be
+                        # the first frame (without prev_pts) of a source not
+                        # starting at 0
+                        terms.append('(isnan(prev_pts)+lt(prev_pts*TB\\,%s))*gte(pts*TB\\,%s)' % (
+                            timestamp, timestamp))
+                select = '+'.join(terms)
+                frames = len(terms)
+            elif thumb.get('interval'):
+                interval = float(thumb['interval'])
+                if interval <= 0:
+                    raise ConverterError('Invalid thumbnails interval: ' + str(thumb['interval']))
+                select = 'isnan(prev_selected_t)+gte(t-prev_selected_t\\,%s)' % interval
+                frames = None
+            else:
+                raise ConverterError('Thumbnails need timestamps or an interval')
+
+            if frames != 1 and '%' not in thumb['path']:
+                raise ConverterError('Thumbnails path must be a pattern when several frames are produced')
+
+            chain = 'select=%s' % select
+            if thumb.get('size'):
+                chain += ',scale=%s' % str(thumb['size']).replace('x', ':')
+            chains.append(chain)
+
+            quality = thumb.get('quality', FFMpeg.DEFAULT_JPEG_QUALITY)
+            try:
+                quality = int(quality)
+            except (TypeError, ValueError):
+                quality = FFMpeg.DEFAULT_JPEG_QUALITY
+            if quality < 2 or quality > 31:
+                quality = FFMpeg.DEFAULT_JPEG_QUALITY
+
+            optlist = ['-map', '[thumb%d]' % index, '-f', 'image2', '-fps_mode', 'vfr']
+            if frames:
+                optlist.extend(['-frames:v', str(frames)])
+            optlist.extend(['-q:v', str(quality)])
+            outfiles.append(thumb['path'])
+            optlists.append(optlist)
+
+        if len(chains) == 1:
+            graph = '[0:v:0]%s[thumb0]' % chains[0]
+        else:
+            graph = '[0:v:0]split=%d%s' % (
+                len(chains), ''.join('[thumbsrc%d]' % i for i in range(len(chains))))
+            for index, chain in enumerate(chains):
+                graph += ';[thumbsrc%d]%s[thumb%d]' % (index, chain, index)
+        optlists[0][0:0] = ['-filter_complex', graph]
+
+        return outfiles, optlists
+
+    def convert(self, infile, outfiles, options, twopass=False, timeout=10, smart_copy=False, draft=False,
+                queued_at=None, benchmark=False):
         """
         Convert media file (infile) according to specified options, and save it to outfile. For two-pass encoding, specify the pass (1 or 2) in the twopass parameter.
 
@@ -146,6 +353,10 @@ class Converter(object):
             * video (optional, dict) - video codec and options; see
               codecs.video.VideoCodec for list of supported options
             * map (optional, int) - can be used to map all content of stream 0
+            * thumbnails (optional, dict or list) - thumbnails produced by the
+              same ffmpeg process; see Converter.parse_thumbnail_options
+            * branding (optional, dict) - intro, outro and logo added to the
+              video; see branding.Branding for the list of supported options
 
         Multiple audio/video streams are not supported. The output has to
         have at least an audio or a video stream (or both).
@@ -165,6 +376,52 @@ class Converter(object):
         timeout is handled (using signals) has special restriction when
         using threads.
 
+        With smart_copy, each source stream that already matches the
+        requested options (same codec, size, frame rate and bitrate at or
+        below the requested ones, ...) is copied instead of being encoded;
+        see the can_copy() method of the codecs for the details.
+
+        With draft, the lowest CPU time is traded for some quality loss,
+        for editing proxies or quick previews: the source video decoder
+        takes the shortcuts it supports (see Converter.draft_decoders),
+        and the video codecs use their draft_options (fastest preset and
+        scaler), which override the requested ones.
+
+        The video options may give a target_speed (eg. 2.0 for twice
+        faster than real time) instead of a preset: the slowest preset of
+        the codec reaching it on this host is used, according to the
+        throughputs measured by calibration.PresetCalibration, which the
+        conversion then refines.
+
+        infile can be a pipes.PipeInput, to start converting media still
+        arriving (eg. an upload) from a file-like object or an iterator of
+        bytes. It is probed from its first bytes and read only once, so
+        two-pass encoding and autocrop are not possible.
+
+        Outputs can be pipes.PipeOutput, to hand the output to a callable
+        or a writable object (eg. an upload) while it is encoded, without
+        writing it to disk. Their format must be streamable (see
+        formats.BaseFormat.streamable) and two-pass encoding is not
+        possible.
+
+        queued_at is the time.time() at which the job was queued, if it
+        waited in a queue: the wait is recorded in the 'queue' timing of
+        the report and told to the instrumentation.
+
+        With benchmark, ffmpeg is run with -benchmark and the CPU and
+        memory figures it reports are kept in the benchmarks of the
+        report (see report.BenchmarkStats), for the 'pass1', 'pass2' or
+        'encode' phases. With benchmark='all', ffmpeg is run with
+        -benchmark_all and the figures are also broken down per decoding
+        and encoding stage of each stream.
+
+        Once exhausted, the generator returns a report.ConversionReport
+        (also kept in Converter.last_report) telling, among other things,
+        for each output which streams were copied or encoded and why, the
+        output sizes, and the wall time and the resources (CPU time,
+        memory, I/O) used by the ffmpeg processes of each phase and the
+        errors, warnings and dropped frames in their log.
+
         >>> conv = Converter().convert('test1.ogg', '/tmp/output.mkv', {
         ...    'format': 'mkv',
         ...    'audio': { 'codec': 'aac' },
@@ -174,7 +431,35 @@ class Converter(object):
         >>> for timecode in conv:
         ...   pass # can be used to inform the user about the progress
         """
-        if isinstance(outfiles, str):
+        queue_wait = None
+        if queued_at is not None:
+            queue_wait = max(0.0, time.time() - queued_at)
+            self.ffmpeg._emit('dequeued', 'convert', queue_wait)
+        source = infile
+        staging_time = None
+        if self.stager is not None and not isinstance(infile, PipeInput) and os.path.exists(infile):
+            start = time.time()
+            source = self.stager.stage(infile)
+            staging_time = time.time() - start
+        scratch = ScratchSpace(self.scratch_dir) if self.scratch_dir else None
+        try:
+            report = yield from self._convert(source, outfiles, options, twopass, timeout, smart_copy, draft, scratch,
+                                              benchmark)
+            if scratch:
+                scratch.commit()
+        finally:
+            if scratch:
+                scratch.cleanup()
+            if source != infile:
+                self.stager.release(source)
+        if staging_time is not None:
+            report.timings['staging'] = staging_time
+        if queue_wait is not None:
+            report.timings['queue'] = queue_wait
+        return report
+
+    def _convert(self, infile, outfiles, options, twopass, timeout, smart_copy, draft, scratch, benchmark):
+        if isinstance(outfiles, (str, PipeOutput)):
             outfiles = [outfiles]
 
         if isinstance(options, dict):
@@ -186,28 +471,68 @@ class Converter(object):
         if not isinstance(options, list):
             raise ConverterError('Invalid options')
 
-        if not os.path.exists(infile):
+        outfiles = list(outfiles)
+        original_options = options
+        options = list(options)
+        report = ConversionReport(outfiles)
+
+        def benchmarks(phase):
+            if not benchmark:
+                return None
+            return report.benchmarks.setdefault(phase, BenchmarkStats(stages=benchmark == 'all'))
+
+        self._check_piped_outputs(outfiles, options)
+        if twopass and any(isinstance(outfile, PipeOutput) for outfile in outfiles):
+            raise ConverterError('Two-pass encoding is not possible with a piped output')
+        if scratch:
+            outfiles = [outfile if isinstance(outfile, PipeOutput) else scratch.path(outfile) for outfile in outfiles]
+        output_paths = list(outfiles)
+
+        pipe = isinstance(infile, PipeInput)
+        if pipe:
+            if twopass:
+                raise ConverterError('Two-pass encoding is not possible with a piped input')
+        elif not os.path.exists(infile):
             raise ConverterError("Source file doesn't exist: " + infile)
 
-        info = self.ffmpeg.probe(infile)
+        start = time.time()
+        info = self.ffmpeg.probe(infile, usage=report.phase('probe'))
+        report.timings['probe'] = time.time() - start
         if info is None:
             raise ConverterError("Can't get information about source file")
 
         if not info.video and not info.audio:
             raise ConverterError('Source file has no audio or video streams')
 
+        if pipe:
+            # the probed prefix may not tell the duration, the progress is 0
+            # until the end if it is not given either
+            info.format.duration = infile.duration or info.format.duration or 0
+
         skinopts = list()
         preopts = list()
+        copy_branding = dict()
         duration = info.format.duration
+        crop = False
         for index in range(0, len(options)):
             if info.video and 'video' in options[index]:
                 options[index] = options[index].copy()
                 v = options[index]['video'] = options[index]['video'].copy()
                 v['src_width'] = info.video.video_width
                 v['src_height'] = info.video.video_height
+                v['src_pix_fmt'] = info.video.video_pixel_format
                 v['display_aspect_ratio'] = info.video.video_display_aspect_ratio
                 v['sample_aspect_ratio'] = info.video.video_sample_aspect_ratio
                 v['rotate'] = info.video.metadata.get('rotate') or info.video.metadata.get('ROTATE')
+                if v.get('mode') == 'autocrop' and 'crop' not in v:
+                    if pipe:
+                        raise ConverterError('Crop detection is not possible with a piped input')
+                    if crop is False:
+                        start = time.time()
+                        crop = self._detect_crop(infile, info, usage=report.phase('crop'))
+                        report.timings['crop'] = time.time() - start
+                    if crop:
+                        v['crop'] = '%d:%d:%d:%d' % crop
                 preoptlist = options[index]['video'].get('ffmpeg_custom_launch_opts', '').split(' ')
                 # Remove empty arguments (make crashes)
                 preoptlist = [arg for arg in preoptlist if arg]
@@ -229,34 +554,456 @@ class Converter(object):
                         newskinoptlist.append(arg)
                 skinoptlist = newskinoptlist
                 skinopts.append(skinoptlist)
-            if not info.format or not info.format.duration or not isinstance(info.format.duration, (float, int)) or info.format.duration < 0.01:
+                if options[index].get('branding'):
+                    if skinoptlist:
+                        raise ConverterError('Branding and ffmpeg_skin_opts cannot be combined')
+                    try:
+                        branding = Branding(options[index]['branding'])
+                    except ValueError as e:
+                        raise ConverterError(str(e))
+                    bumper_infos = dict((bumper, self._probe_bumper(bumper)) for bumper in branding.bumpers)
+                    if not twopass and not pipe and not isinstance(outfiles[index], PipeOutput) and \
+                            self._can_copy_bumpers(branding, info, bumper_infos, options[index]):
+                        copy_branding[index] = branding
+                    else:
+                        first_input = 1 + sum(opts.count('-i') for opts in skinopts[:-1])
+                        brandingopts, options[index]['maps'] = branding.parse_options(
+                            info, bumper_infos, first_input=first_input, suffix=str(index) if index else '')
+                        self._check_filters(brandingopts)
+                        skinoptlist.extend(brandingopts)
+                        # the intro and outro are often the same file
+                        duration = max(duration, (info.format.duration or 0) + sum(
+                            bumper_infos[bumper].format.duration or 0 for bumper in branding.bumpers))
+            elif options[index].get('branding'):
+                raise ConverterError('Branding requested but source has no video stream')
+            else:
+                preopts.append([])
+                skinopts.append([])
+            if pipe:
+                pass
+            elif not info.format or not info.format.duration or not isinstance(info.format.duration, (float, int)) or info.format.duration < 0.01:
                 raise ConverterError('Zero-length media')
 
+        for index, output_options in enumerate(options):
+            streams = report.outputs[index].streams
+            for kind, stream, codecs in (('video', info.video, self.video_codecs),
+                                         ('audio', info.audio, self.audio_codecs)):
+                opt = output_options.get(kind)
+                if not stream or not isinstance(opt, dict) or opt.get('codec') not in codecs:
+                    continue
+                if opt['codec'] is None:
+                    continue
+                if opt['codec'] == 'copy':
+                    streams[kind] = ('copy', 'requested')
+                    continue
+                if not smart_copy:
+                    streams[kind] = ('encode', 'requested')
+                    continue
+                if kind == 'video' and (opt.get('ffmpeg_skin_opts') or output_options.get('branding')):
+                    copy, reason = False, 'filters requested'
+                else:
+                    copy, reason = codecs[opt['codec']]().can_copy(opt, stream)
+                streams[kind] = ('copy' if copy else 'encode', reason)
+                if copy:
+                    output_options = options[index] = output_options.copy()
+                    output_options[kind] = {'codec': 'copy'}
+            video = output_options.get('video')
+            if streams.get('video', ('copy',))[0] == 'encode' and not output_options.get('branding') and \
+                    not video.get('ffmpeg_skin_opts'):
+                report.outputs[index].pix_fmt_conversion = self.video_codecs[video['codec']]().pix_fmt_conversion(video)
+
+        # outputs whose bumpers are joined with stream copy: encode the
+        # content alone to a temporary file, next to the final one
+        branded_outputs = list()
+        for index, branding in copy_branding.items():
+            profile = options[index].copy()
+            del profile['branding']
+            profile.pop('thumbnails', None)
+            bumper_profile = profile.copy()
+            bumper_profile['video'] = dict(
+                (k, v) for k, v in profile['video'].items()
+                if k not in ('src_width', 'src_height', 'src_pix_fmt', 'display_aspect_ratio', 'sample_aspect_ratio',
+                             'rotate', 'crop'))
+            bumper_profile['video']['mode'] = 'pad'
+            root, extension = os.path.splitext(outfiles[index])
+            cache = BumperCache(branding.cache_dir)
+            intro = branding.intro and cache.get(self, branding.intro, bumper_profile, extension)
+            outro = branding.outro and cache.get(self, branding.outro, bumper_profile, extension)
+            # the final join rewrites the file anyway
+            options[index] = dict((k, v) for k, v in options[index].items()
+                                  if k not in ('branding', 'faststart', 'moov_size'))
+            branded_outputs.append((index, outfiles[index], root + '.main' + extension, intro, outro))
+            outfiles[index] = root + '.main' + extension
+
+        thumbnails = list()
+        for output_options in options:
+            thumbs = output_options.get('thumbnails')
+            if thumbs:
+                thumbnails.extend([thumbs] if isinstance(thumbs, dict) else thumbs)
+        if thumbnails:
+            if not info.video:
+                raise ConverterError('Thumbnails requested but source has no video stream')
+            thumb_outfiles, thumb_optlists = self.parse_thumbnail_options(thumbnails)
+            if scratch:
+                thumb_outfiles = [scratch.path(thumb_outfile) for thumb_outfile in thumb_outfiles]
+        else:
+            thumb_outfiles, thumb_optlists = [], []
+        outfiles = list(outfiles) + thumb_outfiles
+        skinopts.extend([] for _ in thumb_outfiles)
+
+        preopts.insert(0, self._global_options(options))
+        selected_presets = {}
+        if draft:
+            lowres = not thumbnails and not any(output_options.get('branding') for output_options in original_options)
+            preopts.insert(0, self._draft_options(info, options, lowres, report))
+        else:
+            selected_presets = self._select_presets(info, options, report)
+
+        def output_optlists(passno):
+            # codec filters of outputs mapped from a complex graph (eg. the
+            # branding) are moved in that graph
+            optlists = []
+            graphs = [list(skinoptlist) for skinoptlist in skinopts]
+            for index, output_options in enumerate(options):
+                optlists.append(self.parse_options(output_options, passno))
+                if passno and scratch:
+                    optlists[index].extend(['-passlogfile', scratch.file('pass%d' % index)])
+                splice_video_filters(optlists[index], graphs[index])
+            return optlists, graphs
+
         if twopass:
-            optlist1 = []
-            for output_options in options:
-                optlist1.append(self.parse_options(output_options, 1))
-            for timecode in self.ffmpeg.convert(infile, outfiles, optlist1,
-                                                timeout=timeout, preopts=preopts, skinopts=skinopts):
+            optlist1, skinopts1 = output_optlists(1)
+            start = time.time()
+            for timecode in self.ffmpeg.convert(infile, outfiles, optlist1, timeout=timeout, preopts=preopts,
+                                                skinopts=skinopts1, usage=report.phase('pass1'),
+                                                benchmark=benchmarks('pass1'),
+                                                log=report.logs.setdefault('pass1', FFMpegLog())):
                 yield float(timecode) / duration
-
-            optlist2 = []
-            for output_options in options:
-                optlist2.append(self.parse_options(output_options, 2))
-            for timecode in self.ffmpeg.convert(infile, outfiles, optlist2,
-                                                timeout=timeout, preopts=preopts, skinopts=skinopts):
+            report.timings['pass1'] = time.time() - start
+
+            optlist2, skinopts2 = output_optlists(2)
+            optlist2.extend(thumb_optlists)
+            start = time.time()
+            for timecode in self.ffmpeg.convert(infile, outfiles, optlist2, timeout=timeout, preopts=preopts,
+                                                skinopts=skinopts2, usage=report.phase('pass2'),
+                                                benchmark=benchmarks('pass2'),
+                                                log=report.logs.setdefault('pass2', FFMpegLog())):
                 yield 0.5 + float(timecode) / duration
+            report.timings['pass2'] = time.time() - start
         else:
-            optlist = []
-            for output_options in options:
-                optlist.append(self.parse_options(output_options, twopass))
-            for timecode in self.ffmpeg.convert(infile, outfiles, optlist,
-                                                timeout=timeout, preopts=preopts, skinopts=skinopts):
+            optlist, skinopts = output_optlists(twopass)
+            optlist.extend(thumb_optlists)
+            start = time.time()
+            for timecode in self.ffmpeg.convert(infile, outfiles, optlist, timeout=timeout, preopts=preopts,
+                                                skinopts=skinopts, usage=report.phase('encode'),
+                                                benchmark=benchmarks('encode'),
+                                                log=report.logs.setdefault('encode', FFMpegLog())):
+                yield float(timecode) / duration if duration else 0.0
+            report.timings['encode'] = time.time() - start
+
+            # the time can only be attributed to a preset for a single output
+            if len(options) == 1 and 0 in selected_presets:
+                codec, preset, (width, height, fps) = selected_presets[0]
+                self._calibration.record(codec, preset, width, height, fps, info.format.duration, time.time() - start)
+
+        for index, outfile, main, intro, outro in branded_outputs:
+            output_options = original_options[index]
+            start = time.time()
+            try:
+                self.ffmpeg.concat(
+                    [part for part in (intro, main, outro) if part], outfile,
+                    faststart=bool(output_options.get('faststart')),
+                    fragmented=output_options['format'] == 'fmp4', usage=report.phase('join'))
+            except ArgumentError as e:
+                logger.warning('Could not join pre-encoded bumpers, encoding them with the content: %s', e)
+                output_options = output_options.copy()
+                output_options['branding'] = dict(output_options['branding'], cache_dir=None)
+                # outfile is already in the scratch space
+                for _ in self._convert(infile, [outfile], [output_options], twopass, timeout, smart_copy, draft, None,
+                                       benchmark):
+                    pass
+                report.merge(self.last_report, 'branding_')
+            finally:
+                os.unlink(main)
+            report.timings['join'] = report.timings.get('join', 0) + time.time() - start
+
+        for index, output_options in enumerate(original_options):
+            video = output_options.get('video')
+            if info.video and isinstance(video, dict) and video.get('decimate') and \
+                    not isinstance(output_paths[index], PipeOutput):
+                output_info = self.ffmpeg.probe(output_paths[index], count_packets=True, usage=report.phase('probe'))
+                source_frames = info.video.video_frames or int(round(
+                    (info.format.duration or 0) * (info.video.video_fps or 0)))
+                if output_info and output_info.video:
+                    report.outputs[index].frames = (source_frames, output_info.video.video_frames)
+
+        report.record_sizes(output_paths)
+        self.last_report = report
+        return report
+
+    def _check_piped_outputs(self, outfiles, options):
+        for outfile, output_options in zip(outfiles, options):
+            if not isinstance(outfile, PipeOutput) or not isinstance(output_options, dict):
+                continue
+            format_class = self.formats.get(output_options.get('format'))
+            if format_class is not None and not format_class.streamable:
+                raise ConverterError('Format %s can not be written to a pipe' % output_options['format'])
+
+    def compose(self, inputs, outfiles, options, layout=None, timeout=10):
+        """
+        Compose several video sources (eg. slides and camera recordings)
+        into one picture and encode all the requested renditions in a
+        single ffmpeg process, so the sources are decoded only once.
+
+        The layout is a dict describing how the inputs are arranged, see
+        composition.Composition for the supported options. Outfiles and
+        options are the same as in Converter.convert(), every output must
+        have a video stream.
+
+        Like convert, compose returns a generator that needs to be iterated
+        to drive the conversion process.
+
+        >>> conv = Converter().compose(['slides.mp4', 'camera.mp4'], '/tmp/output.mp4', {
+        ...    'format': 'mp4',
+        ...    'audio': {'codec': 'aac'},
+        ...    'video': {'codec': 'h264', 'width': 1280}
+        ... }, layout={'type': 'pip', 'position': 'top-right', 'scale': 0.3})
+        """
+        if isinstance(outfiles, (str, PipeOutput)):
+            outfiles = [outfiles]
+
+        if isinstance(options, dict):
+            options = [options]
+
+        if not isinstance(options, list) or not isinstance(inputs, (list, tuple)):
+            raise ConverterError('Invalid options')
+
+        if len(outfiles) != len(options):
+            raise ConverterError('Options are not provided for all the outputs')
+        self._check_piped_outputs(outfiles, options)
+
+        infos = []
+        for infile in inputs:
+            if not os.path.exists(infile):
+                raise ConverterError("Source file doesn't exist: " + infile)
+            info = self.ffmpeg.probe(infile)
+            if info is None:
+                raise ConverterError("Can't get information about source file: " + infile)
+            infos.append(info)
+
+        try:
+            graph, (width, height), video_labels, audio_labels, duration = Composition(layout).parse_options(
+                infos, len(options))
+        except ValueError as e:
+            raise ConverterError(str(e))
+
+        if duration < 0.01:
+            raise ConverterError('Zero-length media')
+
+        optlists = []
+        for index, output_options in enumerate(options):
+            if not isinstance(output_options, dict) or not isinstance(output_options.get('video'), dict):
+                raise ConverterError('Every composed output needs a video stream')
+            output_options = output_options.copy()
+            output_options['maps'] = [video_labels[index]] + audio_labels[index:index + 1]
+            v = output_options['video'] = output_options['video'].copy()
+            v['src_width'] = width
+            v['src_height'] = height
+            optlists.append(self.parse_options(output_options))
+
+        skinopts = [['-filter_complex', graph]] + [[] for _ in options[1:]]
+        for optlist in optlists:
+            splice_video_filters(optlist, skinopts[0])
+        scratch = ScratchSpace(self.scratch_dir) if self.scratch_dir else None
+        try:
+            if scratch:
+                outfiles = [outfile if isinstance(outfile, PipeOutput) else scratch.path(outfile)
+                            for outfile in outfiles]
+            for timecode in self.ffmpeg.convert(list(inputs), outfiles, optlists, timeout=timeout,
+                                                preopts=[self._global_options(options)], skinopts=skinopts):
                 yield float(timecode) / duration
+            if scratch:
+                scratch.commit()
+        finally:
+            if scratch:
+                scratch.cleanup()
+
+    # draft mode shortcuts supported by the decoders (as named by ffprobe)
+    draft_decoders = {
+        'h264': ('flags2', 'skip_loop_filter'),
+        'hevc': ('skip_loop_filter',),
+        'vp8': ('skip_loop_filter',),
+        'mpeg1video': ('flags2', 'lowres'),
+        'mpeg2video': ('flags2', 'lowres'),
+        'mpeg4': ('lowres',),
+        'h263': ('lowres',),
+        'msmpeg4v3': ('lowres',),
+        'mjpeg': ('lowres',),
+    }
+
+    def _draft_options(self, info, options, lowres, report):
+        """
+        Switch the encoded video of the outputs to the draft options of
+        their codec, and return the options speeding up the decoding of
+        the source video. Decoding at a lower resolution (lowres) is only
+        possible when every output has an explicit, small enough size, and
+        no crop rectangle or ffmpeg_skin_opts graph (given in source
+        pixels).
+        """
+        sizes = []
+        for index, output_options in enumerate(options):
+            video = output_options.get('video')
+            if not isinstance(video, dict) or video.get('codec') in (None, 'copy'):
+                continue
+            codec = self.video_codecs.get(video['codec'])
+            if codec is None:
+                continue
+            options[index] = output_options.copy()
+            options[index]['video'] = dict(video, **codec.draft_options)
+            report.outputs[index].shortcuts.extend(
+                '%s=%s' % (k, v) for k, v in sorted(codec.draft_options.items()))
+            try:
+                sizes.append((int(video['width']), int(video['height'])))
+            except (KeyError, TypeError, ValueError):
+                lowres = False
+            if video.get('mode') == 'autocrop' or video.get('crop') or video.get('ffmpeg_skin_opts'):
+                lowres = False
+
+        if not info.video:
+            return []
+        decoder = self.draft_decoders.get(info.video.codec, ())
+        preopts = []
+        if 'flags2' in decoder:
+            preopts.extend(['-flags2', '+fast'])
+        if 'skip_loop_filter' in decoder:
+            preopts.extend(['-skip_loop_filter', 'all'])
+        if 'lowres' in decoder and lowres and sizes:
+            width, height = info.video.video_width, info.video.video_height
+            if str(info.video.metadata.get('rotate')) in ('90', '270'):
+                width, height = height, width
+            factor = 0
+            while factor < 3 and all(
+                    width >> (factor + 1) >= w and height >> (factor + 1) >= h for w, h in sizes):
+                factor += 1
+            if factor:
+                preopts.extend(['-lowres', str(factor)])
+        report.shortcuts.extend(' '.join(preopts[i:i + 2]) for i in range(0, len(preopts), 2))
+        return preopts
+
+    def _select_presets(self, info, options, report):
+        """
+        Replace the target_speed of the video outputs by the slowest preset
+        of their codec reaching it. Returns a dict mapping the output index
+        to the (codec, preset, (width, height, fps)) selected.
+        """
+        selected = {}
+        for index, output_options in enumerate(options):
+            video = output_options.get('video')
+            if not info.video or not isinstance(video, dict) or not video.get('target_speed'):
+                continue
+            codec = self.video_codecs.get(video.get('codec'))
+            if codec is None or not codec.presets:
+                continue
+            try:
+                speed = float(video['target_speed'])
+                width = int(video.get('width') or 0)
+                height = int(video.get('height') or 0)
+                fps = float(video.get('fps') or info.video.video_fps or 25)
+            except (TypeError, ValueError):
+                continue
+
+            sw, sh = info.video.video_width, info.video.video_height
+            if not width and not height:
+                width, height = sw, sh
+            elif not height:
+                height = width * sh // sw
+            elif not width:
+                width = height * sw // sh
+
+            if self._calibration is None:
+                self._calibration = PresetCalibration(self.ffmpeg, self.calibration_cache_dir)
+            try:
+                preset = self._calibration.select(codec, speed, width, height, fps)
+            except ValueError as e:
+                raise ConverterError(str(e))
+            options[index] = output_options.copy()
+            options[index]['video'] = dict(video, preset=preset)
+            report.outputs[index].preset = preset
+            selected[index] = (codec, preset, (width, height, fps))
+        return selected
+
+    def detect_crop(self, infile, samples=5):
+        """
+        Detect the black bars of a video, analyzing samples short windows
+        in parallel (see FFMpeg.detect_crop).
+
+        Returns the (width, height, x, y) rectangle of the picture without
+        the bars, or None if there are no bars to remove. The 'autocrop'
+        video mode of Converter.convert uses it.
+        """
+        if not os.path.exists(infile):
+            raise ConverterError("Source file doesn't exist: " + infile)
+        info = self.ffmpeg.probe(infile)
+        if info is None or not info.video:
+            raise ConverterError('Source file has no video stream')
+        return self._detect_crop(infile, info, samples)
+
+    def _detect_crop(self, infile, info, samples=5, usage=None):
+        crop = self.ffmpeg.detect_crop(infile, info.format.duration or 0, samples, usage=usage)
+        if crop is None:
+            return None
+        width, height = info.video.video_width, info.video.video_height
+        if str(info.video.metadata.get('rotate')) in ('90', '270'):
+            width, height = height, width
+        if crop[:2] == (width, height):
+            return None
+        return crop
+
+    def _probe_bumper(self, bumper):
+        """
+        Probe a branding bumper, the result is kept for the lifetime of
+        the converter as the same bumpers are used for many videos.
+        """
+        if not os.path.exists(bumper):
+            raise ConverterError("Bumper file doesn't exist: " + bumper)
+        key = (os.path.abspath(bumper), os.path.getmtime(bumper))
+        if key not in self._bumper_infos:
+            bumper_info = self.ffmpeg.probe(bumper)
+            if bumper_info is None or not bumper_info.video:
+                raise ConverterError("Can't get information about bumper file: " + bumper)
+            self._bumper_infos[key] = bumper_info
+        return self._bumper_infos[key]
+
+    @staticmethod
+    def _can_copy_bumpers(branding, info, bumper_infos, opt):
+        """
+        Tell whether the bumpers of branding can be pre-encoded with the
+        output options (opt) and joined to the content with stream copy.
+        This requires a fixed output size, frame rate and audio parameters
+        so that every part is encoded with the same parameters.
+        """
+        if not branding.cache_dir or branding.logo or not branding.bumpers:
+            return False
+        video = opt['video']
+        if video.get('codec') in (None, 'copy') or not video.get('width') or not video.get('height') or \
+                not video.get('fps'):
+            return False
+        if 'audio' in opt:
+            audio = opt['audio']
+            if not isinstance(audio, dict) or audio.get('codec') in (None, 'copy'):
+                return False
+            if not audio.get('samplerate') or not audio.get('channels') or not info.audio:
+                return False
+            if not all(bumper_info.audio for bumper_info in bumper_infos.values()):
+                return False
+        return True
 
     def segment(self, infile, working_directory, output_files, output_directories, options, timeout=10):
         """
         Segment the first video stream muxed with the first audio track
+
+        Like convert, the generator returns a report.ConversionReport once
+        exhausted, the outputs being the playlists.
         """
 
         if isinstance(output_files, str):
@@ -271,13 +1018,16 @@ class Converter(object):
         if len(output_files) != len(output_directories) != len(options):
             raise ConverterError('Input file or directories or options are not provided for all the outputs')
 
+        report = ConversionReport(output_files)
         outputs_options = list()
         outputs_ts_files = list()
         for index, output_file in enumerate(output_files):
             if not os.path.exists(infile):
                 raise ConverterError("Source file doesn't exist: " + infile)
 
-            info = self.ffmpeg.probe(infile)
+            start = time.time()
+            info = self.ffmpeg.probe(infile, usage=report.phase('probe'))
+            report.timings['probe'] = report.timings.get('probe', 0) + time.time() - start
             if info is None:
                 raise ConverterError("Can't get information about source file")
 
@@ -330,11 +1080,34 @@ class Converter(object):
             outfile = "%s/media%%05d.ts" % output_directory
             outputs_options.append(optlist)
             outputs_ts_files.append(outfile)
+        scratch = None
+        if self.scratch_dir:
+            # the playlists and the segment directories are written in the
+            # scratch directory as they are laid out in working_directory
+            infile = os.path.abspath(infile)
+            scratch = ScratchSpace(self.scratch_dir)
+            for output_file, output_directory in zip(output_files, output_directories):
+                scratch_directory = scratch.path(os.path.join(working_directory, output_directory), output_directory)
+                if not os.path.isdir(scratch_directory):
+                    os.makedirs(scratch_directory)
+                scratch.path(os.path.join(working_directory, output_file), output_file)
         current_directory = os.getcwd()
-        os.chdir(working_directory)
-        for timecode in self.ffmpeg.convert(infile, outputs_ts_files, outputs_options, timeout=timeout):
-            yield float(timecode) / info.format.duration
-        os.chdir(current_directory)
+        os.chdir(scratch.directory if scratch else working_directory)
+        try:
+            start = time.time()
+            for timecode in self.ffmpeg.convert(infile, outputs_ts_files, outputs_options, timeout=timeout,
+                                                usage=report.phase('segment')):
+                yield float(timecode) / info.format.duration
+            report.timings['segment'] = time.time() - start
+            if scratch:
+                scratch.commit()
+        finally:
+            os.chdir(current_directory)
+            if scratch:
+                scratch.cleanup()
+        report.record_sizes([os.path.join(working_directory, output_file) for output_file in output_files])
+        self.last_report = report
+        return report
 
     def probe(self, fname, posters_as_video=True):
         """
@@ -349,19 +1122,47 @@ class Converter(object):
 
     def thumbnail(self, fname, time, outfile, size=None, quality=FFMpeg.DEFAULT_JPEG_QUALITY):
         """
-        Create a thumbnail of the media file.
+        Create a thumbnail of the media file, and return a
+        report.ConversionReport.
 
         See the documentation of converter.FFMpeg.thumbnail() for details.
         """
-        return self.ffmpeg.thumbnail(fname, time, outfile, size, quality)
+        return self.thumbnails(fname, [(time, outfile, size, quality)])
 
     def thumbnails(self, fname, option_list):
         """
-        Create one or more thumbnail of the media file.
+        Create one or more thumbnail of the media file, and return a
+        report.ConversionReport.
 
         See the documentation of converter.FFMpeg.thumbnails() for details.
         """
-        return self.ffmpeg.thumbnails(fname, option_list)
+        report = ConversionReport([option[1] for option in option_list])
+        start = time.time()
+        self.ffmpeg.thumbnails(fname, option_list, usage=report.phase('thumbnails'))
+        report.timings['thumbnails'] = time.time() - start
+        report.record_sizes()
+        self.last_report = report
+        return report
+
+    def mix(self, inputs, inputs_maps, output, *args, **kwargs):
+        """
+        Mux streams of several media files with stream copy, and return a
+        report.ConversionReport.
 
-    def mix(self, *args, **kwargs):
-        return self.ffmpeg.mix(*args, **kwargs)
+        See the documentation of converter.FFMpeg.mix() for details.
+        """
+        report = ConversionReport([output])
+        start = time.time()
+        self.ffmpeg.mix(inputs, inputs_maps, output, *args, usage=report.phase('mix'), **kwargs)
+        report.timings['mix'] = time.time() - start
+        report.record_sizes()
+        self.last_report = report
+        return report
+
+    def concat(self, *args, **kwargs):
+        """
+        Join media files with stream copy.
+
+        See the documentation of converter.FFMpeg.concat() for details.
+        """
+        return self.ffmpeg.concat(*args, **kwargs)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class Branding(object):
+
+    """
+    Branding added to a converted video. Possible parameters are:
+      * intro (string) - bumper played before the content
+      * outro (string) - bumper played after the content
+      * logo (string) - image overlaid on the content
+      * logo_position (string) - one of top-left (default), top-right,
+        bottom-left, bottom-right
+      * logo_width (integer) - logo width in pixels, defaults to the
+        image width
+      * logo_margin (integer) - distance in pixels between the logo and
+        the frame borders, defaults to 10
+      * cache_dir (string) - directory of the pre-encoded bumpers. When set
+        and no logo is requested, the bumpers are encoded once per output
+        profile and joined to the content with stream copy, so only the
+        content itself is encoded.
+
+    Bumpers are fitted (scaled and padded) to the size of the content.
+    Bumpers or content without audio get a silent audio track.
+    """
+
+    branding_options = {
+        'intro': str,
+        'outro': str,
+        'logo': str,
+        'logo_position': str,
+        'logo_width': int,
+        'logo_margin': int,
+        'cache_dir': str,
+    }
+
+    logo_positions = {
+        'top-left': '%(m)d:%(m)d',
+        'top-right': 'main_w-overlay_w-%(m)d:%(m)d',
+        'bottom-left': '%(m)d:main_h-overlay_h-%(m)d',
+        'bottom-right': 'main_w-overlay_w-%(m)d:main_h-overlay_h-%(m)d',
+    }
+
+    def __init__(self, opt):
+        if not isinstance(opt, dict):
+            raise ValueError('Invalid branding specification')
+
+        safe = {}
+        for k, v in opt.items():
+            if k in self.branding_options and v is not None:
+                typ = self.branding_options[k]
+                try:
+                    safe[k] = typ(v)
+                except Exception:
+                    pass
+
+        self.intro = safe.get('intro')
+        self.outro = safe.get('outro')
+        self.logo = safe.get('logo')
+        self.logo_position = safe.get('logo_position', 'top-left')
+        self.logo_width = safe.get('logo_width')
+        self.logo_margin = safe.get('logo_margin', 10)
+        self.cache_dir = safe.get('cache_dir')
+
+        if not self.intro and not self.outro and not self.logo:
+            raise ValueError('Branding requires an intro, an outro or a logo')
+        if self.logo_position not in self.logo_positions:
+            raise ValueError('Invalid logo position: ' + self.logo_position)
+        if self.logo_width is not None and self.logo_width < 2:
+            self.logo_width = None
+        if self.logo_margin < 0:
+            self.logo_margin = 10
+
+    @property
+    def bumpers(self):
+        """
+        Intro and outro files, in playing order.
+        """
+        return [bumper for bumper in (self.intro, self.outro) if bumper]
+
+    def parse_options(self, info, bumper_infos, first_input=1, suffix=''):
+        """
+        Build the ffmpeg options adding the branding inputs and filter
+        graph to the conversion of a source described by info (MediaInfo).
+        bumper_infos maps each bumper to its MediaInfo.
+
+        The added inputs are numbered from first_input and suffix is
+        appended to the graph labels, so that several outputs of the same
+        ffmpeg process can be branded.
+
+        Returns a tuple of (option list, output maps).
+        """
+        optlist = []
+        graph = []
+        input_index = first_input
+        video = '[0:v:0]'
+
+        def label(name):
+            return '[%s%s]' % (name, suffix)
+
+        if self.logo:
+            optlist.extend(['-i', self.logo])
+            logo = '[%d:v:0]' % input_index
+            input_index += 1
+            if self.logo_width:
+                graph.append('%sscale=%d:-1%s' % (logo, self.logo_width, label('logo')))
+                logo = label('logo')
+            position = self.logo_positions[self.logo_position] % {'m': self.logo_margin}
+            video_out = label('mainv') if self.bumpers else label('outv')
+            graph.append('%s%soverlay=%s%s' % (video, logo, position, video_out))
+            video = video_out
+
+        if not self.bumpers:
+            optlist.extend(['-filter_complex', ';'.join(graph)])
+            return optlist, [label('outv'), '0:a:0?']
+
+        width = info.video.video_width
+        height = info.video.video_height
+        if str(info.video.metadata.get('rotate')) in ('90', '270'):
+            width, height = height, width
+        fit = 'scale=%d:%d:force_original_aspect_ratio=decrease,pad=%d:%d:(ow-iw)/2:(oh-ih)/2,setsar=1' % (
+            width, height, width, height)
+        samplerate = int(info.audio.audio_samplerate) if info.audio and info.audio.audio_samplerate else 48000
+
+        def silence(name, duration):
+            graph.append('anullsrc=r=%d:cl=stereo,atrim=duration=%.3f%s' % (
+                samplerate, duration or 0, label(name + 'a')))
+            return label(name + 'a')
+
+        segments = []
+        for name, bumper in (('intro', self.intro), ('main', None), ('outro', self.outro)):
+            if name == 'main':
+                graph.append('%s%s%s' % (video, fit, label('mainvf')))
+                audio = '[0:a:0]' if info.audio else silence(name, info.format.duration)
+                segments.append(label('mainvf') + audio)
+            elif bumper:
+                optlist.extend(['-i', bumper])
+                graph.append('[%d:v:0]%s%s' % (input_index, fit, label(name + 'v')))
+                bumper_info = bumper_infos[bumper]
+                if bumper_info.audio:
+                    audio = '[%d:a:0]' % input_index
+                else:
+                    audio = silence(name, bumper_info.format.duration)
+                segments.append(label(name + 'v') + audio)
+                input_index += 1
+
+        graph.append('%sconcat=n=%d:v=1:a=1%s%s' % (
+            ''.join(segments), len(segments), label('outv'), label('outa')))
+        optlist.extend(['-filter_complex', ';'.join(graph)])
+        return optlist, [label('outv'), label('outa')]
+
+
+class BumperCache(object):
+
+    """
+    Directory of bumpers pre-encoded with the options of an output, so
+    that they can be joined to the converted content with stream copy
+    instead of being encoded again for every video.
+
+    The cache key covers the bumper path, size and modification time and
+    the output options, so a changed bumper or profile is encoded again.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, bumper, options):
+        stat = os.stat(bumper)
+        data = json.dumps(
+            [os.path.abspath(bumper), stat.st_mtime, stat.st_size, options],
+            sort_keys=True, default=str)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def get(self, converter, bumper, options, extension):
+        """
+        Return the path of bumper encoded with options, encoding it with
+        converter first if it is not in the cache yet.
+        """
+        name = self.key(bumper, options)
+        path = os.path.join(self.directory, name + extension)
+        if os.path.exists(path):
+            return path
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # encode to a private file and rename it, concurrent jobs
+        # must never see a partial bumper
+        tmp_path = os.path.join(self.directory, '%s.%d.tmp%s' % (name, os.getpid(), extension))
+        logger.debug('Encoding bumper %s to %s', bumper, path)
+        try:
+            for _ in converter.convert(bumper, tmp_path, options):
+                pass
+            os.rename(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return path
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PresetCalibration(object):
+
+    """
+    Encoding throughput of the codec presets on this host, used to pick
+    the slowest (best quality) preset reaching a target speed.
+
+    Throughputs are measured in pixels per second by encoding a short
+    synthetic (lavfi) source, only for the presets needed to answer a
+    request, and refined by the conversions actually done. They are kept
+    in cache_dir (defaults to a directory in the system temporary
+    directory), keyed by host name, CPU count and ffmpeg binary.
+
+    >>> calibration = PresetCalibration(FFMpeg())
+    >>> calibration.select(H264Codec, 2.0, 1280, 720, 25)
+    'fast'
+    """
+
+    # weight of a new measure in the recorded throughput
+    refine_weight = 0.3
+
+    def __init__(self, ffmpeg, cache_dir=None, size=(1280, 720), fps=25, duration=1):
+        self.ffmpeg = ffmpeg
+        if cache_dir is None:
+            cache_dir = os.path.join(tempfile.gettempdir(), 'converter-calibration')
+        self.cache_dir = cache_dir
+        self.size = size
+        self.fps = fps
+        self.duration = duration
+
+        data = json.dumps([socket.gethostname(), multiprocessing.cpu_count(),
+                           os.path.abspath(ffmpeg.ffmpeg_path), os.stat(ffmpeg.ffmpeg_path).st_mtime])
+        self.path = os.path.join(self.cache_dir, hashlib.sha1(data.encode('utf-8')).hexdigest() + '.json')
+        try:
+            with open(self.path) as f:
+                self.rates = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.rates = {}
+
+    def save(self):
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.rates, f)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            logger.warning('Could not save the preset calibration in %s', self.cache_dir)
+
+    def measure(self, codec, preset):
+        """
+        Encode the synthetic source with the preset of codec (a video
+        codec class) and return the throughput in pixels per second.
+        """
+        width, height = self.size
+        cmds = [self.ffmpeg.ffmpeg_path, '-hide_banner', '-nostats', '-f', 'lavfi',
+                '-i', 'testsrc2=size=%dx%d:rate=%d:duration=%d' % (width, height, self.fps, self.duration)]
+        cmds.extend(codec().parse_options({'codec': codec.codec_name, 'preset': preset}))
+        cmds.extend(['-f', 'null', '-'])
+        start = time.time()
+        p = self.ffmpeg._start(cmds, 'calibration')
+        p.communicate()
+        self.ffmpeg._exited(p)
+        elapsed = max(time.time() - start, 0.001)
+        if p.returncode:
+            raise ValueError('Calibration of %s preset %s failed' % (codec.ffmpeg_codec_name, preset))
+        rate = width * height * self.fps * self.duration / elapsed
+        logger.debug('Calibrated %s preset %s: %d pixels/s', codec.ffmpeg_codec_name, preset, rate)
+        return rate
+
+    def rate(self, codec, preset):
+        """
+        Throughput of the preset of codec, measured first if unknown.
+        """
+        rates = self.rates.setdefault(codec.ffmpeg_codec_name, {})
+        if str(preset) not in rates:
+            rates[str(preset)] = self.measure(codec, preset)
+            self.save()
+        return rates[str(preset)]
+
+    def record(self, codec, preset, width, height, fps, duration, elapsed):
+        """
+        Refine the throughput of the preset of codec with a conversion of
+        duration seconds of width x height video at fps frames per second
+        done in elapsed seconds.
+        """
+        if not elapsed or not duration:
+            return
+        measured = width * height * fps * duration / elapsed
+        rates = self.rates.setdefault(codec.ffmpeg_codec_name, {})
+        previous = rates.get(str(preset))
+        if previous:
+            measured = previous * (1 - self.refine_weight) + measured * self.refine_weight
+        rates[str(preset)] = measured
+        self.save()
+
+    def select(self, codec, speed, width, height, fps):
+        """
+        Return the slowest preset of codec encoding width x height video
+        at fps frames per second at least speed times faster than real
+        time, or the fastest preset if none does.
+        """
+        pixels = float(width * height * fps)
+        selected = codec.presets[0]
+        for preset in codec.presets:
+            if self.rate(codec, preset) / pixels < speed:
+                break
+            selected = preset
+        return selected
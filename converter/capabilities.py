@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class Capabilities(object):
+
+    """
+    Encoders, filters, pixel formats and muxers available in the ffmpeg
+    binary of an FFMpeg wrapper, which runs the queries (and tells its
+    instrumentation about them). The attributes are sets of names:
+      * encoders - eg. 'libx264', 'aac'
+      * filters - eg. 'scale', 'overlay'
+      * pix_fmts - pixel formats usable as encoder output
+      * muxers - eg. 'mp4', 'matroska'
+
+    Listing them takes several ffmpeg runs, so the result is kept in
+    cache_dir (defaults to a directory in the system temporary directory),
+    keyed by the binary path, modification time and size: ffmpeg is only
+    run when the binary was replaced (rebuilt or upgraded) since it was
+    last queried. The version attribute is the first line of ffmpeg
+    -version.
+
+    >>> caps = Capabilities(FFMpeg())
+    >>> 'libx264' in caps.encoders
+    True
+    """
+
+    sections = {
+        'encoders': '-encoders',
+        'filters': '-filters',
+        'pix_fmts': '-pix_fmts',
+        'muxers': '-muxers',
+    }
+
+    def __init__(self, ffmpeg, cache_dir=None):
+        self.ffmpeg = ffmpeg
+        if cache_dir is None:
+            cache_dir = os.path.join(tempfile.gettempdir(), 'converter-capabilities')
+        self.cache_dir = cache_dir
+        self.version = None
+        self.encoders = set()
+        self.filters = set()
+        self.pix_fmts = set()
+        self.muxers = set()
+        self.load()
+
+    def _run(self, option):
+        p = self.ffmpeg._start([self.ffmpeg.ffmpeg_path, '-hide_banner', option], 'capabilities')
+        stdout_data, _ = p.communicate()
+        self.ffmpeg._exited(p)
+        return stdout_data.decode('utf-8', 'replace')
+
+    def key(self):
+        path = os.path.realpath(self.ffmpeg.ffmpeg_path)
+        stat = os.stat(path)
+        data = json.dumps([path, stat.st_mtime, stat.st_size])
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def load(self):
+        """
+        Read the capabilities from the cache, querying ffmpeg and filling
+        the cache first if needed.
+        """
+        path = os.path.join(self.cache_dir, self.key() + '.json')
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+        except (IOError, OSError, ValueError):
+            cached = None
+
+        if cached is None:
+            logger.debug('Querying capabilities of %s', self.ffmpeg.ffmpeg_path)
+            cached = {'version': self._run('-version').split('\n')[0].strip()}
+            for name, option in self.sections.items():
+                cached[name] = sorted(getattr(self, 'parse_' + name)(self._run(option)))
+            try:
+                if not os.path.isdir(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+                fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(cached, f)
+                os.rename(tmp_path, path)
+            except (IOError, OSError):
+                logger.warning('Could not cache the capabilities of %s in %s', self.ffmpeg.ffmpeg_path,
+                               self.cache_dir)
+
+        self.version = cached.get('version')
+        for name in self.sections:
+            setattr(self, name, set(cached.get(name, [])))
+
+    @staticmethod
+    def _table(raw):
+        # entries of the codec, muxer and pixel format lists follow
+        # a legend ended by a dashed line
+        lines = raw.split('\n')
+        for index, line in enumerate(lines):
+            if line.strip().startswith('--'):
+                return [line.split() for line in lines[index + 1:] if line.strip()]
+        return []
+
+    @staticmethod
+    def parse_encoders(raw):
+        return set(fields[1] for fields in Capabilities._table(raw) if len(fields) > 1)
+
+    @staticmethod
+    def parse_filters(raw):
+        return set(fields[1] for fields in (line.split() for line in raw.split('\n'))
+                   if len(fields) > 2 and '->' in fields[2])
+
+    @staticmethod
+    def parse_pix_fmts(raw):
+        return set(fields[1] for fields in Capabilities._table(raw) if len(fields) > 1 and fields[0][1:2] == 'O')
+
+    @staticmethod
+    def parse_muxers(raw):
+        muxers = set()
+        for fields in Capabilities._table(raw):
+            if len(fields) > 1 and 'E' in fields[0]:
+                muxers.update(fields[1].split(','))
+        return muxers
@@ -35,12 +35,24 @@ class BaseCodec(with_metaclass(MetaBaseCodec, object)):
     encoder_options = {}
     codec_name = None
     ffmpeg_codec_name = None
+    probe_codec_name = None  # codec name reported by ffprobe, if not codec_name
+    fallback_codec_name = None  # codec used instead if ffmpeg lacks the encoder
 
     def parse_options(self, opt):
         if 'codec' not in opt or opt['codec'] != self.codec_name:
             raise ValueError('invalid codec name')
         return None
 
+    def can_copy(self, opt, stream):
+        """
+        Tell whether the source stream (a MediaStreamInfo) already matches
+        options opt, so it can be copied instead of being encoded.
+        Returns a (boolean, reason) tuple.
+        """
+        if stream.codec != (self.probe_codec_name or self.codec_name):
+            return False, 'codec %s is not %s' % (stream.codec, self.probe_codec_name or self.codec_name)
+        return True, 'matches the requested options'
+
     def _codec_specific_parse_options(self, safe):
         return safe
 
@@ -60,6 +60,26 @@ class AudioCodec(BaseCodec):
             optlist.extend(['-filter:a', str(opt['filter'])])
         return optlist
 
+    def can_copy(self, opt, stream):
+        copy, reason = super(AudioCodec, self).can_copy(opt, stream)
+        if not copy:
+            return copy, reason
+
+        if 'filter' in opt:
+            return False, 'audio filter requested'
+
+        safe = self.safe_options(opt)
+        if 'channels' in safe and (stream.audio_channels or 0) > safe['channels']:
+            return False, '%s channels is above %d' % (stream.audio_channels, safe['channels'])
+        if 'samplerate' in safe and stream.audio_samplerate != safe['samplerate']:
+            return False, 'sample rate %s is not %d' % (stream.audio_samplerate, safe['samplerate'])
+        if 'bitrate' in safe:
+            if stream.bitrate is None:
+                return False, 'unknown bitrate'
+            if stream.bitrate > safe['bitrate'] * 1000:
+                return False, 'bitrate %d is above %dk' % (stream.bitrate, safe['bitrate'])
+        return True, reason
+
 
 class AudioNullCodec(AudioCodec):
 
@@ -139,6 +159,8 @@ class FdkAacCodec(AudioCodec):
     """
     codec_name = 'libfdk_aac'
     ffmpeg_codec_name = 'libfdk_aac'
+    probe_codec_name = 'aac'
+    fallback_codec_name = 'aac'
     encoder_options = AudioCodec.encoder_options.copy()
     encoder_options.update({
         'quality': int,  # audio quality. Range is 1-5(highest quality)
@@ -229,3 +251,4 @@ class WmaCodec(AudioCodec):
     """
     codec_name = "wma"
     ffmpeg_codec_name = "wmav2"
+    probe_codec_name = "wmav2"
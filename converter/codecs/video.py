@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import logging
+from converter.filters import FilterChain
 from . import BaseCodec
 
 logger = logging.getLogger(__name__)
@@ -13,7 +14,9 @@ class VideoCodec(BaseCodec):
 
     Possible parameters are:
       * codec (string) - video codec name
-      * pix_fmt (string) - pixel format
+      * pix_fmt (string) - pixel format, defaults to yuv420p. With 'auto',
+        the source pixel format (src_pix_fmt) is kept when the encoder
+        accepts it, and converted to the encoder preferred format otherwise
       * bitrate (string) - stream bitrate
       * min_bitrate (string) - minimum stream bitrate
       * max_bitrate (string) - maximum stream bitrate
@@ -25,8 +28,27 @@ class VideoCodec(BaseCodec):
             * stretch (default) - don't preserve aspect
             * crop - crop extra w/h
             * pad - pad with black bars
+            * autocrop - remove the black bars of the source (see
+              crop), then scale within the requested size keeping
+              the aspect ratio of the remaining picture
+      * crop (string) - source rectangle kept in autocrop mode, as
+        width:height:x:y (see Converter.detect_crop)
       * src_width (int) - source width
       * src_height (int) - source height
+      * src_pix_fmt (string) - source pixel format
+      * scaler (string) - scaling algorithm, one of the scalers below
+        (ffmpeg defaults to bicubic); fast_bilinear or bilinear are
+        enough for previews and proxies
+      * filter_threads (integer) - threads used by the -vf filters
+      * filter_complex_threads (integer) - threads used by the
+        -filter_complex graphs
+        (both are ffmpeg global options: they apply to the whole
+        conversion and must be the same for all its outputs, see
+        global_options)
+      * decimate (boolean) - drop the frames nearly identical to the
+        previous one (mpdecimate), for slides or screen captures; the
+        output has a variable frame rate if the format allows it, fps
+        being then its maximum
 
     Aspect preserval mode is only used if both source
     and both destination sizes are specified. If source
@@ -37,8 +59,8 @@ class VideoCodec(BaseCodec):
     is calculated to preserve the aspect ratio.
 
     Supported video codecs are: null (no video), copy (copy directly
-    from the source), Theora, H.264/AVC, DivX, VP8, H.263, Flv,
-    MPEG-1, MPEG-2, WMV.
+    from the source), Theora, H.264/AVC, H.265/HEVC, AV1 (SVT-AV1), DivX,
+    VP8, VP9, H.263, Flv, MPEG-1, MPEG-2, WMV.
     """
 
     codec_type = "video"
@@ -55,13 +77,33 @@ class VideoCodec(BaseCodec):
         'mode': str,
         'src_width': int,
         'src_height': int,
+        'src_pix_fmt': str,
         'display_aspect_ratio': float,
         'sample_aspect_ratio': float,
         'rotate': str,
         'threads': int,  # Threads count (no value to use recommended count)
+        'scaler': str,
+        'filter_threads': int,
+        'filter_complex_threads': int,
+        'decimate': bool,
+        'crop': str,
     }
 
-    formats_supported = [
+    # options overriding the requested ones in draft mode
+    draft_options = {'scaler': 'fast_bilinear'}
+
+    # encoder presets, fastest first, see Converter.convert target_speed
+    presets = ()
+
+    scalers = ('fast_bilinear', 'bilinear', 'bicubic', 'experimental', 'neighbor', 'area', 'bicublin',
+               'gauss', 'sinc', 'lanczos', 'spline')
+
+    # pixel formats accepted by the encoder, preferred first
+    pix_fmts = ('yuv420p',)
+
+    # known pixel formats; Converter(check_capabilities=True) checks the
+    # formats of the actual ffmpeg binary instead
+    formats_supported = frozenset([
         "yuv420p", "yuyv422", "rgb24", "bgr24", "yuv422p", "yuv444p", "yuv410p",
         "yuv411p", "gray", "monow", "monob", "pal8", "yuvj420p", "yuvj422p",
         "yuvj444p", "xvmcmc", "xvmcidct", "uyvy422", "uyyvyy411", "bgr8",
@@ -91,7 +133,7 @@ class VideoCodec(BaseCodec):
         "bayer_rggb16be", "bayer_gbrg16le", "bayer_gbrg16be", "bayer_grbg16le",
         "bayer_grbg16be", "yuv440p10le", "yuv440p10be", "yuv440p12le", "yuv440p12be",
         "ayuv64le", "ayuv64be", "videotoolbox_vld",
-    ]
+    ])
 
     def _aspect_corrections(self, sw, sh, w, h, sar, rotate, mode):
         # If we don't have source info, we don't try to calculate
@@ -130,18 +172,18 @@ class VideoCodec(BaseCodec):
 
         target_aspect = (1.0 * w) / (1.0 * h)
 
+        # crop the source picture (centered) before scaling it, so it is
+        # scaled once directly to the target size
         if mode == 'crop':
             # source is taller, need to crop top/bottom
             if target_aspect > aspect:  # target is taller
                 h0 = int(w / aspect)
                 assert h0 > h, (sw, sh, w, h)
-                dh = (h0 - h) / 2
-                return w, h0, 'crop=%d:%d:0:%d' % (w, h, dh)
+                return w, h, 'crop=iw:ih*%d/%d' % (h, h0)
             else:  # source is wider, need to crop left/right
                 w0 = int(h * aspect)
                 assert w0 > w, (sw, sh, w, h)
-                dw = (w0 - w) / 2
-                return w0, h, 'crop=%d:%d:%d:0' % (w, h, dw)
+                return w, h, 'crop=iw*%d/%d:ih' % (w, w0)
 
         if mode == 'pad':
             # target is taller, need to pad top/bottom
@@ -158,6 +200,31 @@ class VideoCodec(BaseCodec):
 
         assert False, mode
 
+    def _parse_pix_fmt(self, safe):
+        if 'pix_fmt' in safe:
+            pix_fmt = safe['pix_fmt']
+            if pix_fmt not in self.formats_supported and pix_fmt != 'auto':
+                del safe['pix_fmt']
+
+        # resolve the automatic format, None keeps the source one
+        pix_fmt = safe.get('pix_fmt', 'yuv420p')
+        if pix_fmt == 'auto':
+            pix_fmt = None if safe.get('src_pix_fmt') in self.pix_fmts else self.pix_fmts[0]
+        safe['pix_fmt'] = pix_fmt
+        return safe
+
+    def pix_fmt_conversion(self, opt):
+        """
+        Tell whether encoding with options opt converts the source pixel
+        format (src_pix_fmt). Returns a (source, target) tuple, or None if
+        the source format is kept or unknown.
+        """
+        safe = self._parse_pix_fmt(self.safe_options(opt))
+        source = safe.get('src_pix_fmt')
+        if not source or not safe['pix_fmt'] or safe['pix_fmt'] == source:
+            return None
+        return source, safe['pix_fmt']
+
     def parse_options(self, opt):
         super(VideoCodec, self).parse_options(opt)
 
@@ -188,16 +255,17 @@ class VideoCodec(BaseCodec):
             if mb < 16 or mb > 15000:
                 del safe['max_bitrate']
 
-        if 'pix_fmt' in safe:
-            pix_fmt = safe['pix_fmt']
-            if pix_fmt in self.formats_supported:
-                del safe['pix_fmt']
+        safe = self._parse_pix_fmt(safe)
 
         if 'threads' in safe:
             t = safe['threads']
             if t < 1:
                 del safe['threads']
 
+        if 'scaler' in safe:
+            if safe['scaler'] not in self.scalers:
+                del safe['scaler']
+
         sar = safe.get('sample_aspect_ratio')
         rotate = safe.get('rotate')
 
@@ -236,28 +304,74 @@ class VideoCodec(BaseCodec):
 
         mode = 'stretch'
         if 'mode' in safe:
-            if safe['mode'] in ('stretch', 'crop', 'pad'):
+            if safe['mode'] in ('stretch', 'crop', 'pad', 'autocrop'):
                 mode = safe['mode']
 
+        crop = None
+        if 'crop' in safe:
+            try:
+                crop = tuple(int(v) for v in safe['crop'].split(':'))
+            except ValueError:
+                pass
+            if not crop or len(crop) != 4 or min(crop[:2]) < 16 or min(crop[2:]) < 0:
+                crop = None
+
+        # every codec adds its filters to the same chain, emitted as a
+        # single -vf
+        filters = FilterChain()
+        if safe.get('decimate'):
+            filters.add('decimate', 'mpdecimate')
+
         ow, oh = w, h  # FIXED
-        w, h, filters = self._aspect_corrections(sw, sh, w, h, sar, rotate, mode)
+        if mode == 'autocrop':
+            if crop:
+                # cropdetect works on the rotated picture
+                filters.add('crop', 'crop=%d:%d:%d:%d' % crop)
+                sw, sh, rotate = crop[0], crop[1], None
+            # fitting the picture in the requested size is like padding it,
+            # without the padding
+            w, h, _ = self._aspect_corrections(sw, sh, w, h, sar, rotate, 'pad')
+            if ow and oh:
+                ow, oh = w, h
+            correction = None
+        else:
+            w, h, correction = self._aspect_corrections(sw, sh, w, h, sar, rotate, mode)
+
+        if w and h:
+            if 'scaler' in safe:
+                filters.add('scale', 'scale=%d:%d:flags=%s' % (w, h, safe['scaler']))
+            else:
+                filters.add('scale', 'scale=%d:%d' % (w, h))
+        if correction:
+            filters.add(mode, correction)
 
         safe['width'] = w
         safe['height'] = h
-        safe['aspect_filters'] = filters
+        safe['filters'] = filters
 
-        if w and h:
+        if ow and oh:
+            safe['aspect'] = '%d:%d' % (ow, oh)
+        elif w and h:
             safe['aspect'] = '%d:%d' % (w, h)
 
         safe = self._codec_specific_parse_options(safe)
 
         w = safe['width']
         h = safe['height']
-        filters = safe['aspect_filters']
+        if 'fps' in safe and str(safe['filters']) and not safe.get('decimate'):
+            # drop the frames before they are filtered, -r alone would
+            # drop them at the end of the chain
+            safe['filters'].add('fps', 'fps=%s' % safe['fps'])
+        filters = str(safe['filters'])
 
         optlist = ['-codec:v', self.ffmpeg_codec_name]
-        optlist.extend(['-pix_fmt', str(safe['pix_fmt'] if 'pix_fmt' in safe else 'yuv420p')])
-        if 'fps' in safe:
+        if safe['pix_fmt']:
+            optlist.extend(['-pix_fmt', safe['pix_fmt']])
+        if 'fps' in safe and safe.get('decimate'):
+            # -r would duplicate the dropped frames back to a constant
+            # rate, the rate is only capped
+            optlist.extend(['-fpsmax', str(safe['fps'])])
+        elif 'fps' in safe:
             optlist.extend(['-r', str(safe['fps'])])
         if 'keyframe_interval' in safe:
             optlist.extend(['-g', str(safe['keyframe_interval'])])
@@ -267,21 +381,67 @@ class VideoCodec(BaseCodec):
             optlist.extend(['-minrate', str(safe['min_bitrate']) + 'k'])
         if 'max_bitrate' in safe:
             optlist.extend(['-maxrate', str(safe['max_bitrate']) + 'k', '-bufsize', str(safe['max_bitrate']) + 'k'])
-        if w and h:
-            optlist.extend(['-s', '%dx%d' % (w, h)])
-
-            if ow and oh:
-                optlist.extend(['-aspect', '%d:%d' % (ow, oh)])
+        if w and h and ow and oh:
+            optlist.extend(['-aspect', '%d:%d' % (ow, oh)])
 
         if filters:
             optlist.extend(['-vf', filters])
 
         if 'threads' in safe:
             optlist.extend(['-threads', str(safe['threads'])])
+        if 'scaler' in safe:
+            # also used by the conversions ffmpeg inserts (eg. pixel format)
+            optlist.extend(['-sws_flags', safe['scaler']])
 
         optlist.extend(self._codec_specific_produce_ffmpeg_list(safe))
         return optlist
 
+    def global_options(self, opt):
+        """
+        Return the ffmpeg options of opt applying to the whole ffmpeg
+        process rather than to this output: filter_threads and
+        filter_complex_threads.
+        """
+        safe = self.safe_options(opt)
+        optlist = []
+        for k in ('filter_threads', 'filter_complex_threads'):
+            if k in safe and 1 <= safe[k] <= 64:
+                optlist.extend(['-' + k, str(safe[k])])
+        return optlist
+
+    def can_copy(self, opt, stream):
+        copy, reason = super(VideoCodec, self).can_copy(opt, stream)
+        if not copy:
+            return copy, reason
+
+        safe = self.safe_options(opt)
+        if safe.get('rotate') in ('90', '180', '270'):
+            return False, 'rotation must be applied'
+        if safe.get('decimate'):
+            return False, 'decimation requested'
+        if safe.get('mode') == 'autocrop' and safe.get('crop'):
+            return False, 'crop requested'
+        if 'width' in safe and (stream.video_width or 0) > safe['width']:
+            return False, 'width %s is above %d' % (stream.video_width, safe['width'])
+        if 'height' in safe and (stream.video_height or 0) > safe['height']:
+            return False, 'height %s is above %d' % (stream.video_height, safe['height'])
+        if 'fps' in safe and (stream.video_fps or 0) > safe['fps'] + 0.01:
+            return False, 'frame rate %s is above %s' % (stream.video_fps, safe['fps'])
+        pix_fmt = safe.get('pix_fmt', 'yuv420p')
+        if pix_fmt == 'auto':
+            if stream.video_pixel_format not in self.pix_fmts:
+                return False, 'pixel format %s is not supported' % stream.video_pixel_format
+        elif stream.video_pixel_format != pix_fmt:
+            return False, 'pixel format %s is not %s' % (stream.video_pixel_format, pix_fmt)
+        # the requested bitrate is a cap, as for the audio
+        for k in ('bitrate', 'max_bitrate'):
+            if k in safe:
+                if stream.bitrate is None:
+                    return False, 'unknown bitrate'
+                if stream.bitrate > safe[k] * 1000:
+                    return False, 'bitrate %d is above %dk' % (stream.bitrate, safe[k])
+        return True, reason
+
 
 class VideoNullCodec(VideoCodec):
     """Null video codec (no video)."""
@@ -310,6 +470,7 @@ class TheoraCodec(VideoCodec):
 
     codec_name = 'theora'
     ffmpeg_codec_name = 'libtheora'
+    pix_fmts = ('yuv420p', 'yuv422p', 'yuv444p')
     encoder_options = VideoCodec.encoder_options.copy()
     encoder_options.update({
         'quality': int,  # audio quality. Range is 0-10(highest quality)
@@ -339,6 +500,7 @@ class H264Codec(VideoCodec):
 
     codec_name = 'h264'
     ffmpeg_codec_name = 'libx264'
+    pix_fmts = ('yuv420p', 'yuvj420p', 'yuv422p', 'yuvj422p', 'yuv444p', 'yuvj444p', 'nv12', 'nv21')
     encoder_options = VideoCodec.encoder_options.copy()
     encoder_options.update({
         'preset': str,  # common presets are ultrafast, superfast, veryfast,
@@ -350,12 +512,48 @@ class H264Codec(VideoCodec):
         'level': str,  # default: not-set, for valid values see above link
         'tune': str,  # default: not-set, for valid values see above link
     })
+    draft_options = dict(VideoCodec.draft_options, preset='ultrafast')
+    presets = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow')
+
+    # profiles in the order of the features they allow, as named by x264
+    # (and by ffprobe, once lowercased without spaces and colons)
+    profile_ranks = {'constrainedbaseline': 0, 'baseline': 1, 'main': 2, 'high': 3, 'high10': 4, 'high422': 5,
+                     'high444': 6, 'high444predictive': 6}
+
+    @staticmethod
+    def _parse_level(level):
+        # '3.1' or '31' as 31, the form of the probed levels
+        try:
+            value = float(level)
+        except (TypeError, ValueError):
+            return None
+        return int(round(value * 10)) if value < 10 else int(value)
+
+    def can_copy(self, opt, stream):
+        copy, reason = super(H264Codec, self).can_copy(opt, stream)
+        if not copy:
+            return copy, reason
+
+        safe = self.safe_options(opt)
+        if 'profile' in safe:
+            requested = self.profile_ranks.get(safe['profile'].lower())
+            source = self.profile_ranks.get((stream.profile or '').lower().replace(' ', '').replace(':', ''))
+            if requested is None or source is None or source > requested:
+                return False, 'profile %s is not within %s' % (stream.profile, safe['profile'])
+        if 'level' in safe:
+            requested = self._parse_level(safe['level'])
+            if requested is None or stream.level is None or stream.level > requested:
+                return False, 'level %s is above %s' % (stream.level, safe['level'])
+        return True, reason
 
     def _codec_specific_parse_options(self, safe):
         if 'quality' in safe:
             q = safe['quality']
             if q < 0 or q > 51:
                 del safe['quality']
+        if safe.get('decimate') and 'tune' not in safe:
+            # few, mostly static frames
+            safe['tune'] = 'stillimage'
         return safe
 
     def _codec_specific_produce_ffmpeg_list(self, safe):
@@ -373,6 +571,136 @@ class H264Codec(VideoCodec):
         return optlist
 
 
+class H265Codec(VideoCodec):
+    """
+    H.265/HEVC video codec.
+
+    @see https://trac.ffmpeg.org/wiki/Encode/H.265
+    """
+
+    codec_name = 'h265'
+    ffmpeg_codec_name = 'libx265'
+    probe_codec_name = 'hevc'
+    pix_fmts = ('yuv420p', 'yuvj420p', 'yuv422p', 'yuvj422p', 'yuv444p', 'yuvj444p')
+    encoder_options = VideoCodec.encoder_options.copy()
+    encoder_options.update({
+        'preset': str,  # same presets as H.264, default: medium
+        'quality': int,  # constant rate factor, range:0(lossless)-51(worst)
+        # default:28, recommended: 24-32
+        'profile': str,  # default: not-set, eg. main, main10
+        'tune': str,  # default: not-set, eg. grain, fastdecode, zerolatency
+        'frame_threads': int,  # frames encoded in parallel, range:1-16
+        # default: detected from the CPU count
+        'pools': str,  # thread pools, eg. '8', '+' (all cores), 'none'
+        # or a count per NUMA node like '4,4'
+    })
+    draft_options = dict(VideoCodec.draft_options, preset='ultrafast')
+    presets = H264Codec.presets
+
+    def _codec_specific_parse_options(self, safe):
+        if 'quality' in safe:
+            q = safe['quality']
+            if q < 0 or q > 51:
+                del safe['quality']
+        if 'frame_threads' in safe:
+            t = safe['frame_threads']
+            if t < 1 or t > 16:
+                del safe['frame_threads']
+        if 'pools' in safe:
+            if not safe['pools'] or ':' in safe['pools']:
+                del safe['pools']
+        return safe
+
+    def _codec_specific_produce_ffmpeg_list(self, safe):
+        optlist = []
+        if 'preset' in safe:
+            optlist.extend(['-preset', safe['preset']])
+        if 'quality' in safe:
+            optlist.extend(['-crf', str(safe['quality'])])
+        if 'profile' in safe:
+            optlist.extend(['-profile:v', safe['profile']])
+        if 'tune' in safe:
+            optlist.extend(['-tune', safe['tune']])
+        params = []
+        if 'frame_threads' in safe:
+            params.append('frame-threads=%d' % safe['frame_threads'])
+        if 'pools' in safe:
+            params.append('pools=%s' % safe['pools'])
+        if params:
+            optlist.extend(['-x265-params', ':'.join(params)])
+        return optlist
+
+
+class SvtAv1Codec(VideoCodec):
+    """
+    AV1 video codec, using the SVT-AV1 encoder.
+
+    @see https://trac.ffmpeg.org/wiki/Encode/AV1#SVT-AV1
+    """
+
+    codec_name = 'av1'
+    ffmpeg_codec_name = 'libsvtav1'
+    pix_fmts = ('yuv420p', 'yuv420p10le')
+    encoder_options = VideoCodec.encoder_options.copy()
+    encoder_options.update({
+        'preset': int,  # speed, range:0(slowest)-13(fastest), default:10
+        'quality': int,  # constant rate factor, range:0(best)-63(worst)
+        # default:35
+        'tune': int,  # 0: visual quality, 1: PSNR (default), 2: SSIM
+        'level_of_parallelism': int,  # threads used by the encoder,
+        # range:1-6 (more threads, more memory), default: detected
+        'tile_columns': int,  # log2 of the tile columns, range:0-4
+        'tile_rows': int,  # log2 of the tile rows, range:0-6
+    })
+    draft_options = dict(VideoCodec.draft_options, preset=12)
+    presets = tuple(range(13, -1, -1))
+
+    def _codec_specific_parse_options(self, safe):
+        if 'preset' in safe:
+            p = safe['preset']
+            if p < 0 or p > 13:
+                del safe['preset']
+        if 'quality' in safe:
+            q = safe['quality']
+            if q < 0 or q > 63:
+                del safe['quality']
+        if 'tune' in safe:
+            if safe['tune'] not in (0, 1, 2):
+                del safe['tune']
+        if 'level_of_parallelism' in safe:
+            lp = safe['level_of_parallelism']
+            if lp < 1 or lp > 6:
+                del safe['level_of_parallelism']
+        if 'tile_columns' in safe:
+            tc = safe['tile_columns']
+            if tc < 0 or tc > 4:
+                del safe['tile_columns']
+        if 'tile_rows' in safe:
+            tr = safe['tile_rows']
+            if tr < 0 or tr > 6:
+                del safe['tile_rows']
+        return safe
+
+    def _codec_specific_produce_ffmpeg_list(self, safe):
+        optlist = []
+        if 'preset' in safe:
+            optlist.extend(['-preset', str(safe['preset'])])
+        if 'quality' in safe:
+            optlist.extend(['-crf', str(safe['quality'])])
+        params = []
+        if 'tune' in safe:
+            params.append('tune=%d' % safe['tune'])
+        if 'level_of_parallelism' in safe:
+            params.append('lp=%d' % safe['level_of_parallelism'])
+        if 'tile_columns' in safe:
+            params.append('tile-columns=%d' % safe['tile_columns'])
+        if 'tile_rows' in safe:
+            params.append('tile-rows=%d' % safe['tile_rows'])
+        if params:
+            optlist.extend(['-svtav1-params', ':'.join(params)])
+        return optlist
+
+
 class VaapiH264Codec(VideoCodec):
     """
     H.264/AVC video codec.
@@ -382,6 +710,8 @@ class VaapiH264Codec(VideoCodec):
 
     codec_name = 'h264_vaapi'
     ffmpeg_codec_name = 'h264_vaapi'
+    probe_codec_name = 'h264'
+    fallback_codec_name = 'h264'
     encoder_options = VideoCodec.encoder_options.copy()
     encoder_options.update({
         'preset': str,  # common presets are ultrafast, superfast, veryfast,
@@ -397,12 +727,13 @@ class VaapiH264Codec(VideoCodec):
             q = safe['quality']
             if q < 0 or q > 51:
                 del safe['quality']
+        # ffmpeg must run with -vaapi_device /dev/dri/renderD128 -hwaccel vaapi -hwaccel_output_format vaapi before -i
+        safe['filters'].add('format', 'format=nv12|vaapi')
+        safe['filters'].add('hwupload', 'hwupload')
         return safe
 
     def _codec_specific_produce_ffmpeg_list(self, safe):
         optlist = []
-        # ffmpeg must run with -vaapi_device /dev/dri/renderD128 -hwaccel vaapi -hwaccel_output_format vaapi before -i
-        optlist.extend(['-vf', 'format=nv12|vaapi,hwupload'])
         if 'preset' in safe:
             optlist.extend(['-preset', safe['preset']])
         if 'quality' in safe:
@@ -419,6 +750,7 @@ class DivxCodec(VideoCodec):
 
     codec_name = 'divx'
     ffmpeg_codec_name = 'mpeg4'
+    probe_codec_name = 'mpeg4'
     encoder_options = VideoCodec.encoder_options.copy()
     encoder_options.update({
         'quality': int,  # quality, range:1(lossless)-31(worst)
@@ -445,6 +777,7 @@ class Vp8Codec(VideoCodec):
 
     codec_name = 'vp8'
     ffmpeg_codec_name = 'libvpx'
+    pix_fmts = ('yuv420p', 'yuva420p')
     encoder_options = VideoCodec.encoder_options.copy()
     encoder_options.update({
         'quality': int,  # quality, range:4(lossless)-63(worst)
@@ -472,6 +805,7 @@ class Vp9Codec(VideoCodec):
 
     codec_name = 'vp9'
     ffmpeg_codec_name = 'libvpx-vp9'
+    pix_fmts = ('yuv420p', 'yuva420p', 'yuv422p', 'yuv440p', 'yuv444p')
     encoder_options = VideoCodec.encoder_options.copy()
     encoder_options.update({
         'quality': int,  # quality, range:0(lossless)-63(worst)
@@ -506,6 +840,7 @@ class FlvCodec(VideoCodec):
 
     codec_name = 'flv'
     ffmpeg_codec_name = 'flv'
+    probe_codec_name = 'flv1'
 
 
 class MpegCodec(VideoCodec):
@@ -520,21 +855,10 @@ class MpegCodec(VideoCodec):
 
     # Workaround for a bug in ffmpeg in which aspect ratio
     # is not correctly preserved, so we have to set it
-    # again in vf; take care to put it *before* crop/pad, so
-    # it uses the same adjusted dimensions as the codec itself
-    # (pad/crop will adjust it further if neccessary)
+    # again in vf, once the picture has its final size
     def _codec_specific_parse_options(self, safe):
-        w = safe['width']
-        h = safe['height']
-
-        if w and h:
-            filters = safe['aspect_filters']
-            tmp = 'aspect=%d:%d' % (w, h)
-
-            if filters is None:
-                safe['aspect_filters'] = tmp
-            else:
-                safe['aspect_filters'] = tmp + ',' + filters
+        if 'aspect' in safe:
+            safe['filters'].add('aspect', 'setdar=%s' % safe['aspect'].replace(':', '/'))
 
         if 'quality' in safe:
             q = safe['quality']
@@ -555,6 +879,7 @@ class Mpeg1Codec(MpegCodec):
 
     codec_name = 'mpeg1'
     ffmpeg_codec_name = 'mpeg1video'
+    probe_codec_name = 'mpeg1video'
 
 
 class Mpeg2Codec(MpegCodec):
@@ -562,6 +887,8 @@ class Mpeg2Codec(MpegCodec):
 
     codec_name = 'mpeg2'
     ffmpeg_codec_name = 'mpeg2video'
+    probe_codec_name = 'mpeg2video'
+    pix_fmts = ('yuv420p', 'yuv422p')
 
 
 class WmvCodec(VideoCodec):
@@ -569,6 +896,7 @@ class WmvCodec(VideoCodec):
 
     codec_name = 'wmv'
     ffmpeg_codec_name = 'msmpeg4'
+    probe_codec_name = 'msmpeg4v3'
     encoder_options = VideoCodec.encoder_options.copy()
     encoder_options.update({
         'quality': int,  # quality, range:1(lossless)-31(worst)
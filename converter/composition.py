@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+class Composition(object):
+
+    """
+    Layout of several video sources (eg. slides and camera) composed into
+    a single picture. Possible parameters are:
+      * type (string) - one of:
+            * side_by_side (default) - inputs scaled to the same height
+              and stacked horizontally
+            * pip - picture in picture, the second input is overlaid as
+              an inset on the first one
+      * height (integer) - side_by_side only, height of the stacked
+        inputs, defaults to the smallest input height
+      * main (integer) - pip only, index of the background input
+        (default 0)
+      * position (string) - pip only, position of the inset: one of
+        top-left, top-right, bottom-left, bottom-right (default)
+      * scale (float) - pip only, inset width relative to the background
+        width (default 0.25)
+      * margin (integer) - pip only, distance in pixels between the inset
+        and the frame borders (default 10)
+      * audio (integer) - index of the input providing the audio, defaults
+        to the first input having an audio stream
+
+    The inputs are synchronized using the start time of their video
+    streams: inputs starting later are delayed (padded with black frames
+    and silence) by the difference.
+    """
+
+    layout_options = {
+        'type': str,
+        'height': int,
+        'main': int,
+        'position': str,
+        'scale': float,
+        'margin': int,
+        'audio': int,
+    }
+
+    inset_positions = {
+        'top-left': '%(m)d:%(m)d',
+        'top-right': 'main_w-overlay_w-%(m)d:%(m)d',
+        'bottom-left': '%(m)d:main_h-overlay_h-%(m)d',
+        'bottom-right': 'main_w-overlay_w-%(m)d:main_h-overlay_h-%(m)d',
+    }
+
+    def __init__(self, opt=None):
+        if opt is None:
+            opt = {}
+        if not isinstance(opt, dict):
+            raise ValueError('Invalid layout specification')
+
+        safe = {}
+        for k, v in opt.items():
+            if k in self.layout_options and v is not None:
+                typ = self.layout_options[k]
+                try:
+                    safe[k] = typ(v)
+                except Exception:
+                    pass
+
+        self.type = safe.get('type', 'side_by_side')
+        self.height = safe.get('height')
+        self.main = safe.get('main', 0)
+        self.position = safe.get('position', 'bottom-right')
+        self.scale = safe.get('scale', 0.25)
+        self.margin = safe.get('margin', 10)
+        self.audio = safe.get('audio')
+
+        if self.type not in ('side_by_side', 'pip'):
+            raise ValueError('Invalid layout type: ' + self.type)
+        if self.position not in self.inset_positions:
+            raise ValueError('Invalid inset position: ' + self.position)
+        if self.height is not None and (self.height < 16 or self.height > 9000):
+            self.height = None
+        if self.scale <= 0 or self.scale >= 1:
+            self.scale = 0.25
+        if self.margin < 0:
+            self.margin = 10
+
+    @staticmethod
+    def _even(value):
+        return max(2, int(round(value / 2.0)) * 2)
+
+    def parse_options(self, infos, renditions=1):
+        """
+        Build the filter graph composing the inputs described by infos
+        (list of MediaInfo, in input order) and splitting the result into
+        renditions outputs.
+
+        Returns a tuple (graph, (width, height), video labels, audio
+        labels, duration). There is no audio label if no input has audio.
+        """
+        if len(infos) < 2:
+            raise ValueError('Composition requires at least two inputs')
+        if any(info.video is None for info in infos):
+            raise ValueError('Every composed input must have a video stream')
+        if self.type == 'pip' and (len(infos) != 2 or self.main not in (0, 1)):
+            raise ValueError('Picture in picture requires exactly two inputs')
+
+        starts = [info.video.start_time or 0 for info in infos]
+        offsets = [start - min(starts) for start in starts]
+        duration = max(offset + (info.format.duration or 0) for offset, info in zip(offsets, infos))
+
+        graph = []
+
+        def video_input(index, scale):
+            chain = 'setpts=PTS-STARTPTS'
+            if offsets[index] > 0:
+                chain += ',tpad=start_duration=%.3f' % offsets[index]
+            graph.append('[%d:v:0]%s,%s,setsar=1[in%d]' % (index, chain, scale, index))
+            return '[in%d]' % index
+
+        if self.type == 'side_by_side':
+            height = self.height or min(info.video.video_height for info in infos)
+            height -= height % 2
+            widths = [self._even(1.0 * info.video.video_width * height / info.video.video_height) for info in infos]
+            stacked = ''.join(
+                video_input(index, 'scale=%d:%d' % (widths[index], height)) for index in range(len(infos)))
+            graph.append('%shstack=inputs=%d[composed]' % (stacked, len(infos)))
+            size = (sum(widths), height)
+        else:
+            inset = 1 - self.main
+            background = infos[self.main].video
+            size = (background.video_width - background.video_width % 2,
+                    background.video_height - background.video_height % 2)
+            main = video_input(self.main, 'scale=%d:%d' % size)
+            overlay = video_input(inset, 'scale=%d:-2' % self._even(size[0] * self.scale))
+            position = self.inset_positions[self.position] % {'m': self.margin}
+            graph.append('%s%soverlay=%s:eof_action=pass[composed]' % (main, overlay, position))
+
+        video_labels = ['[v%d]' % index for index in range(renditions)]
+        if renditions > 1:
+            graph.append('[composed]split=%d%s' % (renditions, ''.join(video_labels)))
+        else:
+            graph[-1] = graph[-1][:-len('[composed]')] + video_labels[0]
+
+        audio_input = self.audio
+        if audio_input is None:
+            audio_input = next((index for index, info in enumerate(infos) if info.audio), None)
+        elif audio_input < 0 or audio_input >= len(infos) or not infos[audio_input].audio:
+            raise ValueError('Invalid audio input: %d' % audio_input)
+
+        audio_labels = []
+        if audio_input is not None:
+            chain = 'asetpts=PTS-STARTPTS'
+            if offsets[audio_input] > 0:
+                chain += ',adelay=%d:all=1' % int(offsets[audio_input] * 1000)
+            audio_labels = ['[a%d]' % index for index in range(renditions)]
+            if renditions > 1:
+                chain += ',asplit=%d' % renditions
+            graph.append('[%d:a:0]%s%s' % (audio_input, chain, ''.join(audio_labels)))
+
+        return ';'.join(graph), size, video_labels, audio_labels, duration
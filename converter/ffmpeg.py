@@ -2,11 +2,19 @@
 
 from itertools import count
 from subprocess import Popen, PIPE
+import codecs
 import locale
 import logging
 import os
 import re
 import signal
+import tempfile
+import time
+
+from converter.instrumentation import ProcessEvent
+from converter.log import FFMpegLog
+from converter.pipes import PipeInput, PipeOutput
+from converter.report import ResourceUsage
 
 logger = logging.getLogger(__name__)
 
@@ -19,9 +27,44 @@ class ArgumentError(Exception):
     pass
 
 
+class AccountedPopen(Popen):
+
+    """
+    Popen keeping the resource usage of the child process (see os.wait4)
+    in the usage attribute, once it has been reaped by poll, or by wait
+    (or communicate) without a timeout.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.started = time.time()
+        self.usage = None
+        super(AccountedPopen, self).__init__(*args, **kwargs)
+
+    def poll(self):
+        if self.returncode is None:
+            self._wait4(os.WNOHANG)
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if self.returncode is None and timeout is None:
+            self._wait4(0)
+        # returns at once if the process was reaped
+        return super(AccountedPopen, self).wait(timeout)
+
+    def _wait4(self, flags):
+        try:
+            pid, status, rusage = os.wait4(self.pid, flags)
+        except ChildProcessError:
+            # reaped elsewhere, the usage is lost
+            return
+        if pid == self.pid:
+            self.usage = ResourceUsage.from_rusage(rusage, time.time() - self.started)
+            self.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+
+
 class FFMpegError(Exception):
 
-    def __init__(self, message, cmd=None, details=None, pid=None):
+    def __init__(self, message, cmd=None, details=None, pid=None, category=None):
         """
         @param    message: Error message.
         @type     message: C{str}
@@ -31,6 +74,10 @@ class FFMpegError(Exception):
 
         @param    details: Optional error details.
         @type     details: C{str}
+
+        @param    category: Kind of failure, eg. 'input', 'encoding',
+                  'signal', 'timeout' or 'exit_code'.
+        @type     category: C{str}
         """
         super(FFMpegError, self).__init__(message)
 
@@ -38,6 +85,7 @@ class FFMpegError(Exception):
         self.details = details
         self.message = message
         self.pid = pid
+        self.category = category
 
     def __repr__(self):
         return ('<%s error="%s", details="%s", pid=%s, cmd="%s">' %
@@ -118,11 +166,16 @@ class MediaStreamInfo(object):
       * metadata - optional metadata associated with a video or audio stream
       * bitrate - stream bitrate in bytes/second
       * attached_pic - (0, 1 or None) is stream a poster image? (e.g. in mp3)
+      * profile - codec profile (e.g. "High", "LC"), if known
+      * level - codec level (e.g. 41 for h264 level 4.1), if known
     Video-specific attributes are:
       * video_width - width of video in pixels
       * video_height - height of video in pixels
       * video_fps - average frames per second
+      * video_avg_frame_rate - average frame rate as reported by ffprobe,
+        a fraction (e.g. "30000/1001")
       * video_pixel_format - pixel format
+      * video_frames - number of frames, if known (or counted)
     Audio-specific attributes are:
       * audio_channels - the number of channels in the stream
       * audio_samplerate - sample rate (Hz)
@@ -138,13 +191,17 @@ class MediaStreamInfo(object):
         self.video_width = None
         self.video_height = None
         self.video_fps = None
+        self.video_avg_frame_rate = None
         self.video_pixel_format = None
+        self.video_frames = None
         self.video_sample_aspect_ratio = None
         self.video_display_aspect_ratio = None
         self.audio_channels = None
         self.audio_samplerate = None
         self.start_time = None
         self.attached_pic = None
+        self.profile = None
+        self.level = None
         self.sub_forced = None
         self.sub_default = None
         self.metadata = {}
@@ -188,6 +245,8 @@ class MediaStreamInfo(object):
             self.video_height = self.parse_int(val)
         elif key == 'pix_fmt':
             self.video_pixel_format = val
+        elif key in ('nb_frames', 'nb_read_packets'):
+            self.video_frames = self.parse_int(val, None)
         elif key == 'channels':
             self.audio_channels = self.parse_int(val)
         elif key == 'sample_rate':
@@ -200,6 +259,10 @@ class MediaStreamInfo(object):
                 self.metadata['rotate'] += 360
         elif key == 'DISPOSITION:attached_pic':
             self.attached_pic = self.parse_int(val)
+        elif key == 'profile':
+            self.profile = val
+        elif key == 'level':
+            self.level = self.parse_int(val, None)
         if key.startswith('TAG:'):
             key = key.split('TAG:')[1]
             value = val
@@ -220,7 +283,9 @@ class MediaStreamInfo(object):
                     self.video_fps = self.parse_float(val)
 
         if self.type == 'video':
-            if key == 'r_frame_rate':
+            if key == 'avg_frame_rate' and val != '0/0':
+                self.video_avg_frame_rate = val
+            elif key == 'r_frame_rate':
                 if val == '1000/1':
                     # 1000/1 is reported by ffprobe when frame rate cannot be found in some cases
                     pass
@@ -367,10 +432,12 @@ class FFMpeg(object):
     """
     DEFAULT_JPEG_QUALITY = 4
 
-    def __init__(self, ffmpeg_path=None, ffprobe_path=None):
+    def __init__(self, ffmpeg_path=None, ffprobe_path=None, instrumentation=None):
         """
         Initialize a new FFMpeg wrapper object. Optional parameters specify
-        the paths to ffmpeg and ffprobe utilities.
+        the paths to ffmpeg and ffprobe utilities, and the
+        instrumentation.Instrumentation (or list of them) whose hooks are
+        called for every process.
         """
 
         def which(name):
@@ -401,13 +468,55 @@ class FFMpeg(object):
         if not os.path.exists(self.ffprobe_path):
             raise FFMpegError("ffprobe binary not found: " + self.ffprobe_path)
 
+        if instrumentation is None:
+            instrumentation = []
+        elif not isinstance(instrumentation, (list, tuple)):
+            instrumentation = [instrumentation]
+        self.instrumentation = list(instrumentation)
+
     @staticmethod
-    def _spawn(cmds, shell=False, stdin=PIPE, stdout=PIPE, stderr=PIPE):
+    def _spawn(cmds, shell=False, stdin=PIPE, stdout=PIPE, stderr=PIPE, pass_fds=()):
         logger.debug('Spawning ffmpeg with command: ' + ' '.join(cmds))
-        return Popen(cmds, shell=shell, stdin=stdin, stdout=stdout,
-                     stderr=stderr, close_fds=True)
-
-    def probe(self, uri, posters_as_video=True):
+        return AccountedPopen(cmds, shell=shell, stdin=stdin, stdout=stdout,
+                              stderr=stderr, close_fds=True, pass_fds=pass_fds)
+
+    def _emit(self, hook, *args):
+        for instrumentation in self.instrumentation:
+            try:
+                getattr(instrumentation, hook)(*args)
+            except Exception:
+                logger.exception('Instrumentation hook %s failed', hook)
+
+    def _start(self, cmds, operation, pass_fds=()):
+        # spawn a process of operation, telling the instrumentation
+        extra = {'pass_fds': pass_fds} if pass_fds else {}
+        p = self._spawn(cmds, **extra)
+        program = 'ffprobe' if cmds[0] == self.ffprobe_path else 'ffmpeg'
+        p.event = ProcessEvent(program, operation, cmds, p.pid)
+        self._emit('spawned', p.event)
+        return p
+
+    def _exited(self, p, usage=None):
+        # add the usage of the exited process p to the usage collected by
+        # the caller, if any, and tell the instrumentation
+        if usage is not None and p.usage is not None:
+            usage.add(p.usage)
+        event = getattr(p, 'event', None)
+        if event is not None:
+            event.duration = time.time() - event.started
+            event.returncode = p.returncode
+            event.usage = p.usage
+            self._emit('exited', event)
+
+    def _failed(self, p, error):
+        # tell the instrumentation that process p failed with error, which
+        # is returned to be raised
+        event = getattr(p, 'event', None)
+        if event is not None:
+            self._emit('failed', event, error)
+        return error
+
+    def probe(self, uri, posters_as_video=True, count_packets=False, usage=None):
         """
         Examine the media file and determine its format and media streams.
         Returns the MediaInfo object, or None if the specified file is
@@ -430,13 +539,25 @@ class FFMpeg(object):
         2
         :param posters_as_video: Take poster images (mainly for audio files) as
             A video stream, defaults to True
+        :param count_packets: Read the whole file to count the packets of
+            the streams, for formats not storing the number of frames
+        :param usage: report.ResourceUsage the ffprobe usage is added to
+
+        uri can also be a pipes.PipeInput, whose buffered prefix is probed.
         """
 
         info = MediaInfo(posters_as_video)
 
-        p = self._spawn([self.ffprobe_path, '-hide_banner',
-                         '-show_format', '-show_streams', '-show_error', uri])
-        stdout_data, stderr_data = p.communicate()
+        cmds = [self.ffprobe_path, '-hide_banner', '-show_format', '-show_streams', '-show_error']
+        if count_packets:
+            cmds.append('-count_packets')
+        data = None
+        if isinstance(uri, PipeInput):
+            data = uri.prefix()
+            uri = 'pipe:0'
+        p = self._start(cmds + [uri], 'probe')
+        stdout_data, stderr_data = p.communicate(data)
+        self._exited(p, usage)
         stdout_data = stdout_data.decode(console_encoding, 'replace')
         info.parse_ffprobe(stdout_data)
 
@@ -445,10 +566,16 @@ class FFMpeg(object):
 
         return info
 
-    def convert(self, infile, outfiles, opts, timeout=10, preopts=None, skinopts=None):
+    def convert(self, infile, outfiles, opts, timeout=10, preopts=None, skinopts=None, usage=None, benchmark=None,
+                log=None):
         """
         Convert the source media (infile) according to specified options
         (a list of ffmpeg switches as strings) and save it to outfile.
+        infile can also be a list of files, used as the inputs of a complex
+        filter graph given in skinopts. One of the inputs can be a
+        pipes.PipeInput, written to the standard input of ffmpeg while it
+        runs. Outputs can be pipes.PipeOutput, fed from the standard output
+        of ffmpeg for the first one and from extra pipes for the others.
 
         Convert returns a generator that needs to be iterated to drive the
         conversion process. The generator will periodically yield timecode
@@ -460,6 +587,17 @@ class FFMpeg(object):
         the documentation in Converter.convert() for more details about this
         option.
 
+        The resources used by ffmpeg are added to usage, a
+        report.ResourceUsage, if given. With benchmark, a
+        report.BenchmarkStats, ffmpeg is run with -benchmark (or
+        -benchmark_all) and the figures it reports are added to it.
+
+        The output of ffmpeg is parsed as it arrives into log, a
+        log.FFMpegLog (a new one by default), also given to the
+        instrumentation as the log of the process. It keeps the latest
+        errors and warnings, counts the dropped and duplicated frames,
+        and tells what went wrong when ffmpeg fails.
+
         >>> conv = FFMpeg().convert('test.ogg', '/tmp/output.mp3',
         ...    ['-codec:a', 'libmp3lame', '-vn'])
         >>> for timecode in conv:
@@ -467,39 +605,84 @@ class FFMpeg(object):
 
         """
         cmds = [self.ffmpeg_path, '-hide_banner']
-
-        if not os.path.exists(infile):
-            raise FFMpegError("Input file doesn't exist: " + infile)
+        if log is None:
+            log = FFMpegLog()
+        cmds.extend(log.option)
+        if benchmark is not None:
+            cmds.append(benchmark.option)
+
+        infiles = infile if isinstance(infile, (list, tuple)) else [infile]
+        pipe = None
+        for infile in infiles:
+            if isinstance(infile, PipeInput):
+                if pipe is not None:
+                    raise FFMpegError('Only one input can be piped')
+                pipe = infile
+            elif not os.path.exists(infile):
+                raise FFMpegError("Input file doesn't exist: " + infile)
+        infiles = ['pipe:0' if infile is pipe else infile for infile in infiles]
         if preopts:
             for preopt in preopts:
                 if preopt:
-                    cmds.extend(preopts)
-        cmds.extend(['-y', '-i', infile])
+                    cmds.extend(preopt)
+        cmds.append('-y')
+        for infile in infiles:
+            cmds.extend(['-i', infile])
+        # (PipeOutput, read end) of the piped outputs, the first one
+        # being read from the standard output (read end None)
+        piped_outputs = []
         index = 0
         for outputfile, outopts in zip(outfiles, opts):
             if skinopts and skinopts[index]:
                 cmds.extend(skinopts[index])
             cmds.extend(['-max_muxing_queue_size', '99999'])
             cmds.extend(outopts)
+            if isinstance(outputfile, PipeOutput):
+                if piped_outputs:
+                    read_fd, write_fd = os.pipe()
+                    piped_outputs.append((outputfile, read_fd, write_fd))
+                    outputfile = 'pipe:%d' % write_fd
+                else:
+                    piped_outputs.append((outputfile, None, None))
+                    outputfile = 'pipe:1'
             cmds.append(outputfile)
             index += 1
         try:
-            p = self._spawn(cmds)
+            p = self._start(cmds, 'convert', pass_fds=[write_fd for _, _, write_fd in piped_outputs[1:]])
         except OSError as e:
+            for _, read_fd, write_fd in piped_outputs[1:]:
+                os.close(read_fd)
+                os.close(write_fd)
             raise FFMpegError('Error while calling ffmpeg binary', details=e)
+        p.event.log = log
+
+        writer = None
+        if pipe is not None:
+            writer = pipe.start(p.stdin)
+        readers = []
+        for output, read_fd, write_fd in piped_outputs:
+            if read_fd is None:
+                # the reader owns its descriptor, the stdout file object is
+                # not used anymore
+                read_fd = os.dup(p.stdout.fileno())
+                p.stdout.close()
+            else:
+                os.close(write_fd)  # only ffmpeg writes, for the reader to get EOF
+            readers.append(output.start(read_fd))
 
         if timeout:
             def on_sigvtalrm(*_):
                 signal.signal(signal.SIGVTALRM, signal.SIG_DFL)
                 if p.poll() is None:
                     p.kill()
-                raise FFMpegError('timed out while waiting for ffmpeg')
+                p.wait()
+                self._exited(p, usage)
+                raise self._failed(p, FFMpegError('timed out while waiting for ffmpeg', category='timeout'))
 
             signal.signal(signal.SIGVTALRM, on_sigvtalrm)
 
         yielded = False
-        buf = ''
-        total_output = ''
+        decoder = codecs.getincrementaldecoder(console_encoding)('replace')
         pat = re.compile(r'time=([0-9.:]+)')
 
         def get_timecode(out):
@@ -515,6 +698,17 @@ class FFMpeg(object):
                 return timecode
             return None
 
+        def parse(records):
+            for record in records:
+                if record.status:
+                    timecode = get_timecode(record.message)
+                    if timecode is not None:
+                        p.event.timecode = timecode
+                        self._emit('progress', p.event, timecode)
+                        yield timecode
+                elif benchmark is not None:
+                    benchmark.parse_line(record.message)
+
         while True:
             if timeout:
                 signal.setitimer(signal.ITIMER_VIRTUAL, timeout)
@@ -527,54 +721,71 @@ class FFMpeg(object):
             if not ret:
                 break
 
-            ret = ret.decode(console_encoding, 'replace')
-            total_output += ret
-            buf += ret
-            if '\r' in buf:
-                line, buf = buf.split('\r', 1)
-                timecode = get_timecode(line)
-                if timecode is not None:
-                    yielded = True
-                    yield timecode
-        if not yielded:
-            # There may have been a single time, check it
-            timecode = get_timecode(total_output)
-            if timecode is not None:
+            for timecode in parse(log.feed(decoder.decode(ret))):
                 yielded = True
                 yield timecode
+        for timecode in parse(log.feed(decoder.decode(b'', True))):
+            yielded = True
+            yield timecode
+        for timecode in parse(log.close()):
+            yielded = True
+            yield timecode
 
         if timeout:
             signal.signal(signal.SIGALRM, signal.SIG_DFL)
 
+        if writer is not None:
+            # ffmpeg is done, the writer stops at the latest on a broken pipe
+            writer.join()
+            # the writer closed stdin, communicate would flush it
+            p.stdin = None
+        for reader in readers:
+            reader.join()
         p.communicate()  # wait for process to exit
-
-        if total_output == '':
-            raise FFMpegError('Error while calling ffmpeg binary, no output.')
+        self._exited(p, usage)
+        if writer is not None and pipe.error is not None:
+            raise self._failed(p, FFMpegConvertError(
+                'Error while reading the piped input', ' '.join(cmds), str(pipe.error), pid=p.pid,
+                category='pipe_input'))
+        for output, _, _ in piped_outputs:
+            if output.error is not None:
+                raise self._failed(p, FFMpegConvertError(
+                    'Error while writing the piped output', ' '.join(cmds), str(output.error), pid=p.pid,
+                    category='pipe_output'))
+
+        if not log.lines:
+            raise self._failed(p, FFMpegError('Error while calling ffmpeg binary, no output.', category='no_output'))
 
         cmd = ' '.join(cmds)
-        if '\n' in total_output:
-            line = total_output.split('\n')[-2]
-
-            if line.startswith('Received signal'):
-                # Received signal 15: terminating.
-                raise FFMpegConvertError(
-                    line.split(':')[0], cmd, total_output, pid=p.pid)
-            if line.startswith(infile + ': '):
-                err = line[len(infile) + 2:]
-                raise FFMpegConvertError(
-                    'Encoding error: %s' % err, cmd, total_output, pid=p.pid)
-            if line.startswith('Error while '):
-                raise FFMpegConvertError(
-                    'Encoding error: %s' % line, cmd, total_output, pid=p.pid)
-            if not yielded:
-                raise FFMpegConvertError(
-                    'Unknown ffmpeg error', cmd, total_output, pid=p.pid)
-        if p.returncode != 0:
-            raise FFMpegConvertError(
-                'Exited with code %d' % p.returncode, cmd, total_output, pid=p.pid)
+        if log.signal is not None:
+            # Received signal 15: terminating. / Exiting normally, received signal 2.
+            raise self._failed(p, FFMpegConvertError(
+                'Received signal %d' % log.signal, cmd, log.text(), pid=p.pid, category='signal'))
+        if p.returncode == 0 and yielded:
+            return
+        errors = log.errors()
+        for record in reversed(errors):
+            # the input can't be opened or read
+            for infile in infiles:
+                if record.message.startswith(infile + ': '):
+                    raise self._failed(p, FFMpegConvertError(
+                        'Encoding error: %s' % record.message[len(infile) + 2:], cmd, log.text(), pid=p.pid,
+                        category='input'))
+            if (record.component or '').startswith('in#') or record.message.startswith('Error opening input'):
+                raise self._failed(p, FFMpegConvertError(
+                    'Encoding error: %s' % record.message, cmd, log.text(), pid=p.pid, category='input'))
+        for record in reversed(errors):
+            if record.message.startswith('Error '):
+                raise self._failed(p, FFMpegConvertError(
+                    'Encoding error: %s' % record.message, cmd, log.text(), pid=p.pid, category='encoding'))
+        if not yielded:
+            raise self._failed(p, FFMpegConvertError(
+                'Unknown ffmpeg error', cmd, log.text(), pid=p.pid, category='unknown'))
+        raise self._failed(p, FFMpegConvertError(
+            'Exited with code %d' % p.returncode, cmd, log.text(), pid=p.pid, category='exit_code'))
 
     def thumbnail(self, uri, time, outfile,
-                  size=None, quality=DEFAULT_JPEG_QUALITY):
+                  size=None, quality=DEFAULT_JPEG_QUALITY, usage=None):
         """
         Create a thumbnal of media file, and store it to outfile
         @param uri: file path or url
@@ -583,12 +794,13 @@ class FFMpeg(object):
             If not specified, the video resolution is used.
         @param quality: quality of jpeg file in range 2(best)-31(worst)
             recommended range: 2-6
+        @param usage: report.ResourceUsage the ffmpeg usage is added to
 
         >>> FFMpeg().thumbnail('test1.ogg', 5, '/tmp/shot.png', '320x240')
         """
-        return self.thumbnails(uri, [(time, outfile, size, quality)])
+        return self.thumbnails(uri, [(time, outfile, size, quality)], usage=usage)
 
-    def thumbnails(self, uri, option_list, output_seeking=False):
+    def thumbnails(self, uri, option_list, output_seeking=False, usage=None):
         """
         Create one or more thumbnails of video.
         @param uri: file path or url
@@ -598,6 +810,7 @@ class FFMpeg(object):
         @param output_seeking: a boolean whether the seeking should be done
             on the output (slow but doesn't reset the timestamps) or on the
             input
+        @param usage: report.ResourceUsage the ffmpeg usage is added to
 
         >>> FFMpeg().thumbnails('test1.ogg', [(5, '/tmp/shot.png', '320x240'),
         >>>                                   (10, '/tmp/shot2.png', None, 5)])
@@ -628,17 +841,90 @@ class FFMpeg(object):
             else:
                 cmds.append(thumb[1])
 
-        p = self._spawn(cmds)
+        p = self._start(cmds, 'thumbnails')
         _, stderr_data = p.communicate()
+        self._exited(p, usage)
         if stderr_data == '':
-            raise FFMpegError('Error while calling ffmpeg binary')
+            raise self._failed(p, FFMpegError('Error while calling ffmpeg binary', category='no_output'))
         stderr_data = stderr_data.decode(console_encoding, 'replace')
         if any(not os.path.exists(option[1]) for option in option_list):
-            raise FFMpegError('Error creating thumbnail.', details=stderr_data)
+            raise self._failed(p, FFMpegError('Error creating thumbnail.', details=stderr_data, category='output'))
+
+    def detect_crop(self, uri, duration, samples=5, window=1.0, limit=24, usage=None):
+        """
+        Detect the black bars (letterbox or pillarbox) of a video.
+        @param uri: file path
+        @param duration: duration of the video in seconds
+        @param samples: number of windows analyzed, spread over the video
+            and seeked on the input, so that long files are analyzed in
+            about the same time as short ones
+        @param window: duration of each analyzed window in seconds
+        @param limit: cropdetect black threshold (0-255)
+        @param usage: report.ResourceUsage the ffmpeg usage is added to
+
+        The windows are analyzed in parallel, by one ffmpeg process each.
+        Returns the (width, height, x, y) rectangle containing the picture
+        of every window, or None if no window has a picture.
+
+        >>> FFMpeg().detect_crop('movie.mkv', 5400)
+        (1920, 800, 0, 140)
+        """
+        if not os.path.exists(uri):
+            raise IOError('No such file: ' + uri)
+
+        processes = []
+        for index in range(samples):
+            start = max(0, duration * (index + 1) / (samples + 1) - window / 2)
+            processes.append(self._start([
+                self.ffmpeg_path, '-hide_banner', '-nostats', '-ss', '%.3f' % start, '-i', uri,
+                '-t', '%.3f' % window, '-map', '0:v:0', '-vf', 'cropdetect=%d:2:0' % limit, '-f', 'null', '-'],
+                'detect_crop'))
+
+        rectangles = []
+        for p in processes:
+            _, stderr_data = p.communicate()
+            self._exited(p, usage)
+            stderr_data = stderr_data.decode(console_encoding, 'replace')
+            crops = re.findall(r'crop=(-?\d+):(-?\d+):(-?\d+):(-?\d+)', stderr_data)
+            if not crops:
+                continue
+            # the last values cover the whole window
+            w, h, x, y = [int(value) for value in crops[-1]]
+            # all black windows (eg. fades) have no meaningful rectangle
+            if w > 0 and h > 0:
+                rectangles.append((x, y, x + w, y + h))
+
+        if not rectangles:
+            return None
+
+        left = min(r[0] for r in rectangles)
+        top = min(r[1] for r in rectangles)
+        right = max(r[2] for r in rectangles)
+        bottom = max(r[3] for r in rectangles)
+        return right - left, bottom - top, left, top
+
+    @staticmethod
+    def _movflags(output, faststart, copy_metadata_tags, fragmented):
+        """
+        Build the -movflags value for a stream copy into output. All the
+        flags must be given at once, a second -movflags replaces the first.
+        Fragmented outputs are streamable as written, so they don't need
+        the faststart rewrite.
+        """
+        movflags = []
+        if copy_metadata_tags:
+            movflags.append('use_metadata_tags')
+        if output.endswith('.mp4') or output.endswith('.mov'):
+            if fragmented:
+                movflags.extend(['frag_keyframe', 'empty_moov', 'default_base_moof'])
+            elif faststart:
+                movflags.append('faststart')
+        return '+'.join(movflags)
 
     def mix(
         self, inputs, inputs_maps, output, faststart=True,
-        stream_metadata_tags=None, copy_metadata_tags=False, duration=None
+        stream_metadata_tags=None, copy_metadata_tags=False, duration=None,
+        fragmented=False, usage=None
     ):
 
         if len(inputs) != len(inputs_maps):
@@ -649,10 +935,9 @@ class FFMpeg(object):
 
         command = [self.ffmpeg_path, '-hide_banner', '-y', '-nostdin']
         command_options = ['-codec', 'copy']
-        if copy_metadata_tags:
-            command_options.extend(['-movflags', 'use_metadata_tags'])
-        if faststart and (output.endswith('.mp4') or output.endswith('.mov')):
-            command_options.extend(['-movflags', 'faststart'])
+        movflags = self._movflags(output, faststart, copy_metadata_tags, fragmented)
+        if movflags:
+            command_options.extend(['-movflags', movflags])
         if duration:
             command_options.extend(['-t', str(round(duration, 3))])
 
@@ -684,11 +969,96 @@ class FFMpeg(object):
 
         command.extend(metadata_tags + [output])
 
-        p = self._spawn(command)
+        p = self._start(command, 'mix')
         stdout_data, stderr_data = p.communicate()
+        self._exited(p, usage)
         logger.debug('ffmpeg out:\n%s', stdout_data.decode(console_encoding, 'replace'))
         logger.debug('ffmpeg err:\n%s', stderr_data.decode(console_encoding, 'replace'))
         if p.returncode != 0:
-            raise FFMpegError(
+            raise self._failed(p, FFMpegError(
                 'Error while calling ffmpeg binary, retcode %i' % p.returncode,
-                details=stderr_data.decode(console_encoding, 'replace'))
+                details=stderr_data.decode(console_encoding, 'replace'), category='exit_code'))
+
+    def concat(self, inputs, output, faststart=True, copy_metadata_tags=False, fragmented=False, usage=None):
+        """
+        Join media files with the concat demuxer, copying the streams.
+        Unlike mix(), a single demuxer reads the inputs one after the other
+        from a ffconcat list file, so the command line does not grow with
+        the number of inputs.
+        @param inputs: list of file paths, all having the same streams
+            encoded with the same parameters
+        @param output: output file path
+        @param faststart: move the moov atom at the beginning of mp4/mov
+            outputs
+        @param copy_metadata_tags: keep the metadata tags of mp4/mov outputs
+        @param fragmented: write a fragmented mp4/mov output instead
+        @param usage: report.ResourceUsage the ffmpeg and ffprobe usage is
+            added to
+
+        Returns the duration of the output in seconds.
+
+        >>> FFMpeg().concat(['part1.mp4', 'part2.mp4'], '/tmp/joined.mp4')
+        """
+        if not inputs:
+            raise ArgumentError('at least one input is required')
+
+        # check the codec parameters up front, the concat demuxer would
+        # otherwise produce a broken file without complaining
+        reference = None
+        durations = []
+        for input_file in inputs:
+            info = self.probe(input_file, usage=usage)
+            if info is None:
+                raise ArgumentError('Invalid input: %s' % input_file)
+            # a different frame rate breaks the timestamps, a different
+            # profile or level (hence SPS) makes the stream undecodable
+            signature = [
+                (s.type, s.codec, s.profile, s.level, s.video_width, s.video_height, s.video_pixel_format,
+                 s.video_avg_frame_rate, s.audio_channels, s.audio_samplerate)
+                for s in info.streams if s.type in ('video', 'audio') and not s.attached_pic
+            ]
+            if reference is None:
+                reference = signature
+            elif signature != reference:
+                raise ArgumentError(
+                    'Codec parameters of %s do not match the first input: %s != %s' % (
+                        input_file, signature, reference))
+            durations.append(info.format.duration)
+
+        list_fd, list_path = tempfile.mkstemp(
+            suffix='.ffconcat', dir=os.path.dirname(os.path.abspath(output)))
+        try:
+            with os.fdopen(list_fd, 'w') as list_file:
+                list_file.write('ffconcat version 1.0\n')
+                for input_file, duration in zip(inputs, durations):
+                    list_file.write("file '%s'\n" % os.path.abspath(input_file).replace("'", "'\\''"))
+                    if duration:
+                        # exact durations keep the timestamps of the next
+                        # files from drifting
+                        list_file.write('duration %.6f\n' % duration)
+
+            command = [
+                self.ffmpeg_path, '-hide_banner', '-y', '-nostdin',
+                '-f', 'concat', '-safe', '0', '-i', list_path,
+                '-map', '0', '-codec', 'copy'
+            ]
+            movflags = self._movflags(output, faststart, copy_metadata_tags, fragmented)
+            if movflags:
+                command.extend(['-movflags', movflags])
+            command.append(output)
+
+            p = self._start(command, 'concat')
+            _, stderr_data = p.communicate()
+            self._exited(p, usage)
+            if p.returncode != 0:
+                raise self._failed(p, FFMpegError(
+                    'Error while calling ffmpeg binary, retcode %i' % p.returncode,
+                    cmd=' '.join(command),
+                    details=stderr_data.decode(console_encoding, 'replace'), category='exit_code'))
+        finally:
+            os.unlink(list_path)
+
+        info = self.probe(output, usage=usage)
+        if info is not None and info.format.duration:
+            return info.format.duration
+        return sum(duration or 0 for duration in durations)
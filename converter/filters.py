@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+
+# a filter of a graph: optional input labels, then its name (and instance)
+_filter_re = re.compile(r'\s*(?:\[[^\]]*\]\s*)*([A-Za-z0-9_]+)(?:@[A-Za-z0-9_]+)?\s*(?:=|\[|$)')
+
+
+class FilterChain(object):
+
+    """
+    Chain of simple (single input and output) video filters. Codecs add
+    filters to named stages and the chain is emitted in stage order,
+    whatever the order they were added in, so that each frame is for
+    instance cropped before being scaled once, and uploaded to the GPU
+    last. The stages are:
+      * decimate - drop the frames nearly identical to the previous one
+      * fps - drop or duplicate frames to a constant rate
+      * crop - remove parts of the source picture
+      * scale - resize to the output size
+      * pad - add borders to the scaled picture
+      * aspect - set the display aspect ratio
+      * format - convert the pixel format
+      * hwupload - upload the frames to a hardware encoder
+
+    >>> chain = FilterChain()
+    >>> chain.add('scale', 'scale=320:240')
+    >>> chain.add('crop', 'crop=iw:ih*3/4')
+    >>> str(chain)
+    'crop=iw:ih*3/4,scale=320:240'
+    """
+
+    stages = ('decimate', 'fps', 'crop', 'scale', 'pad', 'aspect', 'format', 'hwupload')
+
+    def __init__(self):
+        self.filters = dict((stage, []) for stage in self.stages)
+
+    def add(self, stage, expression):
+        if stage not in self.filters:
+            raise ValueError('Unknown filter stage: ' + str(stage))
+        self.filters[stage].append(expression)
+
+    def __str__(self):
+        return ','.join(expression for stage in self.stages for expression in self.filters[stage])
+
+    def __repr__(self):
+        return 'FilterChain(%s)' % str(self)
+
+
+def graph_filters(graph):
+    """
+    Return the set of filter names used by a filter graph (or chain), eg.
+    {'scale', 'overlay'} for '[0:v][1:v]overlay=10:10,scale=320:240[v]'.
+
+    >>> sorted(graph_filters('[0:v]crop=iw:ih*3/4,scale=320:240[v];[v]null'))
+    ['crop', 'null', 'scale']
+    """
+    names = set()
+    for part in re.split(r'(?<!\\)[;,]', graph):
+        match = _filter_re.match(part)
+        if match:
+            names.add(match.group(1))
+    return names
+
+
+def splice_video_filters(optlist, graph_opts):
+    """
+    Move the -vf chain of an output option list in the -filter_complex
+    graph of graph_opts, when the output video is mapped from that graph:
+    simple and complex filtering can't be used on the same stream.
+
+    The video is expected to be the first graph output label mapped by
+    the output (eg. [outv] for the branding, [v0] for compositions), or
+    else the only unlabeled graph output (eg. a ffmpeg_skin_opts graph
+    ending in overlay=10:10), which ffmpeg maps to the output by itself:
+    the chain is then appended to it, keeping it unlabeled for the other
+    streams to still be selected automatically. Both lists are modified
+    in place.
+    """
+    if '-vf' not in optlist or '-filter_complex' not in graph_opts:
+        return
+
+    vf_index = optlist.index('-vf')
+    graph_index = graph_opts.index('-filter_complex') + 1
+    labels = [optlist[i + 1] for i in range(len(optlist) - 1)
+              if optlist[i] == '-map' and optlist[i + 1].startswith('[')]
+    if not labels:
+        chains = re.split(r'(?<!\\);', graph_opts[graph_index])
+        unlabeled = [index for index, chain in enumerate(chains) if not chain.rstrip().endswith(']')]
+        if len(unlabeled) != 1:
+            return
+        chains[unlabeled[0]] = '%s,%s' % (chains[unlabeled[0]].rstrip(), optlist[vf_index + 1])
+        graph_opts[graph_index] = ';'.join(chains)
+        del optlist[vf_index:vf_index + 2]
+        return
+
+    label = labels[0]
+    spliced = label[:-1] + 'vf]'
+    graph_opts[graph_index] += ';%s%s%s' % (label, optlist[vf_index + 1], spliced)
+    del optlist[vf_index:vf_index + 2]
+    optlist[optlist.index(label)] = spliced
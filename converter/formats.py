@@ -25,11 +25,13 @@ class BaseFormat(with_metaclass(MetaBaseFormat, object)):
     """
     Base format class.
 
-    Supported formats are: ogg, avi, mkv, webm, flv, mov, mp4, mpeg, wmv
+    Supported formats are: ogg, avi, mkv, webm, flv, mov, mp4, fmp4, mpeg, wmv
     """
 
     format_name = None
     ffmpeg_format_name = None
+    variable_frame_rate = True  # can store video with a variable frame rate
+    streamable = False  # can be written sequentially, eg. to a pipe
     format_options = {
         'format': str
     }
@@ -66,6 +68,8 @@ class OggFormat(BaseFormat):
     """
     format_name = 'ogg'
     ffmpeg_format_name = 'ogg'
+    streamable = True
+    variable_frame_rate = False
 
 
 class AviFormat(BaseFormat):
@@ -75,6 +79,7 @@ class AviFormat(BaseFormat):
     """
     format_name = 'avi'
     ffmpeg_format_name = 'avi'
+    variable_frame_rate = False
 
 
 class MkvFormat(BaseFormat):
@@ -84,6 +89,7 @@ class MkvFormat(BaseFormat):
     """
     format_name = 'mkv'
     ffmpeg_format_name = 'matroska'
+    streamable = True
 
 
 class WebmFormat(BaseFormat):
@@ -94,6 +100,7 @@ class WebmFormat(BaseFormat):
     """
     format_name = 'webm'
     ffmpeg_format_name = 'webm'
+    streamable = True
 
 
 class FlvFormat(BaseFormat):
@@ -103,6 +110,7 @@ class FlvFormat(BaseFormat):
     """
     format_name = 'flv'
     ffmpeg_format_name = 'flv'
+    streamable = True
 
 
 class MovFormat(BaseFormat):
@@ -115,12 +123,16 @@ class MovFormat(BaseFormat):
     ffmpeg_format_name = 'mov'
     format_options = BaseFormat.format_options.copy()
     format_options.update({
-        'faststart': bool  # faststart mode
+        'faststart': bool,  # faststart mode
+        'moov_size': int,  # bytes reserved for the moov atom at the
+        # beginning of the file, avoids the faststart rewrite
     })
 
     def _format_specific_parse_options(self, safe):
         optlist = []
-        if safe.get('faststart', False):
+        if safe.get('moov_size', 0) > 0:
+            optlist.extend(['-moov_size', str(safe['moov_size'])])
+        elif safe.get('faststart', False):
             optlist.extend(['-movflags', 'faststart'])
         return optlist
 
@@ -134,16 +146,48 @@ class Mp4Format(BaseFormat):
     ffmpeg_format_name = 'mp4'
     format_options = BaseFormat.format_options.copy()
     format_options.update({
-        'faststart': bool  # faststart mode
+        'faststart': bool,  # faststart mode
+        'moov_size': int,  # bytes reserved for the moov atom at the
+        # beginning of the file, avoids the faststart rewrite
     })
 
     def _format_specific_parse_options(self, safe):
         optlist = []
-        if safe.get('faststart', False):
+        if safe.get('moov_size', 0) > 0:
+            optlist.extend(['-moov_size', str(safe['moov_size'])])
+        elif safe.get('faststart', False):
             optlist.extend(['-movflags', 'faststart'])
         return optlist
 
 
+class FragmentedMp4Format(BaseFormat):
+
+    """
+    Fragmented Mp4 container (CMAF style). The moov atom is written
+    empty at the beginning of the file and the media is stored in
+    self-contained fragments starting on keyframes, so no second pass
+    is needed to make the file streamable.
+    """
+    format_name = 'fmp4'
+    ffmpeg_format_name = 'mp4'
+    streamable = True
+    format_options = BaseFormat.format_options.copy()
+    format_options.update({
+        'fragment_duration': float,  # minimum fragment duration in seconds
+        # default: one fragment per keyframe
+        'cmaf': bool,  # CMAF compliant fragments
+    })
+
+    def _format_specific_parse_options(self, safe):
+        movflags = ['frag_keyframe', 'empty_moov', 'default_base_moof']
+        if safe.get('cmaf', False):
+            movflags.append('cmaf')
+        optlist = ['-movflags', '+'.join(movflags)]
+        if safe.get('fragment_duration', 0) > 0:
+            optlist.extend(['-min_frag_duration', str(int(safe['fragment_duration'] * 1000000))])
+        return optlist
+
+
 class MpegFormat(BaseFormat):
 
     """
@@ -151,6 +195,7 @@ class MpegFormat(BaseFormat):
     """
     format_name = 'mpg'
     ffmpeg_format_name = 'mpegts'
+    streamable = True
 
 
 class Mp3Format(BaseFormat):
@@ -160,6 +205,7 @@ class Mp3Format(BaseFormat):
     """
     format_name = 'mp3'
     ffmpeg_format_name = 'mp3'
+    streamable = True
 
 
 class WmvFormat(BaseFormat):
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import threading
+import time
+
+
+class ProcessEvent(object):
+
+    """
+    An ffmpeg or ffprobe process, as given to the instrumentation hooks.
+    The attributes are:
+      * program - 'ffmpeg' or 'ffprobe'
+      * operation - what the process does, eg. 'probe', 'convert',
+        'thumbnails', 'detect_crop', 'mix', 'concat', 'calibration'
+      * cmd - command line, as a list
+      * pid - process id
+      * started - time.time() of the spawn
+      * duration - seconds between the spawn and the exit, None until
+        the process exited
+      * returncode - exit code, None until the process exited
+      * timecode - last media timecode reported by ffmpeg (in seconds),
+        None if it reported none
+      * usage - report.ResourceUsage of the process, once it exited
+      * log - log.FFMpegLog of the output of the convert processes, None
+        for the others
+    """
+
+    def __init__(self, program, operation, cmd, pid):
+        self.program = program
+        self.operation = operation
+        self.cmd = cmd
+        self.pid = pid
+        self.started = time.time()
+        self.duration = None
+        self.returncode = None
+        self.timecode = None
+        self.usage = None
+        self.log = None
+
+    @property
+    def speed(self):
+        """
+        Media seconds processed per second, None if unknown.
+        """
+        if self.timecode is None or not self.duration:
+            return None
+        return self.timecode / self.duration
+
+    def __repr__(self):
+        return 'ProcessEvent(%s %s, pid=%s, returncode=%s)' % (self.program, self.operation, self.pid, self.returncode)
+
+
+class Instrumentation(object):
+
+    """
+    Base class of the instrumentation hooks, called by FFMpeg (and
+    Converter) for every ffmpeg and ffprobe process, see
+    FFMpeg.__init__. The methods do nothing, subclasses override the ones
+    they need. They are called from the thread driving the conversion and
+    should return quickly; exceptions they raise are logged and ignored.
+    """
+
+    def spawned(self, process):
+        """
+        The process (a ProcessEvent) was started.
+        """
+
+    def progress(self, process, timecode):
+        """
+        ffmpeg reported converting the media up to timecode (in seconds).
+        """
+
+    def exited(self, process):
+        """
+        The process exited, its duration, returncode and usage are set.
+        """
+
+    def failed(self, process, error):
+        """
+        The process failed, error being the FFMpegError raised. Its
+        category attribute tells the kind of failure, eg. 'input',
+        'encoding', 'signal', 'timeout' or 'exit_code'.
+        """
+
+    def dequeued(self, operation, wait):
+        """
+        A job queued wait seconds ago (see the queued_at argument of
+        Converter.convert) started.
+        """
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class PrometheusExporter(Instrumentation):
+
+    """
+    Instrumentation keeping metrics in the Prometheus text exposition
+    format, served by render() (eg. from the /metrics handler of the
+    application) or written to a node_exporter textfile with write(). The
+    metrics are:
+      * converter_probe_seconds - ffprobe latency (histogram)
+      * converter_encode_speed - media seconds converted per second by
+        the convert processes (histogram)
+      * converter_queue_wait_seconds - time jobs waited before starting
+        (histogram)
+      * converter_processes_total - processes run, by program and
+        operation
+      * converter_process_seconds_total, converter_cpu_seconds_total -
+        wall and CPU time of the processes, by program and operation
+      * converter_errors_total - failures, by operation and category
+      * converter_log_messages_total - error and warning messages of
+        the convert processes, by operation and level
+      * converter_dropped_frames_total, converter_duplicated_frames_total
+        - frames dropped and duplicated by the convert processes to keep
+        the output frame rate, by operation
+
+    >>> exporter = PrometheusExporter()
+    >>> c = Converter(instrumentation=exporter)
+    """
+
+    probe_buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    speed_buckets = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+    queue_buckets = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+    def __init__(self, namespace='converter'):
+        self.namespace = namespace
+        self.probe_seconds = Histogram(self.probe_buckets)
+        self.encode_speed = Histogram(self.speed_buckets)
+        self.queue_wait = Histogram(self.queue_buckets)
+        self.processes = {}  # (program, operation) -> count
+        self.process_seconds = {}
+        self.cpu_seconds = {}
+        self.errors = {}  # (operation, category) -> count
+        self.log_messages = {}  # (operation, level) -> count
+        self.dropped_frames = {}  # (operation,) -> count
+        self.duplicated_frames = {}
+        self._lock = threading.Lock()
+
+    def exited(self, process):
+        key = (process.program, process.operation)
+        with self._lock:
+            self.processes[key] = self.processes.get(key, 0) + 1
+            self.process_seconds[key] = self.process_seconds.get(key, 0) + (process.duration or 0)
+            if process.usage is not None:
+                self.cpu_seconds[key] = self.cpu_seconds.get(key, 0) + process.usage.cpu_time
+            if process.program == 'ffprobe' and process.duration is not None:
+                self.probe_seconds.observe(process.duration)
+            if process.operation == 'convert' and process.returncode == 0 and process.speed is not None:
+                self.encode_speed.observe(process.speed)
+            if process.log is not None:
+                for level in ('error', 'warning'):
+                    key = (process.operation, level)
+                    self.log_messages[key] = self.log_messages.get(key, 0) + process.log.counts[level]
+                key = (process.operation,)
+                self.dropped_frames[key] = self.dropped_frames.get(key, 0) + process.log.dropped_frames
+                self.duplicated_frames[key] = self.duplicated_frames.get(key, 0) + process.log.duplicated_frames
+
+    def failed(self, process, error):
+        key = (process.operation, getattr(error, 'category', None) or 'unknown')
+        with self._lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def dequeued(self, operation, wait):
+        with self._lock:
+            self.queue_wait.observe(wait)
+
+    @staticmethod
+    def _labels(names, values):
+        return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                 for name, value in zip(names, values))
+
+    def _histogram(self, lines, name, help_text, histogram):
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s histogram' % name)
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append('%s_bucket{le="%s"} %d' % (name, repr(float(bound)), count))
+        lines.append('%s_bucket{le="+Inf"} %d' % (name, histogram.count))
+        lines.append('%s_sum %s' % (name, repr(histogram.sum)))
+        lines.append('%s_count %d' % (name, histogram.count))
+
+    def _counter(self, lines, name, help_text, label_names, values):
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s counter' % name)
+        for labels, value in sorted(values.items()):
+            lines.append('%s%s %s' % (name, self._labels(label_names, labels), repr(value)))
+
+    def render(self):
+        """
+        Return the metrics in the Prometheus text format.
+        """
+        n = self.namespace
+        lines = []
+        with self._lock:
+            self._histogram(lines, n + '_probe_seconds', 'Duration of the ffprobe runs.', self.probe_seconds)
+            self._histogram(lines, n + '_encode_speed', 'Media seconds converted per second.', self.encode_speed)
+            self._histogram(lines, n + '_queue_wait_seconds', 'Time jobs waited before starting.', self.queue_wait)
+            self._counter(lines, n + '_processes_total', 'Processes run.',
+                          ('program', 'operation'), self.processes)
+            self._counter(lines, n + '_process_seconds_total', 'Wall time of the processes.',
+                          ('program', 'operation'), self.process_seconds)
+            self._counter(lines, n + '_cpu_seconds_total', 'CPU time of the processes.',
+                          ('program', 'operation'), self.cpu_seconds)
+            self._counter(lines, n + '_errors_total', 'Failed processes.',
+                          ('operation', 'category'), self.errors)
+            self._counter(lines, n + '_log_messages_total', 'Error and warning messages of ffmpeg.',
+                          ('operation', 'level'), self.log_messages)
+            self._counter(lines, n + '_dropped_frames_total', 'Frames dropped by ffmpeg.',
+                          ('operation',), self.dropped_frames)
+            self._counter(lines, n + '_duplicated_frames_total', 'Frames duplicated by ffmpeg.',
+                          ('operation',), self.duplicated_frames)
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Write the metrics to path atomically, eg. in the directory of the
+        node_exporter textfile collector.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.render())
+        # mkstemp creates the file readable by the owner only, the exporter
+        # may run as another user
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
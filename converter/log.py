@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import re
+
+LEVELS = ('panic', 'fatal', 'error', 'warning', 'info', 'verbose', 'debug', 'trace')
+ERROR_LEVELS = ('panic', 'fatal', 'error')
+
+
+class LogRecord(object):
+
+    """
+    A message of ffmpeg. The attributes are:
+      * index - position of the message in the log
+      * level - one of LEVELS, eg. 'error' or 'warning'
+      * component - context logging the message, eg. 'libx264' or
+        'vost#0:0/libx264', None for ffmpeg itself
+      * message - text, without the line end
+      * status - True for the status lines ffmpeg prints while
+        converting (frame=... time=... speed=...)
+    """
+
+    def __init__(self, index, level, component, message, status=False):
+        self.index = index
+        self.level = level
+        self.component = component
+        self.message = message
+        self.status = status
+
+    def __str__(self):
+        if self.component:
+            return '[%s] [%s] %s' % (self.component, self.level, self.message)
+        return '[%s] %s' % (self.level, self.message)
+
+    def __repr__(self):
+        return 'LogRecord(%s, %s, %r)' % (self.level, self.component, self.message)
+
+
+class FFMpegLog(object):
+
+    """
+    Parses, as it arrives, the output of an ffmpeg process run with the
+    log level of each message printed (see option), into LogRecord. Only
+    the latest records of each level are kept, the log of a long
+    conversion doesn't grow in memory. The attributes are:
+      * level - lowest level ffmpeg prints, 'info' by default
+      * records - dict mapping a level to a deque of its latest records,
+        at most retention[level] of them
+      * counts - dict mapping a level to the number of its records, kept
+        or not
+      * lines - number of records
+      * status - last status line (a LogRecord), None if ffmpeg printed
+        none
+      * dropped_frames, duplicated_frames - frames dropped and duplicated
+        by ffmpeg to keep the output frame rate, from the status lines
+      * signal - number of the signal ffmpeg reported terminating on,
+        None otherwise
+    """
+
+    retention = {'panic': 10, 'fatal': 10, 'error': 50, 'warning': 50, 'info': 20, 'verbose': 20, 'debug': 20,
+                 'trace': 20}
+
+    # [parent @ 0x...] [component @ 0x...] [level] message
+    line_re = re.compile(r'((?:\[[^\[\]]+ @ 0x[0-9a-fA-F]+\] )*)\[(%s)\] ?(.*)' % '|'.join(LEVELS))
+    component_re = re.compile(r'\[([^\[\]]+) @ 0x[0-9a-fA-F]+\] ')
+    line_end_re = re.compile(r'[\r\n]')
+    status_re = re.compile(r'(?:frame|size)=')
+    frames_re = re.compile(r'\b(dup|drop)=\s*(\d+)')
+    signal_re = re.compile(r'[Rr]eceived signal (\d+)')
+
+    def __init__(self, level='info', retention=None):
+        self.level = level
+        if retention:
+            self.retention = dict(self.retention, **retention)
+        self.records = dict((name, collections.deque(maxlen=self.retention[name])) for name in LEVELS)
+        self.counts = dict((name, 0) for name in LEVELS)
+        self.lines = 0
+        self.status = None
+        self.dropped_frames = 0
+        self.duplicated_frames = 0
+        self.signal = None
+        self._buf = ''
+        # lines without a level continue the previous message
+        self._level = 'info'
+        self._component = None
+
+    @property
+    def option(self):
+        """
+        ffmpeg options printing the level of the messages.
+        """
+        return ['-loglevel', 'level+' + self.level]
+
+    def feed(self, data):
+        """
+        Parse data, the next part of the ffmpeg output, and yield the
+        records of the lines it completes.
+        """
+        lines = self.line_end_re.split(self._buf + data)
+        self._buf = lines.pop()
+        for line in lines:
+            if line:
+                yield self._parse(line)
+
+    def close(self):
+        """
+        Parse the end of the output, once ffmpeg exited, and yield the
+        record of its last line if it didn't end with a line end.
+        """
+        line, self._buf = self._buf, ''
+        if line:
+            yield self._parse(line)
+
+    def _parse(self, line):
+        match = self.line_re.match(line)
+        if match:
+            components = self.component_re.findall(match.group(1))
+            self._component = components[-1] if components else None
+            self._level = match.group(2)
+            message = match.group(3)
+        else:
+            message = line
+        record = LogRecord(self.lines, self._level, self._component, message,
+                           status=self._component is None and self.status_re.match(message) is not None)
+        self.lines += 1
+        self.counts[record.level] += 1
+        if record.status:
+            self.status = record
+            for name, value in self.frames_re.findall(message):
+                if name == 'dup':
+                    self.duplicated_frames = int(value)
+                else:
+                    self.dropped_frames = int(value)
+        else:
+            self.records[record.level].append(record)
+            if self.signal is None:
+                match = self.signal_re.search(message)
+                if match:
+                    self.signal = int(match.group(1))
+        return record
+
+    def errors(self):
+        """
+        Return the error records kept (panic, fatal and error levels), in
+        the log order.
+        """
+        return sorted((record for level in ERROR_LEVELS for record in self.records[level]),
+                      key=lambda record: record.index)
+
+    def text(self):
+        """
+        Return the records kept and the last status line, in the log
+        order, one per line.
+        """
+        records = [record for deque in self.records.values() for record in deque]
+        if self.status is not None:
+            records.append(self.status)
+        return '\n'.join(str(record) for record in sorted(records, key=lambda record: record.index))
+
+    def __repr__(self):
+        return 'FFMpegLog(lines=%d, errors=%d, warnings=%d, dropped_frames=%d, duplicated_frames=%d)' % (
+            self.lines, sum(self.counts[level] for level in ERROR_LEVELS), self.counts['warning'],
+            self.dropped_frames, self.duplicated_frames)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PipeInput(object):
+
+    """
+    Media read from a file-like object (having a read method) or from an
+    iterator of bytes chunks, eg. an upload still arriving, and written to
+    the standard input of ffmpeg while it converts it.
+
+    The first probe_size bytes are buffered so that the media can be probed
+    before the conversion starts, and replayed to ffmpeg. The format must
+    be readable from the start of the data: eg. Matroska, WebM, MPEG-TS
+    or MP4 with the moov atom first (faststart).
+
+    Chunks are written by a thread with blocking writes, so the source is
+    only read as fast as ffmpeg consumes it. The whole input is read once:
+    a PipeInput can't be used for two-pass encoding or anything else that
+    reads the input twice.
+
+    >>> upload = PipeInput(request.stream)
+    >>> for progress in Converter().convert(upload, '/tmp/output.mp4', options):
+    ...     pass
+    """
+
+    def __init__(self, source, probe_size=4 * 1024 * 1024, chunk_size=64 * 1024, duration=None):
+        self.source = source
+        self.probe_size = probe_size
+        self.chunk_size = chunk_size
+        self.duration = duration  # media duration, if known beforehand
+        self.error = None
+        self._buffered = []
+        self._prefix = None
+        self._iterator = None
+
+    def _read(self):
+        if self._iterator is None:
+            if hasattr(self.source, 'read'):
+                self._iterator = iter(lambda: self.source.read(self.chunk_size), b'')
+            else:
+                self._iterator = iter(self.source)
+        for chunk in self._iterator:
+            if chunk:
+                return chunk
+        return None
+
+    def prefix(self):
+        """
+        Return the first probe_size bytes (or the whole input if shorter).
+        """
+        if self._prefix is None:
+            size = 0
+            while size < self.probe_size:
+                chunk = self._read()
+                if chunk is None:
+                    break
+                self._buffered.append(chunk)
+                size += len(chunk)
+            self._prefix = b''.join(self._buffered)
+        return self._prefix
+
+    def chunks(self):
+        """
+        Iterate over the whole input, buffered prefix included.
+        """
+        self.prefix()
+        while self._buffered:
+            yield self._buffered.pop(0)
+        while True:
+            chunk = self._read()
+            if chunk is None:
+                break
+            yield chunk
+
+    def write_to(self, stream):
+        """
+        Write the whole input to stream and close it. An error reading the
+        source is kept in the error attribute; ffmpeg exiting early (closing
+        the pipe) is not an error.
+        """
+        try:
+            for chunk in self.chunks():
+                try:
+                    stream.write(chunk)
+                    stream.flush()
+                except (IOError, OSError) as e:
+                    logger.debug('ffmpeg stopped reading its input: %s', e)
+                    break
+        except Exception as e:
+            logger.warning('Error while reading the piped input: %s', e)
+            self.error = e
+        finally:
+            try:
+                stream.close()
+            except (IOError, OSError):
+                pass
+
+    def start(self, stream):
+        """
+        Start writing the input to stream in a thread, and return it.
+        """
+        thread = threading.Thread(target=self.write_to, args=(stream,), name='converter-pipe-input')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class PipeOutput(object):
+
+    """
+    Output fed to a sink while ffmpeg writes it: a callable receiving the
+    bytes chunks, or an object having a write method (eg. a socket file or
+    a multipart upload). Uploading the output overlaps with the encoding
+    and nothing is written to disk.
+
+    A pipe can't be sought, so only streamable formats can be written to
+    it (see formats.BaseFormat.streamable): eg. fmp4, mkv, webm, ogg or
+    mpg (MPEG-TS), not mp4 whose index is written at the end.
+
+    The chunks are read from the pipe by a thread, up to chunk_size bytes
+    at a time, and handed to the sink without being copied again. ffmpeg
+    is blocked while the sink is slower than the encoding.
+
+    >>> upload = storage.open_upload('renditions/720p.mp4')
+    >>> for progress in Converter().convert('input.mov', PipeOutput(upload.write), options):
+    ...     pass
+    """
+
+    def __init__(self, sink, chunk_size=1024 * 1024):
+        self.sink = sink if callable(sink) else sink.write
+        self.chunk_size = chunk_size
+        self.error = None
+        self.size = 0  # bytes written to the sink
+
+    def __repr__(self):
+        return 'PipeOutput(%r)' % (self.sink,)
+
+    def read_from(self, fd):
+        """
+        Hand everything read from the file descriptor fd to the sink, then
+        close fd. An error raised by the sink is kept in the error
+        attribute; the pipe is then closed early, making ffmpeg fail.
+        """
+        try:
+            while True:
+                chunk = os.read(fd, self.chunk_size)
+                if not chunk:
+                    break
+                self.sink(chunk)
+                self.size += len(chunk)
+        except Exception as e:
+            logger.warning('Error while writing the piped output: %s', e)
+            self.error = e
+        finally:
+            os.close(fd)
+
+    def start(self, fd):
+        """
+        Start reading the file descriptor fd in a thread, and return it.
+        """
+        thread = threading.Thread(target=self.read_from, args=(fd,), name='converter-pipe-output')
+        thread.daemon = True
+        thread.start()
+        return thread
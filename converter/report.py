@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+
+
+class ResourceUsage(object):
+
+    """
+    Resources used by ffmpeg (or ffprobe) processes, as reported by
+    os.wait4 when they exit, summed over the processes. The attributes are:
+      * processes - number of processes
+      * wall_time - seconds between their start and their exit
+      * user_time, system_time - CPU seconds
+      * max_rss - largest resident set size of a process, in bytes
+      * block_input, block_output - block I/O operations (page cache
+        hits are not counted)
+      * voluntary_switches, involuntary_switches - context switches,
+        waiting for I/O and preempted
+    """
+
+    fields = ('processes', 'wall_time', 'user_time', 'system_time', 'max_rss', 'block_input', 'block_output',
+              'voluntary_switches', 'involuntary_switches')
+
+    def __init__(self, **values):
+        for field in self.fields:
+            setattr(self, field, values.get(field, 0))
+
+    @classmethod
+    def from_rusage(cls, rusage, wall_time):
+        return cls(
+            processes=1, wall_time=wall_time, user_time=rusage.ru_utime, system_time=rusage.ru_stime,
+            # kilobytes, except on macOS
+            max_rss=rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024,
+            block_input=rusage.ru_inblock, block_output=rusage.ru_oublock,
+            voluntary_switches=rusage.ru_nvcsw, involuntary_switches=rusage.ru_nivcsw)
+
+    def add(self, other):
+        for field in self.fields:
+            if field == 'max_rss':
+                self.max_rss = max(self.max_rss, other.max_rss)
+            else:
+                setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    @property
+    def cpu_time(self):
+        return self.user_time + self.system_time
+
+    def as_dict(self):
+        return dict((field, getattr(self, field)) for field in self.fields)
+
+    def __repr__(self):
+        return 'ResourceUsage(processes=%d, wall_time=%.2f, cpu_time=%.2f, max_rss=%d)' % (
+            self.processes, self.wall_time, self.cpu_time, self.max_rss)
+
+
+class BenchmarkStats(object):
+
+    """
+    CPU and memory used by ffmpeg as it reports them itself, when run
+    with -benchmark (totals) or -benchmark_all (totals and stages),
+    summed over the processes. The attributes are:
+      * processes - number of processes reporting their totals
+      * user_time, system_time, real_time - seconds
+      * max_rss - largest resident set size reported, in bytes
+      * stages - dict mapping a stage (eg. 'decode_video 0.0',
+        'encode_audio 0.1') to a dict of its 'user_time', 'system_time'
+        and 'real_time' in seconds and 'count' of measures, with
+        -benchmark_all only
+    """
+
+    totals_re = re.compile(r'bench: utime=([0-9.]+)s stime=([0-9.]+)s rtime=([0-9.]+)s')
+    maxrss_re = re.compile(r'bench: maxrss=(\d+)(KiB|kB)')
+    stage_re = re.compile(r'bench:\s+(\d+) user\s+(\d+) sys\s+(\d+) real (.+)')
+
+    def __init__(self, stages=False):
+        self.all = stages  # run ffmpeg with -benchmark_all
+        self.processes = 0
+        self.user_time = 0.0
+        self.system_time = 0.0
+        self.real_time = 0.0
+        self.max_rss = 0
+        self.stages = {}
+
+    @property
+    def option(self):
+        return '-benchmark_all' if self.all else '-benchmark'
+
+    def parse_line(self, line):
+        """
+        Add the values of a line of the ffmpeg output, if it is a
+        benchmark line.
+        """
+        if 'bench:' not in line:
+            return
+        match = self.totals_re.search(line)
+        if match:
+            self.processes += 1
+            self.user_time += float(match.group(1))
+            self.system_time += float(match.group(2))
+            self.real_time += float(match.group(3))
+            return
+        match = self.maxrss_re.search(line)
+        if match:
+            self.max_rss = max(self.max_rss, int(match.group(1)) * 1024)
+            return
+        match = self.stage_re.search(line)
+        if match:
+            stage = self.stages.setdefault(match.group(4).strip(), {
+                'user_time': 0.0, 'system_time': 0.0, 'real_time': 0.0, 'count': 0})
+            # microseconds since the previous measure
+            stage['user_time'] += int(match.group(1)) / 1e6
+            stage['system_time'] += int(match.group(2)) / 1e6
+            stage['real_time'] += int(match.group(3)) / 1e6
+            stage['count'] += 1
+
+    def parse(self, output):
+        for line in output.replace('\r', '\n').split('\n'):
+            self.parse_line(line)
+
+    def __repr__(self):
+        return 'BenchmarkStats(user_time=%.2f, system_time=%.2f, real_time=%.2f, max_rss=%d, stages=%d)' % (
+            self.user_time, self.system_time, self.real_time, self.max_rss, len(self.stages))
+
+
+class OutputReport(object):
+
+    """
+    Describes what was done to produce one output. The attributes are:
+      * path - output file
+      * streams - dict mapping a stream type ('video' or 'audio') to a
+        (decision, reason) tuple, decision being 'copy' or 'encode'
+      * pix_fmt_conversion - (source, target) pixel formats if the encoded
+        video is converted to another pixel format, None otherwise
+      * shortcuts - draft mode encoder options, as 'option=value' strings
+      * preset - encoder preset selected to reach the requested
+        target_speed, None if no target speed was requested
+      * frames - (source, output) video frame counts when decimation was
+        requested, None otherwise
+      * size - size of the output in bytes, None if it was not written
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.streams = {}
+        self.pix_fmt_conversion = None
+        self.shortcuts = []
+        self.preset = None
+        self.frames = None
+        self.size = None
+
+    def __repr__(self):
+        streams = ', '.join('%s=%s' % (kind, decision) for kind, (decision, _) in sorted(self.streams.items()))
+        return 'OutputReport(path=%s, %s)' % (self.path, streams)
+
+
+class ConversionReport(object):
+
+    """
+    Describes a conversion, as returned by the conversion generators once
+    they are exhausted (and kept in Converter.last_report), or by the
+    other Converter methods running ffmpeg. The attributes are:
+      * outputs - list of OutputReport, in the order of the outputs
+      * shortcuts - draft mode decoder options, eg. '-lowres 1'
+      * timings - dict mapping a phase name to its wall time in seconds,
+        eg. 'staging' for the wait for the staged input copy
+      * usage - dict mapping a phase name (eg. 'probe', 'pass1', 'pass2',
+        'encode') to the ResourceUsage of its ffmpeg processes
+      * benchmarks - dict mapping a phase name to the BenchmarkStats
+        reported by ffmpeg, when requested
+      * logs - dict mapping a phase name ('pass1', 'pass2' or 'encode')
+        to the log.FFMpegLog of its ffmpeg process: latest errors and
+        warnings, dropped and duplicated frames
+    """
+
+    def __init__(self, outputs=None):
+        self.outputs = [OutputReport(path) for path in outputs or []]
+        self.shortcuts = []
+        self.timings = {}
+        self.usage = {}
+        self.benchmarks = {}
+        self.logs = {}
+
+    def phase(self, name):
+        """
+        Return the ResourceUsage of the processes of the phase name.
+        """
+        return self.usage.setdefault(name, ResourceUsage())
+
+    @property
+    def total_usage(self):
+        total = ResourceUsage()
+        for usage in self.usage.values():
+            total.add(usage)
+        return total
+
+    def merge(self, other, prefix):
+        """
+        Add the phases of other, the report of a conversion run as part of
+        this one, as phases named prefix + their name.
+        """
+        for name, usage in other.usage.items():
+            self.phase(prefix + name).add(usage)
+        for name, seconds in other.timings.items():
+            self.timings[prefix + name] = self.timings.get(prefix + name, 0) + seconds
+        for name, stats in other.benchmarks.items():
+            self.benchmarks[prefix + name] = stats
+        for name, log in other.logs.items():
+            self.logs[prefix + name] = log
+
+    def record_sizes(self, paths=None):
+        """
+        Set the size of the outputs, read from paths (the output paths
+        by default) or from the pipes.PipeOutput.
+        """
+        for output, path in zip(self.outputs, paths or [output.path for output in self.outputs]):
+            if hasattr(path, 'size'):
+                output.size = path.size
+            elif path and os.path.isfile(path):
+                output.size = os.path.getsize(path)
+
+    def __repr__(self):
+        return 'ConversionReport(outputs=%s)' % repr(self.outputs)
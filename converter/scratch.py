@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import errno
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# numbered image sequence of the image2 muxer, eg. thumb%03d.jpg
+_pattern_re = re.compile(r'%(0?\d*)d')
+
+
+class ScratchSpace(object):
+
+    """
+    Temporary directory on a fast local disk (or tmpfs) where ffmpeg
+    writes the outputs of a job, moved to their final path (eg. on a
+    network share) only once the job succeeded. ffmpeg seeks and rewrites
+    (faststart, two-pass logs) stay local, and readers never see a half
+    written output.
+
+    Each output is moved with a rename when the final path is on the same
+    filesystem, otherwise copied (with copy_file_range when available)
+    next to its final path and renamed over it. The directory and
+    whatever is left in it are removed by cleanup.
+
+    >>> scratch = ScratchSpace('/dev/shm')
+    >>> path = scratch.path('/mnt/media/output.mp4')
+    >>> # ... encode to path
+    >>> scratch.commit()
+    >>> scratch.cleanup()
+    """
+
+    def __init__(self, scratch_dir=None):
+        self.directory = tempfile.mkdtemp(prefix='converter-', dir=scratch_dir)
+        self.moves = []  # (scratch path, final path)
+
+    def path(self, final, name=None):
+        """
+        Return the scratch path standing for the final path, a file or a
+        directory, named name in the scratch directory (by default, a
+        unique name ending like the final path).
+        """
+        if name is None:
+            name = '%d-%s' % (len(self.moves), os.path.basename(final))
+        path = os.path.join(self.directory, name)
+        self.moves.append((path, final))
+        return path
+
+    def file(self, name):
+        """
+        Return the path of a scratch-only file (eg. a pass log), removed
+        with the scratch directory.
+        """
+        return os.path.join(self.directory, name)
+
+    def commit(self):
+        """
+        Move the outputs to their final paths, in the order they were
+        added. Outputs not written (eg. not produced by ffmpeg) are skipped.
+        The frames of an image sequence (a path like thumb%03d.jpg) are
+        moved one by one to their numbered final path.
+        """
+        for path, final in self.moves:
+            if os.path.exists(path):
+                move(path, final)
+            else:
+                for frame, final_frame in sequence_files(path, final):
+                    move(frame, final_frame)
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def sequence_files(path, final):
+    """
+    Return the (file, final file) tuples of the frames written for path,
+    an image2 pattern like thumb%03d.jpg, numbered as in final, also a
+    pattern. Nothing is returned if path is not a pattern.
+    """
+    directory, name = os.path.split(path)
+    match = _pattern_re.search(name)
+    final_directory, final_name = os.path.split(final)
+    final_match = _pattern_re.search(final_name)
+    if match is None or final_match is None or not os.path.isdir(directory):
+        return []
+    frame_re = re.compile(re.escape(name[:match.start()]) + r'(\d+)' + re.escape(name[match.end():]) + '$')
+    files = []
+    for entry in sorted(os.listdir(directory)):
+        frame_match = frame_re.match(entry)
+        if frame_match:
+            number = ('%' + final_match.group(1) + 'd') % int(frame_match.group(1))
+            files.append((os.path.join(directory, entry), os.path.join(
+                final_directory, final_name[:final_match.start()] + number + final_name[final_match.end():])))
+    return files
+
+
+def move(src, dst):
+    """
+    Move the file or the directory tree src to dst, each file atomically:
+    a directory is merged in an existing one, a file replaces an existing
+    one.
+    """
+    if os.path.isdir(src):
+        if not os.path.isdir(dst):
+            os.makedirs(dst)
+        for name in os.listdir(src):
+            move(os.path.join(src, name), os.path.join(dst, name))
+        return
+
+    try:
+        os.rename(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    # another filesystem: copy next to the final path, then rename
+    directory, name = os.path.split(dst)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or '.', prefix='.%s.' % name, suffix='.part')
+    try:
+        with open(src, 'rb') as fsrc, os.fdopen(fd, 'wb') as fdst:
+            copy_data(fsrc, fdst)
+        shutil.copymode(src, tmp_path)
+        os.rename(tmp_path, dst)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    os.unlink(src)
+
+
+def copy_data(fsrc, fdst, chunk_size=16 * 1024 * 1024):
+    """
+    Copy the content of the file object fsrc to fdst, in the kernel with
+    copy_file_range when possible (Linux, Python 3.8), which NFS and some
+    other filesystems can offload to the server.
+    """
+    if hasattr(os, 'copy_file_range'):
+        copied = 0
+        try:
+            while True:
+                size = os.copy_file_range(fsrc.fileno(), fdst.fileno(), chunk_size)
+                if not size:
+                    return
+                copied += size
+        except OSError as e:
+            if copied or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+            logger.debug('copy_file_range not supported, copying %s in user space', fsrc.name)
+    shutil.copyfileobj(fsrc, fdst, chunk_size)
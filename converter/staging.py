@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from converter.scratch import copy_data
+
+logger = logging.getLogger(__name__)
+
+
+class StagedInput(object):
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.pins = 0  # conversions using the staged copy
+        self.future = None
+
+
+class InputStager(object):
+
+    """
+    Local copies of inputs kept on slow (eg. network) storage, so that
+    ffmpeg reads them from a local disk: demuxing an MP4 whose index is
+    at the end, or whose streams are badly interleaved, seeks a lot.
+
+    Inputs are copied by worker threads, with large sequential reads
+    (copy_file_range when available). Prefetching the input of the next
+    job while the current one is converted hides the copy time:
+
+    >>> stager = InputStager('/var/tmp', budget=20 * 1024 ** 3)
+    >>> c = Converter(stager=stager)
+    >>> for infile, next_infile in zip(jobs, jobs[1:] + [None]):
+    ...     if next_infile:
+    ...         stager.prefetch(next_infile)
+    ...     for progress in c.convert(infile, ...):
+    ...         pass
+
+    The staged copies take at most budget bytes: the least recently used
+    ones not being converted are removed to make room, and an input not
+    fitting is read from its original path.
+    """
+
+    def __init__(self, staging_dir=None, budget=10 * 1024 ** 3, workers=2):
+        self.directory = tempfile.mkdtemp(prefix='converter-staging-', dir=staging_dir)
+        self.budget = budget
+        self.entries = OrderedDict()  # least recently used first
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _key(self, path):
+        stat = os.stat(path)
+        data = json.dumps([os.path.abspath(path), stat.st_size, stat.st_mtime])
+        return hashlib.sha1(data.encode('utf-8')).hexdigest(), stat.st_size
+
+    def _copy(self, path, staged_path):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with open(path, 'rb') as fsrc, os.fdopen(fd, 'wb') as fdst:
+                copy_data(fsrc, fdst)
+            os.rename(tmp_path, staged_path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        logger.debug('Staged %s to %s', path, staged_path)
+
+    def _entry(self, path):
+        # called with the lock held
+        key, size = self._key(path)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry
+
+        used = sum(entry.size for entry in self.entries.values())
+        for old_key, old_entry in list(self.entries.items()):
+            if used + size <= self.budget:
+                break
+            if old_entry.pins or not old_entry.future.done():
+                continue
+            del self.entries[old_key]
+            used -= old_entry.size
+            if os.path.exists(old_entry.path):
+                os.unlink(old_entry.path)
+        if used + size > self.budget:
+            logger.debug('No room to stage %s (%d bytes)', path, size)
+            return None
+
+        entry = StagedInput(os.path.join(self.directory, key + os.path.splitext(path)[1]), size)
+        entry.future = self._executor.submit(self._copy, path, entry.path)
+        self.entries[key] = entry
+        return entry
+
+    def prefetch(self, path):
+        """
+        Start copying path in the background, unless it is already staged.
+        Return False if it can't be staged (no room left).
+        """
+        with self._lock:
+            return self._entry(path) is not None
+
+    def stage(self, path):
+        """
+        Return the path of the staged copy of path, waiting for the copy
+        to finish (starting it if needed), or path itself if it can't be
+        staged. The copy is kept until released with release().
+        """
+        if os.path.dirname(os.path.abspath(path)) == self.directory:
+            return path
+        with self._lock:
+            entry = self._entry(path)
+            if entry is None:
+                return path
+            entry.pins += 1
+        try:
+            entry.future.result()
+        except Exception as e:
+            logger.warning('Could not stage %s, reading it in place: %s', path, e)
+            with self._lock:
+                entry.pins -= 1
+                for key, other in list(self.entries.items()):
+                    if other is entry:
+                        del self.entries[key]
+            return path
+        return entry.path
+
+    def release(self, staged_path):
+        """
+        Allow the staged copy returned by stage() to be evicted.
+        """
+        with self._lock:
+            for entry in self.entries.values():
+                if entry.path == staged_path and entry.pins:
+                    entry.pins -= 1
+                    break
+
+    def close(self):
+        """
+        Wait for the running copies and remove all the staged copies.
+        """
+        self._executor.shutdown(wait=True)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.entries.clear()
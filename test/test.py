@@ -1,10 +1,13 @@
 #!/usr/bin/env python
 
+import io
+import json
 import os
 import random
 import shutil
 import string
 import sys
+import time
 import unittest
 
 # modify the path so that parent directory is in it
@@ -12,10 +15,21 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.dirname(current_dir))
 
 from converter import ffmpeg, formats, codecs, Converter, ConverterError  # NOQA
+from converter.branding import Branding  # NOQA
+from converter.calibration import PresetCalibration  # NOQA
+from converter.capabilities import Capabilities  # NOQA
+from converter.filters import graph_filters, splice_video_filters  # NOQA
+from converter.instrumentation import PrometheusExporter, ProcessEvent  # NOQA
+from converter.log import FFMpegLog  # NOQA
+from converter.pipes import PipeInput, PipeOutput  # NOQA
+from converter.report import ConversionReport, ResourceUsage  # NOQA
+from converter.scratch import ScratchSpace  # NOQA
+from converter.staging import InputStager  # NOQA
 
 
 FFMPEG_PATH = 'ffmpeg'
 FFPROBE_PATH = 'ffprobe'
+FAKE_FFMPEG_PATH = os.path.join(os.path.dirname(current_dir), 'benchmarks', 'fake_ffmpeg.py')
 
 
 def verify_progress(p):
@@ -80,6 +94,25 @@ class TestFFMpeg(unittest.TestCase):
             ex = sys.exc_info()[1]
             return ex
 
+    def stub_ffmpeg(self):
+        # an ffmpeg answering the capabilities queries, logging its calls
+        path = os.path.join(self.temp_dir, 'ffmpeg')
+        with open(path, 'w') as f:
+            f.write('''#!%s
+import sys
+with open(sys.argv[0] + '.calls', 'a') as calls:
+    calls.write(sys.argv[-1] + '\\n')
+print({
+    '-version': 'ffmpeg version stub',
+    '-encoders': ' ------\\n V..... libx264 H.264\\n V..... libtheora Theora\\n A..... aac AAC',
+    '-filters': ' ... crop V->V Crop\\n ... scale V->V Scale\\n ... format V->V Format',
+    '-pix_fmts': '-----\\nIO... yuv420p 3 12\\nIO... yuv444p 3 24',
+    '-muxers': ' --\\n  E mp4 MP4\\n  E ogg Ogg',
+}.get(sys.argv[-1], ''))
+''' % sys.executable)
+        os.chmod(path, 0o755)
+        return path
+
     @staticmethod
     def ensure_notexist(f):
         if os.path.exists(f):
@@ -230,6 +263,13 @@ class TestFFMpeg(unittest.TestCase):
                          formats.MovFormat().parse_options({'format': 'mov'}))
         self.assertEqual(['-f', 'mp4'],
                          formats.Mp4Format().parse_options({'format': 'mp4'}))
+        self.assertEqual(['-f', 'mp4', '-moov_size', '65536'],
+                         formats.Mp4Format().parse_options({'format': 'mp4', 'faststart': True, 'moov_size': 65536}))
+        self.assertEqual(['-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof'],
+                         formats.FragmentedMp4Format().parse_options({'format': 'fmp4'}))
+        self.assertEqual(['-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof+cmaf',
+                          '-min_frag_duration', '2000000'],
+                         formats.FragmentedMp4Format().parse_options({'format': 'fmp4', 'cmaf': True, 'fragment_duration': 2}))
         self.assertEqual(['-f', 'mpegts'],
                          formats.MpegFormat().parse_options({'format': 'mpg'}))
         self.assertEqual(['-f', 'mp3'],
@@ -237,6 +277,10 @@ class TestFFMpeg(unittest.TestCase):
         self.assertEqual(['-f', 'msmpeg4'],
                          formats.WmvFormat().parse_options({'format': 'wmv'}))
 
+        self.assertTrue(formats.FragmentedMp4Format.streamable)
+        self.assertTrue(formats.MpegFormat.streamable)
+        self.assertFalse(formats.Mp4Format.streamable)
+
     def test_codecs(self):
         c = codecs.BaseCodec()
         self.assertRaisesSpecific(ValueError, c.parse_options, {})
@@ -267,35 +311,102 @@ class TestFFMpeg(unittest.TestCase):
 
         self.assertEqual(
             ['-codec:v', 'doctest', '-pix_fmt', 'yuv420p', '-r', '25.0', '-b:v',
-                '300k', '-s', '320x240', '-aspect', '320:240'],
+                '300k', '-aspect', '320:240', '-vf', 'fps=25.0,scale=320:240'],
             c.parse_options({'codec': 'doctest', 'fps': '25', 'bitrate': '300', 'width': 320, 'height': 240}))
 
         self.assertEqual(
-            ['-codec:v', 'doctest', '-pix_fmt', 'yuv420p', '-s', '384x240',
-                '-aspect', '320:240', '-vf', 'crop=320:240:32:0'],
+            ['-codec:v', 'doctest', '-pix_fmt', 'yuv420p',
+                '-aspect', '320:240', '-vf', 'crop=iw*320/384:ih,scale=320:240'],
             c.parse_options({'codec': 'doctest', 'src_width': 640, 'src_height': 400, 'mode': 'crop', 'width': 320, 'height': 240}))
 
         self.assertEqual(
-            ['-codec:v', 'doctest', '-pix_fmt', 'yuv420p', '-s', '320x240', '-aspect',
-                '320:200', '-vf', 'crop=320:200:0:20'],
+            ['-codec:v', 'doctest', '-pix_fmt', 'yuv420p', '-aspect',
+                '320:200', '-vf', 'crop=iw:ih*200/240,scale=320:200'],
             c.parse_options({'codec': 'doctest', 'src_width': 640, 'src_height': 480, 'mode': 'crop', 'width': 320, 'height': 200}))
 
         self.assertEqual(
-            ['-codec:v', 'doctest', '-pix_fmt', 'yuv420p', '-s', '320x200',
-                '-aspect', '320:240', '-vf', 'pad=320:240:0:20'],
+            ['-codec:v', 'doctest', '-pix_fmt', 'yuv420p',
+                '-aspect', '320:240', '-vf', 'scale=320:200,pad=320:240:0:20'],
             c.parse_options({'codec': 'doctest', 'src_width': 640, 'src_height': 400, 'mode': 'pad', 'width': 320, 'height': 240}))
 
         self.assertEqual(
-            ['-codec:v', 'doctest', '-pix_fmt', 'yuv420p', '-s', '266x200',
-                '-aspect', '320:200', '-vf', 'pad=320:200:27:0'],
+            ['-codec:v', 'doctest', '-pix_fmt', 'yuv420p',
+                '-aspect', '320:200', '-vf', 'scale=266:200,pad=320:200:27:0'],
             c.parse_options({'codec': 'doctest', 'src_width': 640, 'src_height': 480, 'mode': 'pad', 'width': 320, 'height': 200}))
 
-        self.assertEqual(['-codec:v', 'doctest', '-pix_fmt', 'yuv420p', '-s', '320x240'], c.parse_options(
+        self.assertEqual(['-codec:v', 'doctest', '-pix_fmt', 'yuv420p', '-vf', 'scale=320:240'], c.parse_options(
             {'codec': 'doctest', 'src_width': 640, 'src_height': 480, 'width': 320}))
 
-        self.assertEqual(['-codec:v', 'doctest', '-pix_fmt', 'yuv420p', '-s', '320x240'], c.parse_options(
+        self.assertEqual(['-codec:v', 'doctest', '-pix_fmt', 'yuv420p', '-vf', 'scale=320:240'], c.parse_options(
             {'codec': 'doctest', 'src_width': 640, 'src_height': 480, 'height': 240}))
 
+        self.assertEqual(
+            ['-codec:v', 'mpeg2video', '-pix_fmt', 'yuv420p', '-aspect', '320:240',
+                '-vf', 'crop=iw*320/384:ih,scale=320:240,setdar=320/240'],
+            codecs.Mpeg2Codec().parse_options(
+                {'codec': 'mpeg2', 'src_width': 640, 'src_height': 400, 'mode': 'crop', 'width': 320, 'height': 240}))
+        self.assertEqual(
+            ['-codec:v', 'h264_vaapi', '-pix_fmt', 'yuv420p', '-aspect', '320:240',
+                '-vf', 'scale=320:240,format=nv12|vaapi,hwupload'],
+            codecs.VaapiH264Codec().parse_options({'codec': 'h264_vaapi', 'width': 320, 'height': 240}))
+
+        self.assertEqual(
+            ['-codec:v', 'libx264', '-pix_fmt', 'yuv420p', '-aspect', '320:240', '-vf',
+                'scale=320:240:flags=fast_bilinear', '-sws_flags', 'fast_bilinear'],
+            codecs.H264Codec().parse_options(
+                {'codec': 'h264', 'width': 320, 'height': 240, 'scaler': 'fast_bilinear', 'filter_threads': 4}))
+        self.assertEqual(
+            ['-codec:v', 'libx264', '-pix_fmt', 'yuv420p', '-aspect', '320:240', '-vf', 'scale=320:240'],
+            codecs.H264Codec().parse_options(
+                {'codec': 'h264', 'width': 320, 'height': 240, 'scaler': 'bogus', 'filter_complex_threads': 0}))
+        self.assertEqual(['-filter_threads', '4'], codecs.H264Codec().global_options(
+            {'codec': 'h264', 'filter_threads': 4, 'filter_complex_threads': 0}))
+        c = Converter(ffmpeg_path=FAKE_FFMPEG_PATH, ffprobe_path=FAKE_FFMPEG_PATH)
+        self.assertEqual(['-filter_threads', '4'], c._global_options([
+            {'format': 'mp4', 'video': {'codec': 'h264', 'filter_threads': 4}},
+            {'format': 'mp4', 'video': {'codec': 'h264', 'filter_threads': 4}}, {'format': 'mp3', 'audio': {}}]))
+        self.assertRaisesSpecific(ConverterError, c._global_options, [
+            {'format': 'mp4', 'video': {'codec': 'h264', 'filter_threads': 4}},
+            {'format': 'mp4', 'video': {'codec': 'h264', 'filter_threads': 2}}])
+
+        self.assertEqual(
+            ['-codec:v', 'libx264', '-pix_fmt', 'yuv420p', '-fpsmax', '25.0', '-aspect', '320:240',
+                '-vf', 'mpdecimate,scale=320:240', '-tune', 'stillimage'],
+            codecs.H264Codec().parse_options(
+                {'codec': 'h264', 'width': 320, 'height': 240, 'fps': 25, 'decimate': True}))
+
+        self.assertEqual(
+            ['-codec:v', 'libx264', '-pix_fmt', 'yuv420p', '-aspect', '640:266',
+                '-vf', 'crop=1920:800:0:140,scale=640:266'],
+            codecs.H264Codec().parse_options(
+                {'codec': 'h264', 'width': 640, 'height': 360, 'mode': 'autocrop', 'crop': '1920:800:0:140',
+                 'src_width': 1920, 'src_height': 1080}))
+        self.assertEqual(
+            ['-codec:v', 'libx264', '-pix_fmt', 'yuv420p', '-vf', 'crop=1920:800:0:140,scale=640:266'],
+            codecs.H264Codec().parse_options(
+                {'codec': 'h264', 'width': 640, 'mode': 'autocrop', 'crop': '1920:800:0:140',
+                 'src_width': 1920, 'src_height': 1080}))
+        self.assertEqual(
+            ['-codec:v', 'libx264', '-pix_fmt', 'yuv420p', '-vf', 'scale=640:360'],
+            codecs.H264Codec().parse_options(
+                {'codec': 'h264', 'width': 640, 'mode': 'autocrop', 'crop': 'bogus',
+                 'src_width': 1920, 'src_height': 1080}))
+
+        optlist = ['-codec:v', 'libx264', '-vf', 'scale=320:240', '-map', '[outv]', '-map', '[outa]']
+        graph_opts = ['-i', 'logo.png', '-filter_complex', '[0:v:0][1:v:0]overlay=10:10[outv]']
+        splice_video_filters(optlist, graph_opts)
+        self.assertEqual(['-codec:v', 'libx264', '-map', '[outvvf]', '-map', '[outa]'], optlist)
+        self.assertEqual(['-i', 'logo.png', '-filter_complex',
+                          '[0:v:0][1:v:0]overlay=10:10[outv];[outv]scale=320:240[outvvf]'], graph_opts)
+
+        # the unlabeled output of a ffmpeg_skin_opts graph
+        optlist = ['-codec:v', 'libtheora', '-vf', 'fps=15,scale=320:240']
+        graph_opts = ['-i', 'logo.png', '-filter_complex', '[1]scale=151:138[wm];[0][wm]overlay=10:10']
+        splice_video_filters(optlist, graph_opts)
+        self.assertEqual(['-codec:v', 'libtheora'], optlist)
+        self.assertEqual(['-i', 'logo.png', '-filter_complex',
+                          '[1]scale=151:138[wm];[0][wm]overlay=10:10,fps=15,scale=320:240'], graph_opts)
+
         self.assertEqual(['-codec:a', 'aac', '-strict', 'experimental'],
                          codecs.AacCodec().parse_options({'codec': 'aac'}))
         self.assertEqual(
@@ -322,6 +433,28 @@ class TestFFMpeg(unittest.TestCase):
             ['-codec:v', 'h263', '-pix_fmt', 'yuv420p'], codecs.H263Codec().parse_options({'codec': 'h263'}))
         self.assertEqual(
             ['-codec:v', 'libx264', '-pix_fmt', 'yuv420p'], codecs.H264Codec().parse_options({'codec': 'h264'}))
+        self.assertEqual(
+            ['-codec:v', 'libx265', '-pix_fmt', 'yuv420p'], codecs.H265Codec().parse_options({'codec': 'h265'}))
+        self.assertEqual(
+            ['-codec:v', 'libx265', '-pix_fmt', 'yuv420p', '-preset', 'fast', '-crf', '26', '-tune', 'grain',
+                '-x265-params', 'frame-threads=4:pools=+'],
+            codecs.H265Codec().parse_options({'codec': 'h265', 'preset': 'fast', 'quality': 26, 'tune': 'grain',
+                                              'frame_threads': 4, 'pools': '+'}))
+        self.assertEqual(
+            ['-codec:v', 'libx265', '-pix_fmt', 'yuv420p'],
+            codecs.H265Codec().parse_options({'codec': 'h265', 'quality': 60, 'frame_threads': 0,
+                                              'pools': 'a:b'}))
+        self.assertEqual(
+            ['-codec:v', 'libsvtav1', '-pix_fmt', 'yuv420p'], codecs.SvtAv1Codec().parse_options({'codec': 'av1'}))
+        self.assertEqual(
+            ['-codec:v', 'libsvtav1', '-pix_fmt', 'yuv420p', '-preset', '8', '-crf', '35',
+                '-svtav1-params', 'tune=0:lp=4:tile-columns=2:tile-rows=1'],
+            codecs.SvtAv1Codec().parse_options({'codec': 'av1', 'preset': '8', 'quality': 35, 'tune': 0,
+                                                'level_of_parallelism': 4, 'tile_columns': 2, 'tile_rows': 1}))
+        self.assertEqual(
+            ['-codec:v', 'libsvtav1', '-pix_fmt', 'yuv420p'],
+            codecs.SvtAv1Codec().parse_options({'codec': 'av1', 'preset': 14, 'quality': 64, 'tune': 3,
+                                                'level_of_parallelism': 7, 'tile_columns': 5, 'tile_rows': -1}))
         self.assertEqual(
             ['-scodec', 'mov_text'], codecs.MOVTextCodec().parse_options({'codec': 'mov_text'}))
         self.assertEqual(
@@ -357,6 +490,486 @@ class TestFFMpeg(unittest.TestCase):
         self.assertEqual(
             ['-codec:v', 'msmpeg4', '-pix_fmt', 'yuv420p'], codecs.WmvCodec().parse_options({'codec': 'wmv'}))
 
+    def test_codecs_pix_fmt(self):
+        c = codecs.H264Codec()
+        self.assertEqual(['-codec:v', 'libx264', '-pix_fmt', 'yuv444p'],
+                         c.parse_options({'codec': 'h264', 'pix_fmt': 'yuv444p'}))
+        self.assertEqual(['-codec:v', 'libx264', '-pix_fmt', 'yuv420p'],
+                         c.parse_options({'codec': 'h264', 'pix_fmt': 'foo'}))
+        self.assertEqual(['-codec:v', 'libx264'],
+                         c.parse_options({'codec': 'h264', 'pix_fmt': 'auto', 'src_pix_fmt': 'yuvj420p'}))
+        self.assertEqual(['-codec:v', 'libx264', '-pix_fmt', 'yuv420p'],
+                         c.parse_options({'codec': 'h264', 'pix_fmt': 'auto', 'src_pix_fmt': 'yuv420p10le'}))
+        self.assertEqual(['-codec:v', 'libx264', '-pix_fmt', 'yuv420p'],
+                         c.parse_options({'codec': 'h264', 'pix_fmt': 'auto'}))
+
+        self.assertIsNone(c.pix_fmt_conversion({'codec': 'h264', 'pix_fmt': 'auto', 'src_pix_fmt': 'yuvj420p'}))
+        self.assertIsNone(c.pix_fmt_conversion({'codec': 'h264', 'src_pix_fmt': 'yuv420p'}))
+        self.assertEqual(('yuvj420p', 'yuv420p'), c.pix_fmt_conversion({'codec': 'h264', 'src_pix_fmt': 'yuvj420p'}))
+        self.assertEqual(('yuvj420p', 'yuv420p'),
+                         codecs.DivxCodec().pix_fmt_conversion({'codec': 'divx', 'pix_fmt': 'auto', 'src_pix_fmt': 'yuvj420p'}))
+
+    def test_codecs_can_copy(self):
+        stream = ffmpeg.MediaStreamInfo()
+        for key, value in (('codec_type', 'video'), ('codec_name', 'h264'), ('width', '1280'), ('height', '720'),
+                           ('pix_fmt', 'yuv420p'), ('r_frame_rate', '25/1'), ('bit_rate', '1500000')):
+            stream.parse_ffprobe(key, value)
+
+        c = codecs.H264Codec()
+        self.assertEqual((True, 'matches the requested options'), c.can_copy({'codec': 'h264'}, stream))
+        self.assertTrue(c.can_copy({'codec': 'h264', 'width': 1920, 'height': 1080, 'fps': 25, 'max_bitrate': 2000}, stream)[0])
+        self.assertEqual((False, 'width 1280 is above 640'), c.can_copy({'codec': 'h264', 'width': 640}, stream))
+        self.assertEqual((False, 'bitrate 1500000 is above 1000k'), c.can_copy({'codec': 'h264', 'max_bitrate': 1000}, stream))
+        self.assertEqual((False, 'pixel format yuv420p is not yuv444p'), c.can_copy({'codec': 'h264', 'pix_fmt': 'yuv444p'}, stream))
+        self.assertFalse(c.can_copy({'codec': 'h264', 'rotate': 90}, stream)[0])
+        self.assertEqual((False, 'bitrate 1500000 is above 1000k'), c.can_copy({'codec': 'h264', 'bitrate': 1000}, stream))
+        self.assertEqual((False, 'codec h264 is not vp8'), codecs.Vp8Codec().can_copy({'codec': 'vp8'}, stream))
+        self.assertEqual((False, 'profile None is not within main'), c.can_copy({'codec': 'h264', 'profile': 'main'}, stream))
+
+        stream.parse_ffprobe('profile', 'High')
+        stream.parse_ffprobe('level', '51')
+        self.assertTrue(c.can_copy({'codec': 'h264', 'profile': 'high', 'level': '5.1'}, stream)[0])
+        self.assertTrue(c.can_copy({'codec': 'h264', 'profile': 'high10', 'level': '52'}, stream)[0])
+        self.assertEqual((False, 'profile High is not within baseline'),
+                         c.can_copy({'codec': 'h264', 'profile': 'baseline'}, stream))
+        self.assertEqual((False, 'level 51 is above 3.0'), c.can_copy({'codec': 'h264', 'level': '3.0'}, stream))
+        stream.parse_ffprobe('profile', 'Constrained Baseline')
+        self.assertTrue(c.can_copy({'codec': 'h264', 'profile': 'main'}, stream)[0])
+
+        stream = ffmpeg.MediaStreamInfo()
+        for key, value in (('codec_type', 'audio'), ('codec_name', 'aac'), ('channels', '2'), ('sample_rate', '44100'),
+                           ('bit_rate', '128000')):
+            stream.parse_ffprobe(key, value)
+
+        c = codecs.AacCodec()
+        self.assertTrue(c.can_copy({'codec': 'aac', 'channels': 2, 'samplerate': 44100, 'bitrate': 128}, stream)[0])
+        self.assertTrue(codecs.FdkAacCodec().can_copy({'codec': 'libfdk_aac'}, stream)[0])
+        self.assertEqual((False, '2 channels is above 1'), c.can_copy({'codec': 'aac', 'channels': 1}, stream))
+        self.assertEqual((False, 'sample rate 44100.0 is not 48000'), c.can_copy({'codec': 'aac', 'samplerate': 48000}, stream))
+        self.assertEqual((False, 'audio filter requested'), c.can_copy({'codec': 'aac', 'filter': 'volume=2'}, stream))
+
+    def test_can_copy_bumpers(self):
+        branding = Branding({'intro': 'intro.mp4', 'cache_dir': self.temp_dir})
+        video = {'codec': 'h264', 'width': 640, 'height': 360}
+        self.assertFalse(Converter._can_copy_bumpers(branding, None, {}, {'video': video}))
+        self.assertTrue(Converter._can_copy_bumpers(branding, None, {}, {'video': dict(video, fps=25)}))
+
+        # the phases of a fallback conversion are merged into the report
+        report, fallback = ConversionReport(), ConversionReport()
+        report.phase('encode').add(ResourceUsage(processes=1, user_time=2.0))
+        fallback.phase('encode').add(ResourceUsage(processes=1, user_time=3.0))
+        fallback.timings['encode'] = 4.0
+        report.merge(fallback, 'branding_')
+        self.assertEqual(2, report.total_usage.processes)
+        self.assertEqual(5.0, report.total_usage.user_time)
+        self.assertEqual({'branding_encode': 4.0}, report.timings)
+
+    def test_draft_options(self):
+        c = Converter(ffmpeg_path=FAKE_FFMPEG_PATH, ffprobe_path=FAKE_FFMPEG_PATH)
+        info = ffmpeg.MediaInfo()
+        info.parse_ffprobe('[STREAM]\nindex=0\ncodec_name=mpeg4\ncodec_type=video\nwidth=1280\nheight=720\n'
+                           '[/STREAM]\n[FORMAT]\nformat_name=avi\nduration=10.0\n[/FORMAT]\n')
+        video = {'codec': 'h264', 'width': 320, 'height': 180}
+        self.assertEqual(['-lowres', '2'], c._draft_options(
+            info, [{'format': 'mp4', 'video': video}], True, ConversionReport(['a.mp4'])))
+        # the crop rectangle and the skin graph are in source pixels
+        for crop in ({'mode': 'autocrop'}, {'mode': 'autocrop', 'crop': '1280:536:0:92'},
+                     {'ffmpeg_skin_opts': '-i logo.png -filter_complex [0][1]overlay=10:10'}):
+            self.assertEqual([], c._draft_options(
+                info, [{'format': 'mp4', 'video': dict(video, **crop)}], True, ConversionReport(['a.mp4'])))
+
+    def test_concat_signature(self):
+        def info(avg_frame_rate, profile):
+            media_info = ffmpeg.MediaInfo()
+            media_info.parse_ffprobe('[STREAM]\nindex=0\ncodec_name=h264\nprofile=%s\ncodec_type=video\nwidth=1280\n'
+                                     'height=720\npix_fmt=yuv420p\nlevel=31\nr_frame_rate=%s\navg_frame_rate=%s\n'
+                                     '[/STREAM]\n[FORMAT]\nformat_name=mp4\nduration=10.0\n[/FORMAT]\n' % (
+                                         profile, avg_frame_rate, avg_frame_rate))
+            return media_info
+
+        infos = {'25.mp4': info('25/1', 'High'), '30.mp4': info('30000/1001', 'High'),
+                 'main.mp4': info('25/1', 'Main')}
+        f = ffmpeg.FFMpeg(ffmpeg_path=FAKE_FFMPEG_PATH, ffprobe_path=FAKE_FFMPEG_PATH)
+        f.probe = lambda path, usage=None: infos[path]
+        self.assertEqual('30000/1001', infos['30.mp4'].video.video_avg_frame_rate)
+        self.assertEqual(('Main', 31), (infos['main.mp4'].video.profile, infos['main.mp4'].video.level))
+        output = os.path.join(self.temp_dir, 'joined.mp4')
+        self.assertRaisesSpecific(ffmpeg.ArgumentError, f.concat, ['25.mp4', '30.mp4'], output)
+        self.assertRaisesSpecific(ffmpeg.ArgumentError, f.concat, ['25.mp4', 'main.mp4'], output)
+
+    def test_capabilities_parsing(self):
+        encoders = """Encoders:
+ V..... = Video
+ A..... = Audio
+ ------
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC (codec h264)
+ A....D aac                  AAC (Advanced Audio Coding)
+"""
+        self.assertEqual({'libx264', 'aac'}, Capabilities.parse_encoders(encoders))
+
+        filters = """Filters:
+  T.. = Timeline support
+  | = Source or sink filter
+ ... abench            A->A       Benchmark part of an audio filter chain.
+ TSC scale             V->V       Scale the input video size and/or convert the image format.
+ ... anullsrc          |->A       Null audio source, return empty audio frames.
+"""
+        self.assertEqual({'abench', 'scale', 'anullsrc'}, Capabilities.parse_filters(filters))
+
+        pix_fmts = """Pixel formats:
+I.... = Supported Input  format for conversion
+.O... = Supported Output format for conversion
+FLAGS NAME            NB_COMPONENTS BITS_PER_PIXEL
+-----
+IO... yuv420p                3            12
+I.... xyz12le                3            36
+"""
+        self.assertEqual({'yuv420p'}, Capabilities.parse_pix_fmts(pix_fmts))
+
+        muxers = """File formats:
+ D. = Demuxing supported
+ .E = Muxing supported
+ --
+  E 3g2             3GP2 (3GPP2 file format)
+ DE matroska,webm   Matroska
+ D  aa              Audible AA format files
+"""
+        self.assertEqual({'3g2', 'matroska', 'webm'}, Capabilities.parse_muxers(muxers))
+
+    def test_capabilities_stub(self):
+        stub = self.stub_ffmpeg()
+        cache_dir = os.path.join(self.temp_dir, 'caps')
+        exporter = PrometheusExporter()
+        wrapper = ffmpeg.FFMpeg(ffmpeg_path=stub, ffprobe_path=FAKE_FFMPEG_PATH, instrumentation=exporter)
+        caps = Capabilities(wrapper, cache_dir)
+        self.assertEqual('ffmpeg version stub', caps.version)
+        self.assertEqual({'libx264', 'libtheora', 'aac'}, caps.encoders)
+        with open(stub + '.calls') as f:
+            calls = f.read().split()
+        self.assertEqual(5, len(calls))
+        self.assertIn('converter_processes_total{program="ffmpeg",operation="capabilities"} 5',
+                      exporter.render().split('\n'))
+
+        # the cache is found without running ffmpeg
+        self.assertEqual('ffmpeg version stub', Capabilities(wrapper, cache_dir).version)
+        with open(stub + '.calls') as f:
+            self.assertEqual(calls, f.read().split())
+
+        c = Converter(ffmpeg_path=stub, ffprobe_path=FAKE_FFMPEG_PATH, check_capabilities=True,
+                      capabilities_cache_dir=cache_dir)
+        self.assertIn('scale=320:240', ' '.join(c.parse_options({
+            'format': 'mp4', 'video': {'codec': 'h264', 'width': 320, 'height': 240}})))
+        self.assertRaisesSpecific(ConverterError, c.parse_options, {
+            'format': 'mp4', 'video': {'codec': 'h264', 'decimate': True}})
+        self.assertIn('yuv420p', c.parse_options({'format': 'mp4', 'video': {'codec': 'h264', 'pix_fmt': 'auto'}}))
+        self.assertEqual(['-an', '-codec:v', 'libx264', '-sn', '-f', 'mp4'], c.parse_options(
+            {'format': 'mp4', 'video': {'codec': 'h264', 'pix_fmt': 'auto', 'src_pix_fmt': 'nv12'}}))
+        self.assertRaisesSpecific(ConverterError, c.parse_options, {
+            'format': 'mp4', 'video': {'codec': 'h264', 'pix_fmt': 'yuv422p'}})
+        self.assertEqual({'crop', 'scale', 'overlay', 'concat'}, graph_filters(
+            '[0:v]crop=iw:ih*3/4,scale=320:240[v];[v][1:v]overlay=W-w-10:10[o];[2:v][o]concat=n=2:v=1:a=0[outv]'))
+
+    def test_pipe_input(self):
+        data = b''.join(bytes(bytearray([i])) * 1000 for i in range(10))
+        pipe = PipeInput(io.BytesIO(data), probe_size=2500, chunk_size=1000)
+        self.assertEqual(data[:3000], pipe.prefix())
+        self.assertEqual(data, b''.join(pipe.chunks()))
+
+        pipe = PipeInput(iter([b'abc', b'', b'def', b'gh']), probe_size=4)
+        self.assertEqual(b'abcdef', pipe.prefix())
+        out = io.BytesIO()
+        out.close = lambda: None
+        pipe.write_to(out)
+        self.assertEqual(b'abcdefgh', out.getvalue())
+        self.assertIsNone(pipe.error)
+
+        def failing():
+            yield b'abc'
+            raise IOError('connection reset')
+
+        pipe = PipeInput(failing())
+        pipe.write_to(io.BytesIO())
+        self.assertIsInstance(pipe.error, IOError)
+
+    def test_resource_usage(self):
+        p = ffmpeg.FFMpeg._spawn([sys.executable, '-c', 'sum(range(1000000))'])
+        p.communicate()
+        self.assertEqual(1, p.usage.processes)
+        self.assertGreater(p.usage.max_rss, 0)
+        self.assertGreater(p.usage.wall_time, 0)
+
+        # reaped by poll
+        polled = ffmpeg.FFMpeg._spawn([sys.executable, '-c', 'import sys; sys.exit(3)'])
+        while polled.poll() is None:
+            time.sleep(0.01)
+        self.assertEqual(3, polled.returncode)
+        self.assertEqual(1, polled.usage.processes)
+        self.assertEqual(3, polled.wait())
+
+        report = ConversionReport()
+        report.phase('encode').add(p.usage)
+        report.phase('encode').add(p.usage)
+        report.phase('probe').add(ResourceUsage(processes=1, user_time=1.0, max_rss=1))
+        total = report.total_usage
+        self.assertEqual(3, total.processes)
+        self.assertEqual(p.usage.max_rss, total.max_rss)
+        self.assertAlmostEqual(2 * p.usage.cpu_time + 1.0, total.cpu_time)
+
+    def test_prometheus_exporter(self):
+        exporter = PrometheusExporter()
+        probe = ProcessEvent('ffprobe', 'probe', ['ffprobe', 'test1.ogg'], 1)
+        probe.duration, probe.returncode = 0.04, 0
+        exporter.exited(probe)
+        convert = ProcessEvent('ffmpeg', 'convert', ['ffmpeg', '-i', 'test1.ogg'], 2)
+        convert.duration, convert.returncode, convert.timecode = 11.0, 0, 33.0
+        convert.usage = ResourceUsage(processes=1, user_time=20.0, system_time=2.0)
+        convert.log = FFMpegLog()
+        list(convert.log.feed('[info] frame=  825 fps=75 time=00:00:33.00 drop=3 speed=3x\n'))
+        exporter.exited(convert)
+        exporter.failed(convert, ffmpeg.FFMpegConvertError('Received signal 15', category='signal'))
+        exporter.dequeued('convert', 7)
+
+        metrics = exporter.render().split('\n')
+        self.assertIn('converter_probe_seconds_bucket{le="0.025"} 0', metrics)
+        self.assertIn('converter_probe_seconds_bucket{le="0.05"} 1', metrics)
+        self.assertIn('converter_encode_speed_bucket{le="2.0"} 0', metrics)
+        self.assertIn('converter_encode_speed_bucket{le="4.0"} 1', metrics)
+        self.assertIn('converter_queue_wait_seconds_bucket{le="+Inf"} 1', metrics)
+        self.assertIn('converter_queue_wait_seconds_sum 7.0', metrics)
+        self.assertIn('converter_cpu_seconds_total{program="ffmpeg",operation="convert"} 22.0', metrics)
+        self.assertIn('converter_errors_total{operation="convert",category="signal"} 1', metrics)
+        self.assertIn('converter_dropped_frames_total{operation="convert"} 3', metrics)
+
+        # readable by the node_exporter, whatever the umask
+        path = os.path.join(self.temp_dir, 'converter.prom')
+        exporter.write(path)
+        self.assertEqual(0o644, os.stat(path).st_mode & 0o777)
+        with open(path) as f:
+            self.assertEqual(exporter.render(), f.read())
+
+    def test_fake_ffmpeg(self):
+        # the wrapper alone, the fake replays a synthetic 60s conversion
+        c = Converter(ffmpeg_path=FAKE_FFMPEG_PATH, ffprobe_path=FAKE_FFMPEG_PATH)
+        info = c.probe(FAKE_FFMPEG_PATH)
+        self.assertEqual(60.0, info.format.duration)
+        self.assertEqual((1280, 720), (info.video.video_width, info.video.video_height))
+
+        output = os.path.join(self.temp_dir, 'output.mkv')
+        progress = list(c.convert(FAKE_FFMPEG_PATH, output, {
+            'format': 'mkv', 'video': {'codec': 'h264'}, 'audio': {'codec': 'aac'}}))
+        self.assertTrue(verify_progress(iter(progress)))
+        self.assertEqual(30, len(progress))
+        self.assertEqual(1.0, progress[-1])
+        self.assertTrue(os.path.exists(output))
+
+    def test_fake_ffmpeg_pipe_input(self):
+        # the writer closes stdin before ffmpeg is waited for
+        c = Converter(ffmpeg_path=FAKE_FFMPEG_PATH, ffprobe_path=FAKE_FFMPEG_PATH)
+        output = os.path.join(self.temp_dir, 'output.mkv')
+        options = {'format': 'mkv', 'video': {'codec': 'h264'}, 'audio': {'codec': 'aac'}}
+        pipe = PipeInput(io.BytesIO(b'\0' * 100000), duration=60.0)
+        self.assertTrue(verify_progress(c.convert(pipe, output, options)))
+        self.assertIsNone(pipe.error)
+
+    def test_fake_ffmpeg_benchmark(self):
+        c = Converter(ffmpeg_path=FAKE_FFMPEG_PATH, ffprobe_path=FAKE_FFMPEG_PATH)
+        output = os.path.join(self.temp_dir, 'output.mkv')
+        options = {'format': 'mkv', 'video': {'codec': 'h264'}, 'audio': {'codec': 'aac'}}
+        list(c.convert(FAKE_FFMPEG_PATH, output, options))
+        self.assertEqual({}, c.last_report.benchmarks)
+
+        list(c.convert(FAKE_FFMPEG_PATH, output, options, benchmark='all'))
+        stats = c.last_report.benchmarks['encode']
+        self.assertEqual(1, stats.processes)
+        self.assertAlmostEqual(0.005, stats.user_time + stats.system_time)
+        self.assertEqual(20480 * 1024, stats.max_rss)
+        self.assertEqual({'user_time': 0.001, 'system_time': 0.0, 'real_time': 0.0012, 'count': 1},
+                         stats.stages['encode_video 0.0'])
+        self.assertEqual(4, len(stats.stages))
+
+    def test_ffmpeg_log(self):
+        log = FFMpegLog(retention={'info': 2})
+        records = list(log.feed('[info] Input #0, ogg, from \'test1.ogg\':\n[info]   Duration: 00:00:33.00\n[libx2'))
+        self.assertEqual(2, len(records))
+        records = list(log.feed('64 @ 0x55d0c6a0f2c0] [warning] too many B-frames\nsecond line\n'
+                                '[info] frame=   10 fps=0.0 time=00:00:00.40 dup=2 drop=1 speed=0.8x    \r'
+                                '[aost#0:1/aac @ 0x5597] [error] Error while processing the decoded data\n'
+                                '[info] Exiting normally, received signal 2.'))
+        self.assertEqual(('warning', 'libx264', 'too many B-frames'),
+                         (records[0].level, records[0].component, records[0].message))
+        self.assertEqual(('warning', 'libx264', 'second line'),
+                         (records[1].level, records[1].component, records[1].message))
+        self.assertTrue(records[2].status)
+        self.assertEqual((1, 2), (log.dropped_frames, log.duplicated_frames))
+        self.assertEqual(['aost#0:1/aac'], [record.component for record in log.errors()])
+        self.assertIsNone(log.signal)
+        self.assertEqual(1, len(list(log.close())))
+        self.assertEqual(2, log.signal)
+        self.assertEqual(7, log.lines)
+        self.assertEqual(4, log.counts['info'])
+        self.assertEqual(2, len(log.records['info']))  # the oldest one dropped, the status line kept apart
+        self.assertEqual(['[info]   Duration: 00:00:33.00', '[libx264] [warning] too many B-frames'],
+                         log.text().split('\n')[:2])
+
+        # classified from the records of a failed conversion
+        recording = os.path.join(self.temp_dir, 'recording.json')
+        with open(recording, 'w') as f:
+            json.dump({'probe': '', 'returncode': 1, 'stderr': [[0, ''.join(
+                '[info] frame=%5d fps=25 time=00:00:%05.2f speed=1.0x    \r' % (frame, frame / 25.0)
+                for frame in range(25, 101, 25))],
+                [0, '\n[vost#0:0/libx264 @ 0x5597] [error] Error submitting video frame to the encoder\n'
+                    '[info] Conversion failed!\n']]}, f)
+        os.environ['FAKE_FFMPEG_RECORDING'] = recording
+        try:
+            f = ffmpeg.FFMpeg(ffmpeg_path=FAKE_FFMPEG_PATH, ffprobe_path=FAKE_FFMPEG_PATH)
+            log = FFMpegLog()
+            conv = f.convert(recording, [os.path.join(self.temp_dir, 'output.mkv')], [['-f', 'matroska']], log=log)
+            self.assertEqual([1.0, 2.0, 3.0, 4.0], [next(conv) for _ in range(4)])
+            with self.assertRaises(ffmpeg.FFMpegConvertError) as context:
+                list(conv)
+        finally:
+            del os.environ['FAKE_FFMPEG_RECORDING']
+        self.assertEqual('encoding', context.exception.category)
+        self.assertIn('Error submitting video frame', context.exception.message)
+        self.assertEqual(1, log.counts['error'])
+
+    def test_scratch_space(self):
+        final_dir = os.path.join(self.temp_dir, 'final')
+        os.makedirs(final_dir)
+        scratch = ScratchSpace(self.temp_dir)
+        output = scratch.path(os.path.join(final_dir, 'output.mp4'))
+        self.assertTrue(output.endswith('output.mp4'))
+        with open(output, 'w') as f:
+            f.write('media')
+        segments = scratch.path(os.path.join(final_dir, 'segments'), 'segments')
+        os.makedirs(segments)
+        with open(os.path.join(segments, 'media00001.ts'), 'w') as f:
+            f.write('segment')
+        scratch.path(os.path.join(final_dir, 'thumbnail.jpg'))  # not written
+        preview = scratch.path(os.path.join(final_dir, 'preview%03d.jpg'))
+        for number in (1, 2, 1000):
+            with open(preview % number, 'w') as f:
+                f.write('frame')
+        with open(scratch.file('pass0-0.log'), 'w') as f:
+            f.write('log')
+
+        self.assertEqual([], os.listdir(final_dir))
+        scratch.commit()
+        scratch.cleanup()
+        self.assertEqual(['output.mp4', 'preview001.jpg', 'preview002.jpg', 'preview1000.jpg', 'segments'],
+                         sorted(os.listdir(final_dir)))
+        self.assertEqual(['media00001.ts'], os.listdir(os.path.join(final_dir, 'segments')))
+        self.assertFalse(os.path.exists(scratch.directory))
+
+    def test_input_stager(self):
+        sources = []
+        for name in ('a', 'b', 'c'):
+            sources.append(os.path.join(self.temp_dir, name + '.mp4'))
+            with open(sources[-1], 'wb') as f:
+                f.write(name.encode('ascii') * 1000)
+
+        stager = InputStager(self.temp_dir, budget=2500)
+        try:
+            self.assertTrue(stager.prefetch(sources[0]))
+            staged_a = stager.stage(sources[0])
+            self.assertNotEqual(sources[0], staged_a)
+            self.assertTrue(staged_a.endswith('.mp4'))
+            with open(staged_a, 'rb') as f:
+                self.assertEqual(b'a' * 1000, f.read())
+            self.assertEqual(staged_a, stager.stage(staged_a))
+
+            staged_b = stager.stage(sources[1])
+            stager.release(staged_b)
+            # b is evicted to make room for c, a is still being used
+            staged_c = stager.stage(sources[2])
+            self.assertTrue(os.path.exists(staged_a))
+            self.assertFalse(os.path.exists(staged_b))
+            # nothing can be evicted anymore
+            self.assertFalse(stager.prefetch(sources[1]))
+            self.assertEqual(sources[1], stager.stage(sources[1]))
+            stager.release(staged_a)
+            stager.release(staged_c)
+        finally:
+            stager.close()
+        self.assertFalse(os.path.exists(stager.directory))
+
+    def test_converter_scratch_dir(self):
+        scratch_dir = os.path.join(self.temp_dir, 'scratch')
+        os.makedirs(scratch_dir)
+        c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH, scratch_dir=scratch_dir)
+        output = os.path.join(self.temp_dir, 'output.mp4')
+        # two-pass progress goes up to 1.5, only the outcome is checked
+        list(c.convert('test1.ogg', output, {
+            'format': 'mp4', 'faststart': True, 'video': {'codec': 'h264', 'bitrate': 500}}, twopass=True))
+        self.assertTrue(os.path.exists(output))
+        self.assertEqual([], os.listdir(scratch_dir))
+
+        preview = os.path.join(self.temp_dir, 'preview%03d.jpg')
+        self.assertTrue(verify_progress(c.convert('test1.ogg', output, {
+            'format': 'mp4', 'video': {'codec': 'h264'}, 'thumbnails': {'path': preview, 'interval': 10}})))
+        self.assertTrue(os.path.exists(preview % 1))
+        self.assertTrue(os.path.exists(preview % 3))
+        self.assertEqual([], os.listdir(scratch_dir))
+
+        failed = os.path.join(self.temp_dir, 'failed.mp4')
+        conv = c.convert('test1.ogg', failed, {
+            'format': 'mp4', 'video': {'codec': 'h264', 'ffmpeg_custom_launch_opts': '-t 1 -not_an_option 1'}})
+        self.assertRaisesSpecific(ffmpeg.FFMpegConvertError, list, conv)
+        self.assertFalse(os.path.exists(failed))
+        self.assertEqual([], os.listdir(scratch_dir))
+
+    def test_converter_pipe_input(self):
+        c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
+        output = os.path.join(self.temp_dir, 'output.mkv')
+        options = {'format': 'mkv', 'video': {'codec': 'h264'}, 'audio': {'codec': 'aac'}}
+        with open('test1.ogg', 'rb') as f:
+            self.assertTrue(verify_progress(c.convert(PipeInput(f, duration=33.0), output, options)))
+        info = c.probe(output)
+        self.assertAlmostEqual(33.0, info.format.duration, places=0)
+
+        with open('test1.ogg', 'rb') as f:
+            self.assertRaisesSpecific(ConverterError, list, c.convert(PipeInput(f), output, options, twopass=True))
+
+    def test_converter_pipe_output(self):
+        c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
+        chunks = []
+        copy = os.path.join(self.temp_dir, 'copy.mkv')
+        self.assertTrue(verify_progress(c.convert('test1.ogg', [PipeOutput(chunks.append), copy], [
+            {'format': 'fmp4', 'video': {'codec': 'h264'}, 'audio': {'codec': 'aac'}},
+            {'format': 'mkv', 'video': {'codec': 'h264'}, 'audio': {'codec': 'aac'}}])))
+        output = os.path.join(self.temp_dir, 'output.mp4')
+        with open(output, 'wb') as f:
+            f.write(b''.join(chunks))
+        info = c.probe(output)
+        self.assertAlmostEqual(33.0, info.format.duration, places=0)
+
+        self.assertRaisesSpecific(ConverterError, list, c.convert('test1.ogg', PipeOutput(chunks.append), {
+            'format': 'mp4', 'video': {'codec': 'h264'}}))
+
+    def test_converter_capabilities(self):
+        c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH, check_capabilities=True,
+                      capabilities_cache_dir=os.path.join(self.temp_dir, 'caps'))
+        self.assertIn('aac', c.capabilities.encoders)
+        self.assertIn('scale', c.capabilities.filters)
+        self.assertIn('mp4', c.capabilities.muxers)
+        self.assertEqual(1, len(os.listdir(os.path.join(self.temp_dir, 'caps'))))
+
+        c.capabilities.encoders.discard('libfdk_aac')
+        self.assertEqual(['-codec:a', 'aac', '-strict', 'experimental', '-vn', '-sn', '-f', 'mp4'],
+                         c.parse_options({'format': 'mp4', 'audio': {'codec': 'libfdk_aac'}}))
+
+        c.capabilities.encoders.discard('libtheora')
+        self.assertRaisesSpecific(ConverterError, c.parse_options, {'format': 'ogg', 'video': {'codec': 'theora'}})
+        # a format the codec knows but the build lacks
+        c.capabilities.pix_fmts.discard('yuv444p')
+        self.assertRaisesSpecific(ConverterError, c.parse_options,
+                                  {'format': 'mp4', 'video': {'codec': 'h264', 'pix_fmt': 'yuv444p'}})
+
+        # served from the cache
+        c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH, check_capabilities=True,
+                      capabilities_cache_dir=os.path.join(self.temp_dir, 'caps'))
+        self.assertIn('libtheora', c.capabilities.encoders)
+
     def test_converter(self):
         c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
 
@@ -448,6 +1061,14 @@ class TestFFMpeg(unittest.TestCase):
 
         self._assert_converted_video_file()
 
+        report = c.last_report
+        self.assertEqual({'probe', 'pass1', 'pass2'}, set(report.usage))
+        self.assertEqual(1, report.usage['pass2'].processes)
+        self.assertGreater(report.usage['pass2'].cpu_time, 0)
+        self.assertGreater(report.usage['pass2'].max_rss, 0)
+        self.assertGreater(report.timings['pass1'], 0)
+        self.assertEqual(os.path.getsize(self.video_file_path), report.outputs[0].size)
+
     def test_converter_vp8_codec(self):
         c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
         conv = c.convert('test1.ogg', self.video_file_path, {
@@ -720,6 +1341,165 @@ class TestFFMpeg(unittest.TestCase):
 
         self.assertTrue(verify_progress(conv))
 
+    def test_branding_spec(self):
+        c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
+        profile = {
+            'format': 'mp4',
+            'video': {
+                'codec': 'h264',
+                'preset': 'ultrafast',
+                'width': 640,
+                'height': 360,
+                'fps': 25,
+            },
+            'audio': {
+                'codec': 'aac',
+                'channels': 2,
+                'samplerate': 44100,
+            }
+        }
+        bumper = os.path.join(self.temp_dir, 'bumper.mp4')
+        self.assertTrue(verify_progress(c.convert('test1.ogg', bumper, profile)))
+
+        options = dict(profile, branding={'intro': bumper, 'outro': bumper, 'logo': 'logo.png', 'logo_width': 64, 'logo_position': 'bottom-right'})
+        self.assertRaisesSpecific(
+            ConverterError, list, c.convert('test1.ogg', self.video_file_path, dict(profile, branding={'logo_width': 64})))
+        self.assertTrue(verify_progress(c.convert('test1.ogg', os.path.join(self.temp_dir, 'branded.mp4'), options)))
+
+        # intro and outro only: bumpers are encoded once and joined with stream copy
+        cache_dir = os.path.join(self.temp_dir, 'bumpers')
+        options = dict(profile, branding={'intro': bumper, 'outro': bumper, 'cache_dir': cache_dir})
+        output = os.path.join(self.temp_dir, 'joined.mp4')
+        for index in range(2):
+            self.assertTrue(verify_progress(c.convert('test1.ogg', output, options)))
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+            self.assertAlmostEqual(3 * c.probe(bumper).format.duration, c.probe(output).format.duration, places=0)
+
+    def test_compose(self):
+        c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
+        self.assertRaisesSpecific(
+            ConverterError, list, c.compose(['test1.ogg'], self.video_file_path, {'format': 'ogg', 'video': {'codec': 'theora'}}))
+        self.assertRaisesSpecific(
+            ConverterError, list, c.compose(['test1.ogg', 'test1.ogg'], self.video_file_path, {'format': 'ogg', 'video': {'codec': 'theora'}},
+                                            layout={'type': 'mosaic'}))
+
+        outputs = [os.path.join(self.temp_dir, 'large.ogg'), os.path.join(self.temp_dir, 'small.ogg')]
+        conv = c.compose(['test1.ogg', 'test1_no_audio.ogg'], outputs, [
+            {'format': 'ogg', 'video': {'codec': 'theora', 'height': 400}, 'audio': {'codec': 'vorbis'}},
+            {'format': 'ogg', 'video': {'codec': 'theora', 'width': 320, 'height': 240, 'mode': 'pad'}, 'audio': {'codec': 'vorbis'}},
+        ], layout={'type': 'side_by_side'})
+        self.assertTrue(verify_progress(conv))
+        info = c.probe(outputs[0])
+        self.assertEqual(1440, info.video.video_width)
+        self.assertEqual('vorbis', info.audio.codec)
+        self.assertEqual(240, c.probe(outputs[1]).video.video_height)
+
+        conv = c.compose(['test1.ogg', 'test1_no_audio.ogg'], self.video_file_path, {
+            'format': 'ogg', 'video': {'codec': 'theora'}, 'audio': {'codec': 'vorbis'}
+        }, layout={'type': 'pip', 'position': 'top-left', 'scale': 0.3})
+        self.assertTrue(verify_progress(conv))
+        self.assertEqual(720, c.probe(self.video_file_path).video.video_width)
+
+    def test_converter_smart_copy(self):
+        c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
+        options = {
+            'format': 'mp4',
+            'video': {'codec': 'h264', 'width': 640, 'height': 360, 'preset': 'ultrafast'},
+            'audio': {'codec': 'aac', 'channels': 2, 'samplerate': 44100}
+        }
+        source = os.path.join(self.temp_dir, 'source.mp4')
+        self.assertTrue(verify_progress(c.convert('test1.ogg', source, options)))
+        self.assertEqual({'video': ('encode', 'requested'), 'audio': ('encode', 'requested')},
+                         c.last_report.outputs[0].streams)
+        self.assertIsNone(c.last_report.outputs[0].pix_fmt_conversion)
+
+        output = os.path.join(self.temp_dir, 'copy.mp4')
+        options['audio']['channels'] = 1
+        self.assertTrue(verify_progress(c.convert(source, output, options, smart_copy=True)))
+        streams = c.last_report.outputs[0].streams
+        self.assertEqual(('copy', 'matches the requested options'), streams['video'])
+        self.assertEqual(('encode', '2 channels is above 1'), streams['audio'])
+        info = c.probe(output)
+        self.assertEqual(640, info.video.video_width)
+        self.assertEqual(1, info.audio.audio_channels)
+
+    def test_converter_draft(self):
+        c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
+        source = os.path.join(self.temp_dir, 'source.avi')
+        self.assertTrue(verify_progress(c.convert('test1.ogg', source, {
+            'format': 'avi', 'video': {'codec': 'divx'}, 'audio': {'codec': 'mp3'}})))
+
+        output = os.path.join(self.temp_dir, 'draft.mp4')
+        self.assertTrue(verify_progress(c.convert(source, output, {
+            'format': 'mp4',
+            'video': {'codec': 'h264', 'width': 320, 'height': 180, 'preset': 'slow'},
+            'audio': {'codec': 'aac'},
+        }, draft=True)))
+        self.assertEqual(['-lowres 1'], c.last_report.shortcuts)
+        self.assertEqual(['preset=ultrafast', 'scaler=fast_bilinear'], c.last_report.outputs[0].shortcuts)
+        self.assertEqual(320, c.probe(output).video.video_width)
+
+        self.assertTrue(verify_progress(c.convert(output, os.path.join(self.temp_dir, 'draft.mkv'), {
+            'format': 'mkv', 'video': {'codec': 'h264'}}, draft=True)))
+        self.assertEqual(['-flags2 +fast', '-skip_loop_filter all'], c.last_report.shortcuts)
+
+    def test_converter_target_speed(self):
+        cache_dir = os.path.join(self.temp_dir, 'calibration')
+        c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH, calibration_cache_dir=cache_dir)
+
+        calibration = PresetCalibration(c.ffmpeg, cache_dir, size=(320, 240))
+        # only the presets needed are measured
+        self.assertEqual('ultrafast', calibration.select(codecs.H264Codec, 100000, 320, 240, 25))
+        self.assertEqual(['ultrafast'], list(calibration.rates['libx264']))
+        rate = calibration.rates['libx264']['ultrafast']
+        calibration.record(codecs.H264Codec, 'ultrafast', 320, 240, 25, 10, 0.001)
+        self.assertGreater(calibration.rates['libx264']['ultrafast'], rate)
+        self.assertEqual(calibration.rates, PresetCalibration(c.ffmpeg, cache_dir, size=(320, 240)).rates)
+
+        output = os.path.join(self.temp_dir, 'output.mp4')
+        self.assertTrue(verify_progress(c.convert('test1.ogg', output, {
+            'format': 'mp4', 'video': {'codec': 'h264', 'width': 320, 'target_speed': 100000}})))
+        self.assertEqual('ultrafast', c.last_report.outputs[0].preset)
+
+    def test_converter_decimate(self):
+        c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
+        self.assertEqual(
+            ['-an', '-codec:v', 'libx264', '-pix_fmt', 'yuv420p', '-vf', 'mpdecimate', '-tune', 'stillimage',
+                '-sn', '-f', 'mp4', '-fps_mode', 'vfr'],
+            c.parse_options({'format': 'mp4', 'video': {'codec': 'h264', 'decimate': True}}))
+        self.assertEqual(
+            ['-an', '-codec:v', 'libx264', '-pix_fmt', 'yuv420p', '-vf', 'mpdecimate', '-tune', 'stillimage',
+                '-sn', '-f', 'avi'],
+            c.parse_options({'format': 'avi', 'video': {'codec': 'h264', 'decimate': True}}))
+
+        # a still picture
+        source = os.path.join(self.temp_dir, 'slides.mp4')
+        self.assertTrue(verify_progress(c.convert('test1.ogg', source, {
+            'format': 'mp4', 'video': {'codec': 'h264', 'ffmpeg_custom_launch_opts': '-ss 5 -t 10',
+                                       'ffmpeg_skin_opts': '-vf select=eq(n\\,0),loop=250:1,setpts=N/25/TB'}})))
+
+        output = os.path.join(self.temp_dir, 'decimated.mkv')
+        self.assertTrue(verify_progress(c.convert(source, output, {
+            'format': 'mkv', 'video': {'codec': 'h264', 'decimate': True}})))
+        source_frames, output_frames = c.last_report.outputs[0].frames
+        self.assertGreater(source_frames, 200)
+        self.assertLess(output_frames, 10)
+
+    def test_converter_autocrop(self):
+        c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
+        self.assertIsNone(c.detect_crop('test1.ogg'))
+
+        letterboxed = os.path.join(self.temp_dir, 'letterboxed.mp4')
+        self.assertTrue(verify_progress(c.convert('test1.ogg', letterboxed, {
+            'format': 'mp4', 'video': {'codec': 'h264', 'width': 720, 'height': 560, 'mode': 'pad'}})))
+        self.assertEqual((720, 400, 0, 80), c.detect_crop(letterboxed, samples=3))
+
+        output = os.path.join(self.temp_dir, 'output.mp4')
+        self.assertTrue(verify_progress(c.convert(letterboxed, output, {
+            'format': 'mp4', 'video': {'codec': 'h264', 'width': 360, 'mode': 'autocrop'}})))
+        info = c.probe(output)
+        self.assertEqual((360, 200), (info.video.video_width, info.video.video_height))
+
     def test_converter_parallelize(self):
         c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
         input_file = 'test1.ogg'
@@ -767,6 +1547,56 @@ class TestFFMpeg(unittest.TestCase):
 
         self.assertTrue(verify_progress(conv))
 
+    def test_converter_thumbnail_outputs(self):
+        c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
+
+        self.assertRaisesSpecific(ConverterError, c.parse_thumbnail_options, [])
+        self.assertRaisesSpecific(
+            ConverterError, c.parse_thumbnail_options, {'path': self.shot_file_path})
+        self.assertRaisesSpecific(
+            ConverterError, c.parse_thumbnail_options, {'path': self.shot_file_path, 'interval': 5})
+
+        outfiles, optlists = c.parse_thumbnail_options({'path': self.shot_file_path, 'timestamps': [10]})
+        self.assertEqual([self.shot_file_path], outfiles)
+        self.assertEqual([[
+            '-filter_complex', '[0:v:0]select=(isnan(prev_pts)+lt(prev_pts*TB\\,10.0))*gte(pts*TB\\,10.0)[thumb0]',
+            '-map', '[thumb0]', '-f', 'image2', '-fps_mode', 'vfr', '-frames:v', '1', '-q:v', '4']], optlists)
+
+        pattern = os.path.join(self.temp_dir, 'preview%03d.jpg')
+        conv = c.convert('test1.ogg', self.video_file_path, {
+            'format': 'ogg',
+            'video': {'codec': 'theora', 'width': 320, 'height': 240},
+            'audio': {'codec': 'vorbis', 'channels': 1, 'bitrate': 32},
+            'thumbnails': [
+                {'path': self.shot_file_path, 'timestamps': [5]},
+                {'path': pattern, 'interval': 10, 'size': '160x120', 'quality': 5},
+            ]
+        })
+
+        self.assertTrue(verify_progress(conv))
+        self.assertTrue(os.path.exists(self.shot_file_path))
+        self.assertTrue(os.path.exists(pattern % 1))
+        self.assertTrue(os.path.exists(pattern % 4))
+
+    def test_concat(self):
+        c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
+        part = os.path.join(self.temp_dir, 'part.mp4')
+        conv = c.convert('test1.ogg', part, {
+            'format': 'mp4',
+            'video': {'codec': 'h264', 'width': 320, 'height': 240, 'fps': 25, 'preset': 'ultrafast'},
+            'audio': {'codec': 'aac', 'channels': 2, 'samplerate': 44100}
+        })
+        self.assertTrue(verify_progress(conv))
+
+        output = os.path.join(self.temp_dir, 'joined.mp4')
+        self.assertRaisesSpecific(ffmpeg.ArgumentError, c.concat, [], output)
+        self.assertRaisesSpecific(ffmpeg.ArgumentError, c.concat, [part, 'test1.ogg'], output)
+
+        part_duration = c.probe(part).format.duration
+        duration = c.concat([part, part, part], output)
+        self.assertAlmostEqual(3 * part_duration, duration, places=0)
+        self.assertAlmostEqual(duration, c.probe(output).format.duration, places=3)
+
     def test_probe_audio_poster(self):
         c = Converter(ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
 